@@ -1,40 +1,93 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
 
+import data_registry as registry
+import model_calendar
+import grid_ops
+import clean_store
 
-emis_BLAZE = Dataset('../../model_data/LPJ-GUESS-BLAZE_SF1_Cfire.nc', 
-                'r', format = 'NETCDF4')
-BA_BLAZE = Dataset('../../model_data/LPJ-GUESS-BLAZE_SF1_BA.nc', 
-                'r', format = 'NETCDF4')            
-grid_BLAZE = Dataset('../../model_data/HalfDegree-gridarea-8950.nc', 
-                    'r', format = 'NETCDF4')
+emis_BLAZE = registry.get_dataset('blaze', 'emis_BLAZE')
+BA_BLAZE = registry.get_dataset('blaze', 'BA_BLAZE')
+grid_BLAZE = registry.get_dataset('blaze', 'grid_BLAZE')
+time_data = registry.get_dataset('blaze', 'time_data')
 
-# LPJ BLAZE has no useful separate time data, must use JSBACH data which matches it.             
-time_data = Dataset('../../model_data/JSBACH_SF1_fFirepft.nc', 
-                'r', format = 'NETCDF4')
+
+#
+# Calendar
+#
+
+def get_calendar(time_data=time_data):
+    """
+    Returns the cached monthly calendar of BLAZE, taken from
+    the JSBACH time axis, which matches it.
+    """
+    return model_calendar.get_calendar(time_data)
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_BLAZE):
+    """
+    Returns the cached cell areas of the BLAZE grid.
+    """
+    return registry.get_static_field(grid_data, "cell_area",
+                                     dtype=grid_ops.get_dtype())
+
+
+#
+# Cleaned Inputs
+#
+
+def _clean_negative(values):
+    # Remove negative values.
+    values = np.array(values)
+    values[values<0.]=0
+    return values
+
+
+def get_burnt_area(BA_data=BA_BLAZE):
+    """
+    Returns the burnt area of BLAZE with negative values removed,
+    cleaned once per file, see clean_store.
+    """
+    return clean_store.get_variable(BA_data, "BA.", _clean_negative)
+
+
+def get_emissions(emis_data=emis_BLAZE):
+    """
+    Returns the emissions of BLAZE with negative values removed,
+    cleaned once per file, see clean_store.
+    """
+    return clean_store.get_variable(emis_data, "Cfire.monthly",
+                                    _clean_negative)
 
 
 #
 # Burnt Area Analysis
 #
 
-def get_grid_burnt_area(year, month_period, BA_data, grid_data, keep_time=False):
-    BA = BA_data["BA."][year*12:year*12+month_period]
+def get_monthly_burnt_area(time, month_period, BA_data, grid_data):
+    BA = get_burnt_area(BA_data)[time:time+month_period]
     BA = np.divide(BA, 100.)
     
-    BA = np.multiply(BA, grid_data["cell_area"])
-    BA = np.array(BA)
-    BA[BA<0.]=0
+    BA = np.multiply(BA, get_cell_area(grid_data))
+    return BA
+
+def get_grid_burnt_area(year, month_period, BA_data, grid_data,
+                        keep_time=False, chunk=None):
+    time = int(year*12)
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return get_monthly_burnt_area(time, month_period, BA_data, grid_data)
+    BA = grid_ops.sum_over_time(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data)
     return BA
     
 def get_global_BA_yearly(year, BA_data, grid_data):
     BA_grid = get_grid_burnt_area(year, 12, BA_data, grid_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -43,34 +96,32 @@ def get_global_BA_yearly(year, BA_data, grid_data):
 #
 
 
+def get_monthly_emissions(time, month_period, emis_data, grid_data, time_data):
+    sec_per_month = get_calendar(time_data).get_sec_per_month(time, month_period)
+    
+    emis = get_emissions(emis_data)[time:time+month_period]
+    emis = np.multiply(emis, get_cell_area(grid_data))
+    emis= np.multiply(emis, 
+                sec_per_month[:, np.newaxis, np.newaxis])
+    return emis
+
 def get_grid_emissions(year, month_period, emis_data, grid_data,
-                     time_data, keep_time=False):
+                     time_data, keep_time=False, chunk=None):
     time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(time_data["time"]):
-            days_per_month.append(time_data["time"][time+i+1]-time_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
     
     # Ignore overflow warning.
     np.seterr(over='ignore')
-    emis = emis_data["Cfire.monthly"][time:time+month_period]
-    emis = np.multiply(emis, grid_data["cell_area"])
-    emis= np.multiply(emis, 
-                sec_per_month[:, np.newaxis, np.newaxis])
-    emis = np.array(emis)
-    emis[emis<0.]=0.
     
     if keep_time:
-        return emis
-    emis = np.sum(emis, axis = 0)
+        return get_monthly_emissions(time, month_period, emis_data,
+                                     grid_data, time_data)
+    emis = grid_ops.sum_over_time(get_monthly_emissions, time, month_period,
+                                  chunk, emis_data, grid_data, time_data)
     return emis
 
 def get_global_emissions_yearly(year, emis_data, grid_data, time_data):
     emis_grid = get_grid_emissions(year, 12, emis_data, grid_data, time_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -78,51 +129,59 @@ def get_global_emissions_yearly(year, emis_data, grid_data, time_data):
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, 
-                            time_data, monthly=False):
-    time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(time_data["time"]):
-            days_per_month.append(time_data["time"][time+i+1]-time_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
-    
+def get_monthly_fire_data(time, month_period, emis_data, BA_data, time_data):
+    """
+    Returns the monthly emissions and burnt area used for the
+    fuel consumption, per unit area.
+    """
+    sec_per_month = get_calendar(time_data).get_sec_per_month(time, month_period)
     
-    # Ignore division by zero warning. Returns NaN.
-    np.seterr(divide='ignore')
-    
-    BA = BA_data["BA."][time:time+month_period]
-    BA = np.array(BA)
-    BA[BA<0.]=0
+    BA = get_burnt_area(BA_data)[time:time+month_period]
     BA = np.divide(BA, 100.)
-    if not monthly:
-        BA = np.sum(BA, axis=0)
-    inv_BA = 1./BA
-    # Remove infinities due to division by 0.
-    inv_BA[inv_BA == np.inf] = 0
     
-    
-    emis = emis_data["Cfire.monthly"][time:time+month_period]
+    emis = get_emissions(emis_data)[time:time+month_period]
     emis = np.multiply(emis, 
                 sec_per_month[:, np.newaxis, np.newaxis])
-    if not monthly:
-        emis = np.sum(emis, axis=0)
-    emis = np.array(emis)
-    emis[emis<0.]=0.    
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or monthly, in which case the
+    monthly fuel consumption is summed.
+    """
+    inv_BA = 1./BA
+    # Remove infinities due to division by 0.
+    inv_BA[inv_BA == np.inf] = 0
     
     fuel_consumption = np.multiply(emis,inv_BA)
     if monthly:
         fuel_consumption = np.nansum(fuel_consumption, axis = 0)
     return fuel_consumption
+
+def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, 
+                            time_data, monthly=False, chunk=None):
+    time = int(year*12)
+    
+    # Ignore division by zero warning. Returns NaN.
+    np.seterr(divide='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_monthly_fire_data(start, count, emis_data,
+                                           BA_data, time_data),
+                    monthly=True), time, month_period, chunk)
+    emis, BA = grid_ops.sum_over_time(get_monthly_fire_data, time,
+                        month_period, chunk, emis_data, BA_data, time_data)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
     
     
 def get_global_mean_FC_yearly(year, emis_data, BA_data, grid_data, time_data):
     time = int(year*12)   
     FC_data = get_grid_fuel_consumption(year,12,emis_data, BA_data, time_data)
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
     
     
@@ -132,3 +191,44 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data, grid_data, time_da
     global_mean_FC = total_emis/total_BA
     return global_mean_FC
 
+
+#
+# Fire Budget
+#
+
+def get_monthly_fire_budget(time, month_period, emis_data, BA_data,
+                            grid_data, time_data):
+    """
+    Returns the monthly emissions and burnt area grids, and the
+    monthly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    sec_per_month = get_calendar(time_data).get_sec_per_month(time, month_period)
+    cell_area = get_cell_area(grid_data)
+    
+    BA = get_burnt_area(BA_data)[time:time+month_period]
+    BA = np.divide(BA, 100.)
+    BA_grid = np.multiply(BA, cell_area)
+    
+    emis = get_emissions(emis_data)[time:time+month_period]
+    emis_grid = np.multiply(emis, cell_area)
+    emis_grid = np.multiply(emis_grid, sec_per_month[:, np.newaxis, np.newaxis])
+    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, month_period, emis_data, BA_data, grid_data,
+                    time_data, keep_time=False, monthly=False, chunk=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    time = int(year*12)
+    
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    return grid_ops.fire_budget(get_monthly_fire_budget,
+                    calc_fuel_consumption, time, month_period, chunk,
+                    (emis_data, BA_data, grid_data, time_data),
+                    keep_time, monthly)
@@ -0,0 +1,182 @@
+"""
+This module stores cleaned copies of the time-varying inputs of
+the models, so that the rules removing their meaningless values
+(fill values, negative values, percentages over 100, ...) are
+applied once per file instead of on every read.
+
+Each model module declares its rules as module-level functions,
+which take a window of a variable as read from the file, can
+modify it in place, and return it cleaned. The first time a
+cleaned variable is used, the whole variable is read window by
+window, cleaned, and written as a memory-mapped .npy file under
+STORE_DIR, together with a boolean .mask.npy file of the values
+which are still missing (masked) after cleaning, if there are
+any. The files are named after a hash of the source file (with
+its size and modification time), the variable and the rule, so
+they are written again whenever the source file changes.
+
+The accessors then slice the stored copy, which is read-only,
+without scanning it or writing to it. Slices are returned in the
+precision of the grids (see grid_ops.set_precision), which leaves
+them as they are for variables stored as float32.
+"""
+
+import os
+
+import numpy as np
+
+import data_registry as registry
+import grid_cache
+import grid_ops
+
+
+STORE_DIR = './cache/clean/'
+
+# Bump when a cleaning rule changes, so that previously stored
+# copies are no longer used.
+CLEAN_VERSION = 1
+
+# Number of time steps read at once when storing a variable.
+INGEST_CHUNK = 24
+
+# Set to False to clean every read instead of storing copies.
+enabled = True
+
+# Cleaned variables already opened, keyed by path, name and rule.
+_variables = {}
+
+
+class CleanVariable(object):
+    """
+    Read-only cleaned variable, which can be sliced like the netCDF
+    variable it comes from. Slices are masked arrays if the variable
+    has missing values, and plain arrays otherwise.
+    """
+    def __init__(self, data, mask=None):
+        self.data = data
+        self.mask = mask
+        self.shape = data.shape
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if self.mask is None:
+            return grid_ops.to_precision(self.data[key])
+        return grid_ops.to_precision(np.ma.masked_array(self.data[key],
+                                                        mask=self.mask[key]))
+
+
+class CleaningReader(object):
+    """
+    Stand-in for a CleanVariable when the store is disabled, which
+    reads each slice from the file and cleans it.
+    """
+    def __init__(self, dataset, name, clean):
+        self.dataset = dataset
+        self.name = name
+        self.clean = clean
+
+    @property
+    def shape(self):
+        return self.dataset[self.name].shape
+
+    def __len__(self):
+        return len(self.dataset[self.name])
+
+    def __getitem__(self, key):
+        return grid_ops.to_precision(self.clean(self.dataset[self.name][key]))
+
+
+def get_variable(dataset, name, clean):
+    """
+    Returns the given variable of the dataset, with a time axis
+    first, cleaned by the function clean, as a CleanVariable. The
+    cleaned copy is written on first use, see the module docstring.
+    """
+    if not enabled:
+        return CleaningReader(dataset, name, clean)
+    path = registry.get_dataset_path(dataset)
+    variable_key = (path, name, clean)
+    if variable_key not in _variables:
+        key = grid_cache.get_key('clean', (CLEAN_VERSION, name,
+                                           get_rule_name(clean)), [path])
+        data_path = _get_file(key)
+        if not os.path.exists(data_path):
+            ingest(dataset, name, clean, key)
+        data = np.load(data_path, mmap_mode='r')
+        mask = None
+        if os.path.exists(_get_file(key, mask=True)):
+            mask = np.load(_get_file(key, mask=True), mmap_mode='r')
+        _variables[variable_key] = CleanVariable(data, mask)
+    return _variables[variable_key]
+
+
+def get_rule_name(clean):
+    """
+    Returns the name identifying the given cleaning rule across runs.
+    """
+    return clean.__module__ + '.' + clean.__name__
+
+
+def ingest(dataset, name, clean, key):
+    """
+    Reads the given variable of the dataset, INGEST_CHUNK time steps
+    at a time, cleans it, and stores it under the given key.
+    """
+    if not os.path.isdir(STORE_DIR):
+        os.makedirs(STORE_DIR)
+    variable = dataset[name]
+    length = len(variable)
+    data_path = _get_file(key)
+    mask_path = _get_file(key, mask=True)
+    if os.path.exists(mask_path):
+        # Left by an interrupted run.
+        os.remove(mask_path)
+    # Write to temporary files first, so that an interrupted run (or
+    # another process storing the same variable) never leaves a
+    # partial copy under the final name.
+    tmp_suffix = '.%d.tmp' % os.getpid()
+    data = mask = None
+    for start in range(0, length, INGEST_CHUNK):
+        window = clean(variable[start:start+INGEST_CHUNK])
+        stop = start + len(window)
+        if data is None:
+            shape = (length,) + np.shape(window)[1:]
+            data = np.lib.format.open_memmap(data_path + tmp_suffix,
+                                mode='w+', dtype=np.result_type(window),
+                                shape=shape)
+        data[start:stop] = np.ma.getdata(window)
+        window_mask = np.ma.getmask(window)
+        if window_mask is not np.ma.nomask and window_mask.any():
+            if mask is None:
+                # New files are filled with zeros, i.e. not missing.
+                mask = np.lib.format.open_memmap(mask_path + tmp_suffix,
+                                    mode='w+', dtype='bool', shape=shape)
+            mask[start:stop] = window_mask
+    if mask is not None:
+        mask.flush()
+        del mask
+        os.rename(mask_path + tmp_suffix, mask_path)
+    data.flush()
+    del data
+    # The data file is renamed last, as it marks the copy complete.
+    os.rename(data_path + tmp_suffix, data_path)
+
+
+def clear():
+    """
+    Deletes all the stored copies.
+    """
+    _variables.clear()
+    if not os.path.isdir(STORE_DIR):
+        return
+    for name in os.listdir(STORE_DIR):
+        if name.endswith('.npy'):
+            os.remove(os.path.join(STORE_DIR, name))
+
+
+def _get_file(key, mask=False):
+    if mask:
+        return os.path.join(STORE_DIR, key + '.mask.npy')
+    return os.path.join(STORE_DIR, key + '.npy')
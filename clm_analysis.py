@@ -1,52 +1,72 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
-                    
-emis_CLM_pft = Dataset('../../model_data/CLM_S1_fFirepft.nc', 
-                'r', format = 'NETCDF4')
-# Total emissions, not per pft, because burnt area per pft is not available.                   
-emis_CLM = Dataset('../../model_data/CLM_S1_CFFIRE.nc', 
-                'r', format = 'NETCDF4')                
-BA_CLM = Dataset('../../model_data/CLM_S1_BAF.nc', 
-                'r', format = 'NETCDF4')                
-grid_backup_CLM = Dataset('../../model_data/CLM-gridcell.nc', 
-                    'r', format = 'NETCDF4')
-grid_CLM = Dataset('../../model_data/CLM-gridarea-nomask.nc', 
-                    'r', format = 'NETCDF4')            
-# CLM has no separate time data, must use JSBACH data which matches CLM.                  
-time_data = Dataset('../../model_data/JSBACH_SF1_fFirepft.nc', 
-                'r', format = 'NETCDF4')
 
+import data_registry as registry
+import model_calendar
+import grid_ops
+
+emis_CLM_pft = registry.get_dataset('clm', 'emis_CLM_pft')
+emis_CLM = registry.get_dataset('clm', 'emis_CLM')
+BA_CLM = registry.get_dataset('clm', 'BA_CLM')
+grid_backup_CLM = registry.get_dataset('clm', 'grid_backup_CLM')
+grid_CLM = registry.get_dataset('clm', 'grid_CLM')
+time_data = registry.get_dataset('clm', 'time_data')
+
+
+#
+# Calendar
+#
+
+def get_calendar(time_data=time_data):
+    """
+    Returns the cached monthly calendar of CLM, taken from
+    the JSBACH time axis, which matches CLM.
+    """
+    return model_calendar.get_calendar(time_data)
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_CLM):
+    """
+    Returns the cached cell areas of the CLM grid.
+    """
+    return registry.get_static_field(grid_data, "cell_area",
+                                     dtype=grid_ops.get_dtype())
 
 
 #
 # Burnt Area Analysis
 #
 
-def get_grid_burnt_area(year, month_period, BA_data, grid_data, time_data, keep_time=False):
-    time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(time_data["time"]):
-            days_per_month.append(time_data["time"][time+i+1]-time_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    days_per_month = np.array(days_per_month)
-    
-    BA = BA_data["BAF"][year*12:year*12+month_period]
+def get_monthly_burnt_area(time, month_period, BA_data, grid_data, time_data):
+    days_per_month = get_calendar(time_data).get_days_per_month(time, month_period)
+    
+    BA = grid_ops.to_precision(BA_data["BAF"][time:time+month_period])
     BA = np.divide(BA,100.)
     BA = np.multiply(BA,days_per_month[:,np.newaxis,np.newaxis])
     
-    BA = np.multiply(BA, grid_data["cell_area"])
+    BA = np.multiply(BA, get_cell_area(grid_data))
+    return BA
+
+def get_grid_burnt_area(year, month_period, BA_data, grid_data, time_data,
+                        keep_time=False, chunk=None, orient=None):
+    time = int(year*12)
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return grid_ops.collect(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data, time_data,
+                                orient=orient)
+    BA = grid_ops.sum_over_time(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data, time_data,
+                                orient=orient)
     return BA
     
 def get_global_BA_yearly(year, BA_data, grid_data, time_data):
     BA_grid = get_grid_burnt_area(year, 12, BA_data, grid_data, time_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -55,30 +75,33 @@ def get_global_BA_yearly(year, BA_data, grid_data, time_data):
 #
 
                    
-def get_grid_emissions(year, month_period, emis_data, grid_data, time_data,keep_time=False):
+def get_monthly_emissions(time, month_period, emis_data, grid_data, time_data):
+    sec_per_month = get_calendar(time_data).get_sec_per_month(time, month_period)
+    
+    emis = grid_ops.to_precision(emis_data["CFFIRE"][time:time+month_period])
+    emis = np.multiply(emis, get_cell_area(grid_data))
+    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
+    return emis
+
+def get_grid_emissions(year, month_period, emis_data, grid_data, time_data,
+                        keep_time=False, chunk=None, orient=None):
     time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(time_data["time"]):
-            days_per_month.append(time_data["time"][time+i+1]-time_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
     
     # Ignore overflow warning.
     np.seterr(over='ignore')
     
-    emis = emis_data["CFFIRE"][time:time+month_period]
-    emis = np.multiply(emis, grid_data["cell_area"])
-    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
     if keep_time:
-        return emis
-    emissions = np.sum(emis, axis = 0)
+        return grid_ops.collect(get_monthly_emissions, time, month_period,
+                                chunk, emis_data, grid_data, time_data,
+                                orient=orient)
+    emissions = grid_ops.sum_over_time(get_monthly_emissions, time,
+                        month_period, chunk, emis_data, grid_data, time_data,
+                        orient=orient)
     return emissions
 
 def get_global_emissions_yearly(year, emis_data, grid_data, time_data):
     emissions_grid = get_grid_emissions(year, 12, emis_data, grid_data, time_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -87,49 +110,63 @@ def get_global_emissions_yearly(year, emis_data, grid_data, time_data):
 #
 
 
-def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, time_data, monthly=False):
-    time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(time_data["time"]):
-            days_per_month.append(time_data["time"][time+i+1]-time_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
-    days_per_month = np.array(days_per_month)
+def get_monthly_fire_data(time, month_period, emis_data, BA_data, time_data):
+    """
+    Returns the monthly emissions and burnt area used for the
+    fuel consumption, per unit area.
+    """
+    calendar = get_calendar(time_data)
+    days_per_month = calendar.get_days_per_month(time, month_period)
+    sec_per_month = calendar.get_sec_per_month(time, month_period)
     
-    # Ignore division by zero warning. Returns inf.
-    np.seterr(divide='ignore')
-    
-    
-    
-    BA = BA_data["BAF"][year*12:year*12+month_period]
+    BA = grid_ops.to_precision(BA_data["BAF"][time:time+month_period])
     BA = np.divide(BA,100.)
     BA = np.multiply(BA,days_per_month[:,np.newaxis,np.newaxis])
     
-    if not monthly:
-        BA = np.sum(BA, axis=0)
+    # Burnt area data per pft is not available, so I use CFFIRE for this calculation.
+    emis = grid_ops.to_precision(emis_data["CFFIRE"][time:time+month_period])
+    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or monthly, in which case the
+    monthly fuel consumption is summed.
+    """
     inv_BA = 1./BA
     # Remove infinities due to division by 0.
     inv_BA[inv_BA == np.inf] = 0
     
-    # Burnt area data per pft is not available, so I use CFFIRE for this calculation.
-    emis = emis_data["CFFIRE"][time:time+month_period]
-    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
-    if not monthly:
-        emis = np.sum(emis, axis=0)
-    
     fuel_consumption = np.multiply(emis, inv_BA)
     if monthly:
         fuel_consumption = np.sum(fuel_consumption, axis = 0)
     return fuel_consumption
 
+def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, time_data,
+                              monthly=False, chunk=None, orient=None):
+    time = int(year*12)
+    
+    # Ignore division by zero warning. Returns inf.
+    np.seterr(divide='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_monthly_fire_data(start, count, emis_data,
+                                           BA_data, time_data),
+                    monthly=True), time, month_period, chunk, orient=orient)
+    emis, BA = grid_ops.sum_over_time(get_monthly_fire_data, time,
+                        month_period, chunk, emis_data, BA_data, time_data,
+                        orient=orient)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
+
     
 def get_global_mean_FC_yearly(year, emis_data, BA_data, grid_data, time_data):
     time = int(year*12)   
     FC_data = get_grid_fuel_consumption(year,12,emis_data, BA_data, time_data) 
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
     
 
@@ -137,5 +174,50 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data, grid_data, time_da
     total_emis = get_global_emissions_yearly(year,emis_data,grid_data,time_data)
     total_BA = get_global_BA_yearly(year,BA_data,grid_data,time_data)
     global_mean_FC = total_emis/total_BA
-    return global_mean_FC    
+    return global_mean_FC
 
+
+#
+# Fire Budget
+#
+
+def get_monthly_fire_budget(time, month_period, emis_data, BA_data,
+                            grid_data, time_data):
+    """
+    Returns the monthly emissions and burnt area grids, and the
+    monthly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    calendar = get_calendar(time_data)
+    days_per_month = calendar.get_days_per_month(time, month_period)
+    sec_per_month = calendar.get_sec_per_month(time, month_period)
+    cell_area = get_cell_area(grid_data)
+    
+    BA = grid_ops.to_precision(BA_data["BAF"][time:time+month_period])
+    BA = np.divide(BA,100.)
+    BA = np.multiply(BA,days_per_month[:,np.newaxis,np.newaxis])
+    BA_grid = np.multiply(BA, cell_area)
+    
+    emis = grid_ops.to_precision(emis_data["CFFIRE"][time:time+month_period])
+    emis_grid = np.multiply(emis, cell_area)
+    emis_grid = np.multiply(emis_grid, sec_per_month[:, np.newaxis, np.newaxis])
+    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, month_period, emis_data, BA_data, grid_data,
+                    time_data, keep_time=False, monthly=False, chunk=None,
+                    orient=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    time = int(year*12)
+    
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    return grid_ops.fire_budget(get_monthly_fire_budget,
+                    calc_fuel_consumption, time, month_period, chunk,
+                    (emis_data, BA_data, grid_data, time_data),
+                    keep_time, monthly, orient=orient)
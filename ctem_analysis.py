@@ -1,44 +1,107 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
-                    
-emis_CTEM = Dataset('../../model_data/CTEM_S1_fFirepft.nc', 
-                'r', format = 'NETCDF4')
-BA_CTEM = Dataset('../../model_data/CTEM_S1_burntArea.nc', 
-                'r', format = 'NETCDF4')                
-grid_CTEM = Dataset('../../model_data/CTEM-gridarea.nc', 
-                    'r', format = 'NETCDF4')
-landCover_CTEM = Dataset('../../model_data/CTEM_S1_landCoverFrac.nc',
-                    'r', format = 'NETCDF4')
-                               
+
+import data_registry as registry
+import model_calendar
+import grid_ops
+import clean_store
+
+emis_CTEM = registry.get_dataset('ctem', 'emis_CTEM')
+BA_CTEM = registry.get_dataset('ctem', 'BA_CTEM')
+grid_CTEM = registry.get_dataset('ctem', 'grid_CTEM')
+landCover_CTEM = registry.get_dataset('ctem', 'landCover_CTEM')
+
+
 #
-# Burnt Area Analysis
+# Calendar
 #
 
-def get_grid_burnt_area(year, month_period, BA_data, grid_data, 
-                        landCover_data, keep_time=False):
-    BA = BA_data["burntArea"][year*12:year*12+month_period, :9]
-    BA = np.array(BA)
-    BA[BA>100]=0
+def get_calendar(data=emis_CTEM):
+    """
+    Returns the cached monthly calendar of CTEM, taken from
+    the time axis of the emissions data.
+    """
+    return model_calendar.get_calendar(data)
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_CTEM):
+    """
+    Returns the cached cell areas of the CTEM grid.
+    """
+    return registry.get_static_field(grid_data, "cell_area",
+                                     dtype=grid_ops.get_dtype())
+
+
+#
+# Cleaned Inputs
+#
+
+def _clean_burnt_area(BA):
+    # Convert from percentage to decimal and eliminate meaningless values.
+    BA = np.ma.getdata(BA)
+    BA[BA>100.]=0
     BA[BA<0.]=0
-    BA = np.divide(BA,100.)
-    landCover = landCover_data["landCoverFrac"][year*12:year*12+month_period]
-    landCover = np.array(landCover)
+    BA /= 100.
+    return BA
+
+
+def _clean_land_cover(landCover):
+    landCover = np.ma.getdata(landCover)
     landCover[landCover>1.]=0
-    BA = np.multiply(BA, landCover)
-    
-    BA = np.multiply(BA, grid_data["cell_area"])
-    BA = np.sum(BA, axis=1)
+    return landCover
+
+
+def get_burnt_area(BA_data=BA_CTEM):
+    """
+    Returns the burnt area fractions of CTEM, as decimals and with
+    meaningless values removed, cleaned once per file, see
+    clean_store.
+    """
+    return clean_store.get_variable(BA_data, "burntArea", _clean_burnt_area)
+
+
+def get_land_cover(landCover_data=landCover_CTEM):
+    """
+    Returns the land cover fractions of CTEM with meaningless values
+    removed, cleaned once per file, see clean_store.
+    """
+    return clean_store.get_variable(landCover_data, "landCoverFrac",
+                                    _clean_land_cover)
+
+
+#
+# Burnt Area Analysis
+#
+
+def get_monthly_burnt_area(time, month_period, BA_data, grid_data,
+                           landCover_data):
+    BA = get_burnt_area(BA_data)[time:time+month_period, :9]
+    landCover = get_land_cover(landCover_data)[time:time+month_period]
+    BA = grid_ops.contract_pfts(BA, landCover, get_cell_area(grid_data))
+    return BA
+
+def get_grid_burnt_area(year, month_period, BA_data, grid_data, 
+                        landCover_data, keep_time=False, chunk=None,
+                        orient=None):
+    time = int(year*12)
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return grid_ops.collect(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data, landCover_data,
+                                orient=orient)
+    BA = grid_ops.sum_over_time(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data, landCover_data,
+                                orient=orient)
     return BA
 
     
 def get_global_BA_yearly(year, BA_data, grid_data, landCover_data):
     BA_grid = get_grid_burnt_area(year, 12, BA_data, grid_data,landCover_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -47,38 +110,38 @@ def get_global_BA_yearly(year, BA_data, grid_data, landCover_data):
 #
 
                 
+def get_monthly_emissions(time, month_period, emis_data, grid_data,
+                          landCover_data):
+    sec_per_month = get_calendar(emis_data).get_sec_per_month(time, month_period)
+    
+    landCover = get_land_cover(landCover_data)[time:time+month_period]
+    emis = emis_data["fFirepft"][time:time+month_period, :9]
+    emis = grid_ops.to_precision(emis)
+    emis = grid_ops.contract_pfts(emis, landCover, get_cell_area(grid_data),
+                                  sec_per_month)
+    emis[emis<0]=0.
+    return emis
+
 def get_grid_emissions(year, month_period, emis_data, grid_data, 
-                    landCover_data, keep_time=False):
+                    landCover_data, keep_time=False, chunk=None, orient=None):
     time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(emis_data["time"]):
-            days_per_month.append(emis_data["time"][time+i+1]-emis_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
     
     # Ignore overflow warning.
     np.seterr(over='ignore')
     
-    landCover = landCover_data["landCoverFrac"][time:time+month_period]
-    landCover = np.array(landCover)
-    landCover[landCover>1.]=0
-    complete_area_data = np.multiply(landCover, grid_data["cell_area"])
-    emis = emis_data["fFirepft"][time:time+month_period, :9]
-    emis = np.multiply(emis, complete_area_data)
-    emis = np.sum(emis, axis = 1)
-    emis = np.multiply(emis,sec_per_month[:, np.newaxis, np.newaxis])
-    emis[emis<0]=0.
     if keep_time:
-        return emis
-    emis = np.sum(emis, axis = 0)
+        return grid_ops.collect(get_monthly_emissions, time, month_period,
+                                chunk, emis_data, grid_data, landCover_data,
+                                orient=orient)
+    emis = grid_ops.sum_over_time(get_monthly_emissions, time, month_period,
+                                  chunk, emis_data, grid_data, landCover_data,
+                                  orient=orient)
     return emis
 
 
 def get_global_emissions_yearly(year, emis_data, grid_data, landCover_data):
     emissions_grid = get_grid_emissions(year, 12, emis_data, grid_data, landCover_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -86,58 +149,66 @@ def get_global_emissions_yearly(year, emis_data, grid_data, landCover_data):
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, 
-                            landCover_data, monthly=False):
-    time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(emis_data["time"]):
-            days_per_month.append(emis_data["time"][time+i+1]-emis_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
+def get_monthly_fire_data(time, month_period, emis_data, BA_data,
+                          landCover_data):
+    """
+    Returns the monthly emissions and burnt area used for the
+    fuel consumption, per unit area and summed over the pfts.
+    """
+    sec_per_month = get_calendar(emis_data).get_sec_per_month(time, month_period)
     
-    # Ignore division by zero warning. Returns inf.
-    np.seterr(divide='ignore')
-    # Ignore overflow warning.
-    np.seterr(over='ignore')
+    landCover = get_land_cover(landCover_data)[time:time+month_period]
     
-    landCover = landCover_data["landCoverFrac"][time:time+month_period]
-    landCover = np.array(landCover)
-    landCover[landCover>1.]=0
-    
-    # Convert from percentage to decimal and eliminate meaningless values.
-    BA = BA_data["burntArea"][year*12:year*12+month_period, :9]
-    BA = np.array(BA)
-    BA[BA>100.]=0
-    BA[BA<0.]=0
-    BA = np.divide(BA,100.)
-
-    BA = np.multiply(BA, landCover)
+    BA = get_burnt_area(BA_data)[time:time+month_period, :9]
 
     # Add up pft dependency.
-    BA=np.sum(BA,axis=1)
-    
-    if not monthly:
-        BA = np.sum(BA,axis=0)
+    BA = grid_ops.contract_pfts(BA, landCover)
     
+    emis = emis_data["fFirepft"][time:time+month_period, :9]
+    emis = grid_ops.to_precision(emis)
+    # Add up pft dependency.
+    emis = grid_ops.contract_pfts(emis, landCover, step_scale=sec_per_month)
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or monthly, in which case the
+    monthly fuel consumption is summed.
+    """
     inv_BA = 1./BA
     # Remove infinities due to division by 0.
     inv_BA[inv_BA == np.inf] = 0.
     
-    emis = emis_data["fFirepft"][time:time+month_period, :9]
-    emis = np.multiply(landCover, emis)
-    # Add up pft dependency.
-    emis = np.sum(emis, axis=1)
-    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
-                
-    if not monthly:
-        emis=np.sum(emis,axis=0)
     emis[emis<0]=0.
     
     fuel_consumption = np.multiply(emis, inv_BA)  
     if monthly:
         fuel_consumption = np.sum(fuel_consumption, axis = 0)
+    return fuel_consumption
+
+def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, 
+                            landCover_data, monthly=False, chunk=None,
+                            orient=None):
+    time = int(year*12)
+    
+    # Ignore division by zero warning. Returns inf.
+    np.seterr(divide='ignore')
+    # Ignore overflow warning.
+    np.seterr(over='ignore')
+    
+    if monthly:
+        fuel_consumption = grid_ops.accumulate(
+                    lambda start, count: calc_fuel_consumption(
+                        *get_monthly_fire_data(start, count, emis_data,
+                                               BA_data, landCover_data),
+                        monthly=True), time, month_period, chunk,
+                        orient=orient)
+    else:
+        emis, BA = grid_ops.sum_over_time(get_monthly_fire_data, time,
+                        month_period, chunk, emis_data, BA_data,
+                        landCover_data, orient=orient)
+        fuel_consumption = calc_fuel_consumption(emis, BA)
     # Removing these values as they seem singularities.
     # Must ask modeller what is wrong.
     fuel_consumption[fuel_consumption>100]=0
@@ -148,7 +219,7 @@ def get_global_mean_FC_yearly(year, emis_data, BA_data, grid_data, landCover_dat
     time = int(year*12)   
     FC_data = get_grid_fuel_consumption(year,12,emis_data, BA_data, landCover_data) 
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
     
     
@@ -158,3 +229,53 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data, grid_data, landCov
     global_mean_FC = total_emis/total_BA
     return global_mean_FC
 
+
+#
+# Fire Budget
+#
+
+def get_monthly_fire_budget(time, month_period, emis_data, BA_data,
+                            grid_data, landCover_data):
+    """
+    Returns the monthly emissions and burnt area grids, and the
+    monthly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    sec_per_month = get_calendar(emis_data).get_sec_per_month(time, month_period)
+    cell_area = get_cell_area(grid_data)
+    
+    landCover = get_land_cover(landCover_data)[time:time+month_period]
+    
+    BA = get_burnt_area(BA_data)[time:time+month_period, :9]
+    # Add up pft dependency, the cell areas do not depend on the pft.
+    BA = grid_ops.contract_pfts(BA, landCover)
+    BA_grid = np.multiply(BA, cell_area)
+    
+    emis = emis_data["fFirepft"][time:time+month_period, :9]
+    emis = grid_ops.to_precision(emis)
+    emis = grid_ops.contract_pfts(emis, landCover, step_scale=sec_per_month)
+    emis_grid = np.multiply(emis, cell_area)
+    emis_grid[emis_grid<0]=0.
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, month_period, emis_data, BA_data, grid_data,
+                    landCover_data, keep_time=False, monthly=False,
+                    chunk=None, orient=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    time = int(year*12)
+    
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    emis, BA, fuel_consumption = grid_ops.fire_budget(
+                    get_monthly_fire_budget, calc_fuel_consumption,
+                    time, month_period, chunk,
+                    (emis_data, BA_data, grid_data, landCover_data),
+                    keep_time, monthly, orient=orient)
+    # Removing these values as they seem singularities.
+    fuel_consumption[fuel_consumption>100]=0
+    return emis, BA, fuel_consumption
@@ -0,0 +1,129 @@
+"""
+This module stores the monthly (or yearly) grids of the models
+as memory-mapped .npy cubes of shape (time, lat, lon), in the
+standard orientation, so that time series can be served as
+zero-copy views instead of being recomputed and held in memory.
+
+The cubes are written by spatial_comparison.export_cubes, and
+read by spatial_comparison.load_var_grid.
+"""
+
+import os
+import json
+
+import numpy as np
+
+import data_registry as registry
+import grid_cache
+
+
+STORE_DIR = './cache/cubes/'
+
+# Models with yearly instead of monthly outputs.
+YEARLY_MODELS = ['mc2', 'globfirm']
+
+# Cubes already opened, keyed by path.
+_cubes = {}
+
+
+def get_steps_per_year(model):
+    """
+    Returns the number of time steps per year of the model.
+    """
+    if model in YEARLY_MODELS:
+        return 1
+    return 12
+
+
+def get_cube_path(model, var):
+    return os.path.join(STORE_DIR, model + '_' + var + '.npy')
+
+
+def create_cube(model, var, year_period, grid_shape):
+    """
+    Creates an empty cube for the given model and variable,
+    covering year_period years, to be filled year by year and
+    then completed with finish_cube. Returns the writable
+    memory-mapped cube.
+    """
+    if not os.path.isdir(STORE_DIR):
+        os.makedirs(STORE_DIR)
+    shape = (year_period*get_steps_per_year(model),) + tuple(grid_shape)
+    path = get_cube_path(model, var)
+    _cubes.pop(path, None)
+    return np.lib.format.open_memmap(path + '.tmp', mode='w+',
+                                     dtype='float64', shape=shape)
+
+
+def finish_cube(model, var, first_year, cube):
+    """
+    Flushes the cube created by create_cube to disk and makes
+    it available for reading. The first year of the cube is in
+    absolute terms, e.g. 1997.
+    """
+    cube.flush()
+    path = get_cube_path(model, var)
+    # Any view of an older cube at this path is out of date.
+    _cubes.pop(path, None)
+    metadata_path = path[:-len('.npy')] + '.json'
+    # The old metadata goes first and the new one comes last, so
+    # that a cube is never read with the metadata of another one,
+    # even if the process dies in between.
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)
+    os.rename(path + '.tmp', path)
+    metadata = {'first_year': first_year,
+                'steps_per_year': get_steps_per_year(model),
+                'sources': _get_sources_key(model)}
+    f = open(metadata_path + '.tmp', 'w')
+    try:
+        json.dump(metadata, f)
+    finally:
+        f.close()
+    os.rename(metadata_path + '.tmp', metadata_path)
+
+
+def get_cube_slice(model, var, year, year_period):
+    """
+    Returns a read-only, memory-mapped view of the stored cube for
+    the given model and variable, for the given year (in absolute
+    terms, e.g. 1997) and year period. Returns None if there is no
+    up to date cube covering the whole period.
+    """
+    path = get_cube_path(model, var)
+    metadata_path = path[:-len('.npy')] + '.json'
+    if not (os.path.exists(path) and os.path.exists(metadata_path)):
+        return None
+    f = open(metadata_path)
+    try:
+        metadata = json.load(f)
+    finally:
+        f.close()
+    if metadata['sources'] != _get_sources_key(model):
+        return None
+    if path not in _cubes:
+        _cubes[path] = np.load(path, mmap_mode='r')
+    cube = _cubes[path]
+    steps = metadata['steps_per_year']
+    start = (year - metadata['first_year'])*steps
+    stop = start + year_period*steps
+    if start < 0 or stop > len(cube):
+        return None
+    return cube[start:stop]
+
+
+def remove_cube(model, var):
+    """
+    Deletes the stored cube for the given model and variable.
+    """
+    path = get_cube_path(model, var)
+    _cubes.pop(path, None)
+    for old_path in (path, path[:-len('.npy')] + '.json'):
+        if os.path.exists(old_path):
+            os.remove(old_path)
+
+
+def _get_sources_key(model):
+    # Changes whenever one of the model's source files changes.
+    return grid_cache.get_key('cube', (model,),
+                              registry.get_model_paths(model))
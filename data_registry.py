@@ -0,0 +1,332 @@
+"""
+This module is the registry of all the netCDF files used by
+the model analysis modules.
+
+The files are not opened when a model module is imported,
+but only the first time one of their variables is accessed,
+so a single model figure (or a worker process) only touches
+the files it actually needs.
+"""
+
+import os
+import numpy as np
+from netCDF4 import Dataset
+
+
+DATA_DIR = '../../model_data/'
+
+# Maximum number of files kept open at the same time. Once it is
+# reached, the least recently used lazy datasets are closed before
+# another file is opened, and are reopened when accessed again.
+MAX_OPEN_FILES = 32
+
+# File names of each model's inputs, under the names used in
+# the corresponding model module.
+MODEL_FILES = {
+    'gfed': {
+        # Total emissions, not per pft, because burnt area per pft
+        # is not available.
+        'data_GFED': 'GFED_DATA_1997-2013.nc',
+        'grid_GFED': 'GFED_grid.nc',
+    },
+    'jsbach': {
+        'emis_JSBACH': 'JSBACH_SF1_fFirepft.nc',
+        'BA_JSBACH': 'JSBACH_SF1burntArea.nc',
+        'grid_JSBACH': 'JSBACH_grid.nc',
+    },
+    'clm': {
+        'emis_CLM_pft': 'CLM_S1_fFirepft.nc',
+        # Total emissions, not per pft, because burnt area per pft
+        # is not available.
+        'emis_CLM': 'CLM_S1_CFFIRE.nc',
+        'BA_CLM': 'CLM_S1_BAF.nc',
+        'grid_backup_CLM': 'CLM-gridcell.nc',
+        'grid_CLM': 'CLM-gridarea-nomask.nc',
+        # CLM has no separate time data, must use JSBACH data
+        # which matches CLM.
+        'time_data': 'JSBACH_SF1_fFirepft.nc',
+    },
+    'ctem': {
+        'emis_CTEM': 'CTEM_S1_fFirepft.nc',
+        'BA_CTEM': 'CTEM_S1_burntArea.nc',
+        'grid_CTEM': 'CTEM-gridarea.nc',
+        'landCover_CTEM': 'CTEM_S1_landCoverFrac.nc',
+    },
+    'blaze': {
+        'emis_BLAZE': 'LPJ-GUESS-BLAZE_SF1_Cfire.nc',
+        'BA_BLAZE': 'LPJ-GUESS-BLAZE_SF1_BA.nc',
+        'grid_BLAZE': 'HalfDegree-gridarea-8950.nc',
+        # LPJ BLAZE has no useful separate time data, must use
+        # JSBACH data which matches it.
+        'time_data': 'JSBACH_SF1_fFirepft.nc',
+    },
+    'orchidee': {
+        'emis_ORCHIDEE': 'ORCHIDEE_SF1_fFirepft.nc',
+        'BA_ORCHIDEE': 'ORCHIDEE_SF1_burntArea.nc',
+        'grid_ORCHIDEE': 'HalfDegree-gridarea-8975-inverted.nc',
+        'landCover_ORCHIDEE': 'ORCHIDEE_SF1_landCoverFrac.nc',
+        # ORCHIDEE has no useful separate time data, must use
+        # JSBACH data which matches it.
+        'time_data': 'JSBACH_SF1_fFirepft.nc',
+    },
+    'inferno': {
+        'emis_INFERNO': 'Inferno_S1_fFirepft.nc',
+        'BA_INFERNO': 'Inferno_S1_burntArea.nc',
+        'grid_INFERNO': 'Inferno_grid.nc',
+        'landmask_INFERNO': 'CRU-NCEP-LandMask.nc',
+        'landCover_INFERNO': 'Inferno_S1_LandCoverFrac.nc',
+    },
+    'spitfire': {
+        'emis_SPITFIRE': 'LPJ-GUESS-SPITFIRE_SF1_fFirepft.nc',
+        'BA_SPITFIRE': 'LPJ-GUESS-SPITFIRE_SF1_burntArea.nc',
+        'grid_SPITFIRE': 'HalfDegree-gridarea-8975.nc',
+    },
+    'mc2': {
+        'emis_MC2': 'MC2_GlobalFire_Cfire.nc',
+        'BA_MC2': 'MC2_GlobalFire_BA.nc',
+        'grid_MC2': 'HalfDegree-gridarea-8975.nc',
+    },
+    'globfirm': {
+        'emis_GLOBFIRM': 'LPJ-GUESS-globfirm_SF1_Cfire.nc',
+        'BA_GLOBFIRM': 'LPJ-GUESS-globfirm_SF1_burntArea.nc',
+        'grid_GLOBFIRM': 'HalfDegree-gridarea-8975.nc',
+    },
+}
+
+
+class HandlePool(object):
+    """
+    Pool of open netCDF files, keyed by path, so that a file used
+    by several models (e.g. the JSBACH fFirepft file, which also
+    provides the time axis of CLM, BLAZE and ORCHIDEE) is only
+    opened once per process.
+
+    Handles are reference counted. When a handle is no longer
+    referenced it is kept open for reuse, and the least recently
+    used idle handles are closed once more than max_open files
+    are open.
+    """
+    def __init__(self, max_open=MAX_OPEN_FILES):
+        self.max_open = max_open
+        self._handles = {}
+        self._refs = {}
+        # Unreferenced paths, least recently used first.
+        self._idle = []
+
+    def acquire(self, path):
+        if path in self._handles:
+            if path in self._idle:
+                self._idle.remove(path)
+        else:
+            self._trim(self.max_open-1)
+            self._handles[path] = Dataset(path, 'r', format = 'NETCDF4')
+            self._refs[path] = 0
+        self._refs[path] += 1
+        return self._handles[path]
+
+    def release(self, path):
+        self._refs[path] -= 1
+        if self._refs[path] == 0:
+            self._idle.append(path)
+            self._trim(self.max_open)
+
+    def set_max_open(self, max_open):
+        self.max_open = max_open
+        self._trim(max_open)
+
+    def close_idle(self):
+        self._trim(0)
+
+    def ref_count(self, path):
+        return self._refs.get(path, 0)
+
+    def is_open(self, path):
+        return path in self._handles
+
+    def no_open(self):
+        return len(self._handles)
+
+    def no_in_use(self):
+        return len(self._handles) - len(self._idle)
+
+    def _trim(self, limit):
+        # Close idle handles until at most limit files are open.
+        while len(self._handles) > limit and self._idle:
+            path = self._idle.pop(0)
+            self._handles.pop(path).close()
+            del self._refs[path]
+
+
+pool = HandlePool()
+
+# Lazy datasets already handed out, keyed by model and name.
+_datasets = {}
+
+# Lazy datasets currently open, least recently used first.
+_open_datasets = []
+
+# Time axes already read, keyed by path.
+_time_axes = {}
+
+# Static fields already read, keyed by path, name, cleaning function
+# and type.
+_static_fields = {}
+
+
+class LazyDataset(object):
+    """
+    Stand-in for a read-only netCDF4 Dataset, which is opened
+    the first time one of its variables or attributes is
+    accessed. Can be indexed like a Dataset, e.g. data["time"].
+
+    The file itself is taken from the shared handle pool, and
+    each LazyDataset holds one reference to it while open. When
+    another file has to be opened and MAX_OPEN_FILES are already
+    open, the least recently used LazyDatasets are closed, so a
+    variable taken from a dataset (e.g. data["time"]) should be
+    read before other files are accessed.
+
+    Only the path is pickled, so the datasets can be handed to
+    worker processes, which then open the file on their own.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._dataset = None
+
+    def open(self):
+        if self._dataset is None:
+            if not pool.is_open(self.path):
+                _close_least_recent(pool.max_open-1)
+            self._dataset = pool.acquire(self.path)
+        else:
+            _open_datasets.remove(self)
+        _open_datasets.append(self)
+        return self._dataset
+
+    def close(self):
+        if self._dataset is not None:
+            self._dataset = None
+            _open_datasets.remove(self)
+            pool.release(self.path)
+
+    def is_open(self):
+        return self._dataset is not None
+
+    def __getitem__(self, key):
+        return self.open()[key]
+
+    def __getattr__(self, name):
+        # Private names are never delegated, to avoid opening the
+        # file (or recursing) during copying and pickling.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.open(), name)
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._dataset = None
+
+    def __repr__(self):
+        status = 'open' if self.is_open() else 'not opened'
+        return 'LazyDataset(%r, %s)' % (self.path, status)
+
+
+def _close_least_recent(limit):
+    # Closes the least recently used lazy datasets until at most
+    # limit files are in use. The pool closes the handles they
+    # release once they are no longer needed.
+    while pool.no_in_use() > limit and _open_datasets:
+        _open_datasets[0].close()
+
+
+def get_path(model, name):
+    """
+    Returns the path of the file registered for the given
+    model under the given name, e.g. ('clm', 'emis_CLM').
+    """
+    return os.path.join(DATA_DIR, MODEL_FILES[model][name])
+
+
+def get_model_paths(model):
+    """
+    Returns the sorted list of the paths of all the files
+    used by the given model.
+    """
+    return sorted(set(get_path(model, name)
+                        for name in MODEL_FILES[model]))
+
+
+def get_dataset(model, name):
+    """
+    Returns the lazily opened dataset registered for the given
+    model under the given name, e.g. ('clm', 'emis_CLM').
+    """
+    if (model, name) not in _datasets:
+        _datasets[(model, name)] = LazyDataset(get_path(model, name))
+    return _datasets[(model, name)]
+
+
+def get_time_axis(time_data):
+    """
+    Returns the time variable of the given dataset as an array.
+    It is only read once per file, and shared by all the models
+    using that file as their time axis.
+    """
+    path = get_dataset_path(time_data)
+    if path not in _time_axes:
+        _time_axes[path] = np.array(time_data["time"][:])
+    return _time_axes[path]
+
+
+def get_static_field(dataset, name, clean=None, dtype=None):
+    """
+    Returns the given variable of the dataset as a contiguous,
+    read-only array, for fields which are constant in time such
+    as cell areas and land masks. The variable is only read from
+    disk once per file.
+
+    Argument clean can be a function which takes a writable copy
+    of the field and removes meaningless values in place. It is
+    applied only once, and the cleaned field is cached.
+
+    If dtype is given, the cleaned field is converted to that type
+    (e.g. grid_ops.get_dtype()).
+    """
+    key = (get_dataset_path(dataset), name, clean, dtype)
+    if key not in _static_fields:
+        field = np.array(dataset[name])
+        if clean is not None:
+            clean(field)
+        field = np.ascontiguousarray(field, dtype=dtype)
+        field.setflags(write=False)
+        _static_fields[key] = field
+    return _static_fields[key]
+
+
+def set_max_open_files(max_open):
+    """
+    Sets the maximum number of files kept open at the same time,
+    closing the least recently used files if necessary.
+    """
+    pool.set_max_open(max_open)
+    _close_least_recent(max_open)
+
+
+def close_all():
+    """
+    Closes all the files opened so far. They will be reopened
+    if accessed again.
+    """
+    for dataset in list(_open_datasets):
+        dataset.close()
+    pool.close_idle()
+
+
+def get_dataset_path(dataset):
+    # Works for both LazyDatasets and plain netCDF4 Datasets.
+    if isinstance(dataset, LazyDataset):
+        return dataset.path
+    return dataset.filepath()
@@ -6,6 +6,16 @@ import matplotlib.pyplot as plt
 
 import spatial_comparison as spt
 
+# Names of the boxed regions of the spatial_comparison module,
+# with region 0 as global.
+REGION_NAMES = ['Global','BONA','TENA','EQCSA','SOMA','NOEU',
+                'MEME','EQAF','SOAF','BOAS','CEAS','EQAS','AUST']
+
+# Number of months of model output read at a time when summing
+# the fuel consumption over the 43 years compared with the field
+# observations, to keep the memory use bounded.
+CHUNK_MONTHS = 24
+
 
 #FIELD OBSERVATIONS DATA
 observ_latlon = [[18.35,-95.05],[36,-79.1],[-33.93,115.46],
@@ -69,6 +79,62 @@ observ_year = [1980,1983,1983,1984,1986,1989,1989,1990,1990,1990,
 'N/A','N/A','N/A','N/A','N/A']
 
 
+# Site indices already found, keyed by model.
+_site_indices = {}
+
+# KD-trees of irregular grids already built, keyed by grid.
+_trees = {}
+
+
+def is_regular(axis):
+    """
+    Returns True if the given 1-D array of coordinates is
+    evenly spaced.
+    """
+    axis = np.asarray(axis, dtype='float64')
+    if len(axis) < 2:
+        return False
+    spacing = np.diff(axis)
+    return np.allclose(spacing, spacing[0])
+
+
+def locate_regular(axis, values):
+    """
+    Returns the indices of the nearest coordinates of the given
+    evenly spaced axis to each of the given values, by index
+    arithmetic.
+    """
+    axis = np.asarray(axis, dtype='float64')
+    spacing = (axis[-1]-axis[0])/(len(axis)-1)
+    indices = np.rint((np.asarray(values)-axis[0])/spacing).astype('int')
+    return np.clip(indices, 0, len(axis)-1)
+
+
+def locate_sites(lons, lats, sites):
+    """
+    Returns the latitude and longitude indices of the grid cells
+    nearest to the given sites, as [lat, lon] pairs, for the grid
+    given by the 1-D arrays lons and lats.
+    
+    On a regular grid the indices are found directly. Otherwise
+    the cells are searched with a KD-tree, only built once for
+    each grid.
+    """
+    sites = np.asarray(sites, dtype='float64')
+    if is_regular(lats) and is_regular(lons):
+        lat_ind = locate_regular(lats, sites[:,0])
+        lon_ind = locate_regular(lons, sites[:,1])
+        return lat_ind, lon_ind
+    key = (np.asarray(lats).tobytes(), np.asarray(lons).tobytes())
+    if key not in _trees:
+        lat_grid, lon_grid = np.meshgrid(lats, lons, indexing='ij')
+        _trees[key] = spatial.cKDTree(np.column_stack((lat_grid.ravel(),
+                                                      lon_grid.ravel())))
+    indices = _trees[key].query(sites)[1]
+    lat_ind, lon_ind = np.unravel_index(indices, (len(lats), len(lons)))
+    return lat_ind, lon_ind
+
+
 def find_indices(model):
     """
     For the given model, returns the indices which
@@ -76,20 +142,43 @@ def find_indices(model):
     in the order given in the obeserv_FC list. Also returns
     the shape of the model, used to create a grid of the
     observations.
+    
+    The indices are only found once for each model.
+    """
+    if model not in _site_indices:
+        lons_list, lats_list = spt.get_lons_lats(model)
+        lat_ind, lon_ind = locate_sites(lons_list, lats_list, observ_latlon)
+        model_shape = (len(lats_list), len(lons_list))
+        model_indices = [(lat,lon) for lat,lon 
+                            in zip(lat_ind,lon_ind)]
+        _site_indices[model] = (model_indices, model_shape)
+    return _site_indices[model]
+
+# Averaged observations already computed, keyed by model.
+_observ_points = {}
+
+
+def get_observ_points(model):
     """
-    lons_list, lats_list = spt.get_lons_lats(model)
-    lats, lons = np.meshgrid(lats_list,lons_list)
-    latlon_data = zip(lats.ravel(), lons.ravel())
-    model_grid = spatial.KDTree(latlon_data)
-    query = model_grid.query(observ_latlon)
+    For the given model, returns the sparse form of the grid
+    of field observations, as (indices, values, counts): the
+    flat indices of the grid cells with observations, in
+    increasing order, the mean of the observations in each
+    of these cells, and the number of observations in it.
     
-    indices = query[1]
-    model_shape = (len(lats_list), len(lons_list))
-    lat_ind=np.mod(indices,len(lats_list))
-    lon_ind= np.divide(indices,len(lats_list))
-    model_indices = [(lat,lon) for lat,lon 
-                        in zip(lat_ind,lon_ind)]
-    return model_indices, model_shape
+    Only computed once for each model.
+    """
+    if model not in _observ_points:
+        indices, shape = find_indices(model)
+        lat_ind, lon_ind = zip(*indices)
+        flat_indices = np.ravel_multi_index((lat_ind, lon_ind), shape)
+        cells, inverse = np.unique(flat_indices, return_inverse=True)
+        # Scatter-add the observations and their count in each cell.
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=observ_FC)
+        _observ_points[model] = (cells, np.divide(sums, counts), counts)
+    return _observ_points[model]
+
 
 def get_observ_grid(model):
     """
@@ -102,21 +191,130 @@ def get_observ_grid(model):
     this is entirely correct for the sake of comparison
     it is a reasonable way to go about it.
     """
-    indices, shape = find_indices(model)
-    grid = np.zeros(shape,dtype=object)
-    for i in range(len(indices)):
-        index = indices[i]
-        value = observ_FC[i]
-        if grid[index] == 0:
-            grid[index] = [value]
-        else:
-            grid[index].append(value)
-    for index,FC_list in np.ndenumerate(grid):
-        grid[index] = np.mean(FC_list)
-    grid = grid.astype('float64')
+    cells, values, counts = get_observ_points(model)
+    shape = find_indices(model)[1]
+    grid = np.zeros(shape)
+    grid.flat[cells] = values
     return grid
     
 
+# Model outputs of the model being compared, keyed by name. Only one
+# model is kept at a time, see get_model_cached.
+_model_cache = {}
+
+
+def get_model_cached(model, name, compute):
+    """
+    Returns the value stored under the given name for the given
+    model, or computes it with the function compute (which takes
+    no arguments) and stores it.
+    
+    Only the values of one model are kept: asking for another
+    model releases those of the previous one, so comparing the
+    models one after the other never holds more than one model's
+    grids in memory.
+    """
+    if _model_cache.get('model') != model:
+        clear_model_cache()
+        _model_cache['model'] = model
+    if name not in _model_cache:
+        _model_cache[name] = compute()
+    return _model_cache[name]
+
+
+def clear_model_cache():
+    """
+    Releases the model outputs kept by get_model_cached.
+    """
+    _model_cache.clear()
+
+
+def get_point_deviations(model):
+    """
+    For the given model, returns the flat indices of the grid
+    cells with field observations, as given by get_observ_points,
+    and the relative deviations (in %) of the model's fuel
+    consumption from the observations in these cells. Cells where
+    the model is masked, or the observations are 0, are left out.
+    
+    The model is only evaluated at these cells, see
+    spatial_comparison.load_var_points, once per model, see
+    get_model_cached.
+    """
+    cells, observ_vals, counts = get_observ_points(model)
+    model_vals = get_model_cached(model, 'FC_points',
+                    lambda: spt.load_var_points(1970, 43, model, cells, 'FC',
+                                                chunk_months=CHUNK_MONTHS))
+    kept = ~np.ma.getmaskarray(model_vals) & (observ_vals != 0)
+    cells = cells[kept]
+    observ_vals = observ_vals[kept]
+    model_vals = np.ma.getdata(model_vals)[kept]
+    diff_vals = np.multiply(np.divide(model_vals-observ_vals, observ_vals),
+                            100)
+    return cells, diff_vals
+
+
+def get_region_stats(labels, values, no_regions=13):
+    """
+    Returns the number, mean and standard error of the given
+    values in each region, from region 0 (all values) up to
+    no_regions-1, given the region label of each value. Empty
+    regions have a NaN mean and standard error.
+    """
+    labels = np.asarray(labels)
+    values = np.asarray(values, dtype='float64')
+    counts = np.bincount(labels, minlength=no_regions)[:no_regions]
+    sums = np.bincount(labels, weights=values,
+                       minlength=no_regions)[:no_regions]
+    counts[0] = len(values)
+    sums[0] = np.sum(values)
+    means = np.divide(sums, counts)
+    # Population standard deviation, as np.std, from the squared
+    # deviations from the mean of each value's region.
+    sq_devs = np.square(values - means[labels])
+    sq_sums = np.bincount(labels, weights=sq_devs,
+                          minlength=no_regions)[:no_regions]
+    sq_sums[0] = np.sum(np.square(values - means[0]))
+    stderrs = np.divide(np.sqrt(np.divide(sq_sums, counts)), np.sqrt(counts))
+    return counts, means, stderrs
+
+
+def compare_observations(model):
+    """
+    For the given model, returns a table of the mean relative
+    deviation of the model from the field observations in each
+    region, with its associated statistical error, for all the
+    regions at once. Region 0 is global, and regions 1 to 12 are
+    the boxed regions of the spatial_comparison module.
+    
+    The table is a record array with one row per region, and the
+    fields region, name, no_obs, mean_dev and stderr_dev. It is
+    only computed once per model, see get_model_cached.
+    """
+    return get_model_cached(model, 'table',
+                            lambda: calc_observation_table(model))
+
+
+def calc_observation_table(model):
+    """
+    Computes the table returned by compare_observations.
+    """
+    # Ignore division by zero warnings for empty regions.
+    np.seterr(divide='ignore', invalid='ignore')
+    cells, diff_vals = get_point_deviations(model)
+    labels = np.ravel(spt.generate_regions(model))[cells]
+    # Cells where the model matches exactly are left out, as in
+    # the grid of deviations, where they are 0.
+    compared = diff_vals != 0
+    counts, means, stderrs = get_region_stats(labels[compared],
+                                              diff_vals[compared],
+                                              len(REGION_NAMES))
+    return np.rec.fromarrays([np.arange(len(REGION_NAMES)), REGION_NAMES,
+                              counts, means, stderrs],
+                        names=['region', 'name', 'no_obs', 'mean_dev',
+                               'stderr_dev'])
+
+
 def compare_points(model, region=0):
     """
     Creates a grid of the relative differences between
@@ -125,18 +323,14 @@ def compare_points(model, region=0):
     comparison. For more details on the regions, check
     spatial_comparison module. 
     """
-    observ_grid = get_observ_grid(model)
-    observ_grid = spt.get_regional_var_grid(1970,43,
-                                    region,model,'FC',
-                                    grid = observ_grid)
-    model_grid = spt.get_regional_var_grid(1970,43,
-                                    region,model,'FC')
-                                    
-    diff_grid = model_grid-observ_grid
-    # Avoid division by 0.
-    observ_grid[observ_grid==0]=np.inf
-    diff_grid = np.divide(diff_grid,observ_grid)
-    diff_grid = np.multiply(diff_grid, 100)
+    cells, diff_vals = get_point_deviations(model)
+    shape = find_indices(model)[1]
+    if region != 0:
+        labels = np.ravel(spt.generate_regions(model))[cells]
+        cells = cells[labels == region]
+        diff_vals = diff_vals[labels == region]
+    diff_grid = np.zeros(shape)
+    diff_grid.flat[cells] = diff_vals
     return diff_grid
 
 
@@ -151,11 +345,10 @@ def calc_mean_dev_points(model, region=0, no_vals=False):
     number of observations in the given region. Used in
     plots.
     """
-    diff_grid = compare_points(model, region)
-    diff_vals = diff_grid[diff_grid!=0]
-    mean_dev = np.mean(diff_vals)
-    no_obs = len(diff_vals)
-    stderr_dev = np.std(diff_vals)/np.sqrt(no_obs)
+    row = compare_observations(model)[region]
+    mean_dev = row['mean_dev']
+    no_obs = row['no_obs']
+    stderr_dev = row['stderr_dev']
     if no_vals:
         return (mean_dev, stderr_dev), no_obs
     else:
@@ -173,15 +366,18 @@ def calc_mean_dev_total(model, region=0):
     This method is not preferred, as the field observations
     are extremely sparse compared to the model outputs. 
     """
-    observ_grid = get_observ_grid(model)
-    observ_grid = spt.get_regional_var_grid(1970,43,
-                                    region,model,'FC',
-                                    grid = observ_grid)
-    model_grid = spt.get_regional_var_grid(1970,43,
-                                    region,model,'FC')
+    cells, observ_vals, counts = get_observ_points(model)
+    model_grid = get_model_cached(model, 'FC_grid',
+                    lambda: spt.load_var_grid(1970,43,model,'FC',
+                                              chunk_months=CHUNK_MONTHS))
+    region_data = spt.generate_regions(model)
+    if region != 0:
+        observ_vals = observ_vals[np.ravel(region_data)[cells] == region]
+        model_vals = model_grid[(region_data == region) & (model_grid > 0)]
+    else:
+        model_vals = model_grid[model_grid > 0]
     
-    observ_vals = observ_grid[observ_grid>0]
-    model_vals = model_grid[model_grid>0]
+    observ_vals = observ_vals[observ_vals>0]
     no_obs = len(observ_vals)
     no_model = len(model_vals)
     observ_mean = np.mean(observ_vals)
@@ -210,8 +406,7 @@ def plot_bar_chart(model='all', save=False):
                 'blaze', 'orchidee', 'inferno','spitfire',
                  'mc2','globfirm']
     colour_map=iter(plt.cm.Dark2(np.linspace(0,1,len(model_list))))
-    region_names = ['Global','BONA','TENA','EQCSA','SOMA','NOEU',
-                   'MEME','EQAF','SOAF','BOAS','CEAS','EQAS','AUST']
+    region_names = REGION_NAMES
     no_obs_list = []
     
     fig, ax = plt.subplots(figsize=(14,10))
@@ -235,25 +430,20 @@ def plot_bar_chart(model='all', save=False):
             colour = 'k'          
         else:
             colour = next(colour_map)
-        means = []
-        stderrs = []
-        for j in range(13):
-            if i==0:
-                dev, no_obs = calc_mean_dev_points(model_name,
-                                       region=j, no_vals=True)
-                no_obs_list.append(no_obs)
-            else:
-                dev = calc_mean_dev_points(model_name,
-                                            region=j)
-            
-            means.append(dev[0])
-            stderrs.append(dev[1])
+        # All the regions are compared from a single evaluation
+        # of the model, released when moving to the next model.
+        table = compare_observations(model_name)
+        if i==0:
+            no_obs_list = list(table['no_obs'])
+        means = list(table['mean_dev'])
+        stderrs = list(table['stderr_dev'])
         
         ax.bar(ind+i*bar_width,means,bar_width,
              color=colour,yerr=stderrs, 
              error_kw=error_config,label=model_name.upper())
         
         highest.append(np.nanmax(means))
+    clear_model_cache()
     
     
     xticks = [region + '\n' + str(no_obs) for region,no_obs in
@@ -167,8 +167,11 @@ def generate_standard_deviation_map():
     
     # CTEM resolution. 
     for var in var_list:
-        fig = spatial.plot_std_map(1997,16,var,ref_grid='ctem',
-                                    save=True)
+        # Fuel consumption is per unit of burnt area, so it is not
+        # remapped conservatively.
+        method = 'nearest' if var == 'FC' else 'conservative'
+        fig = spatial.plot_std_map(1997,16,var,method=method,
+                                    ref_grid='ctem', save=True)
         fig.savefig('./figures/spatial_comparison/'+
               get_var_name(var)+'_standard_dev_map_LORES.png')
         plt.close(fig)
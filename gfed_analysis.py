@@ -1,34 +1,57 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
 
-# Total emissions, not per pft, because burnt area per pft is not available.                   
-data_GFED = Dataset('../../model_data/GFED_DATA_1997-2013.nc', 
-                'r', format = 'NETCDF4')            
-grid_GFED = Dataset('../../model_data/GFED_grid.nc', 
-                    'r', format = 'NETCDF4')                    
+import data_registry as registry
+import grid_ops
+
+data_GFED = registry.get_dataset('gfed', 'data_GFED')
+grid_GFED = registry.get_dataset('gfed', 'grid_GFED')
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_GFED):
+    """
+    Returns the cached cell areas of the GFED grid.
+    """
+    return registry.get_static_field(grid_data, "grid_cell_area",
+                                     dtype=grid_ops.get_dtype())
+
+
+def get_basis_regions(grid_data=grid_GFED):
+    """
+    Returns the cached GFED basis regions.
+    """
+    return registry.get_static_field(grid_data, "basis_regions")
                 
 
 #
 # Burnt Area Analysis
 #
 
-def get_grid_burnt_area(year, month_period, data, grid_data, keep_time=False):
-    time = int(year*12)
-    BA = np.array(data["BA"][time:time+month_period])
+def get_monthly_burnt_area(time, month_period, data, grid_data):
+    BA = grid_ops.to_precision(np.array(data["BA"][time:time+month_period]))
     # Convert to fractional.
     BA = np.divide(BA,100.)
     
-    BA = np.multiply(BA, grid_data["grid_cell_area"])
+    BA = np.multiply(BA, get_cell_area(grid_data))
+    return BA
+
+def get_grid_burnt_area(year, month_period, data, grid_data,
+                        keep_time=False, chunk=None):
+    time = int(year*12)
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return get_monthly_burnt_area(time, month_period, data, grid_data)
+    BA = grid_ops.sum_over_time(get_monthly_burnt_area, time, month_period,
+                                chunk, data, grid_data)
     return BA
     
 def get_global_BA_yearly(year, data, grid_data):
     BA_grid = get_grid_burnt_area(year, 12, data, grid_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -37,25 +60,30 @@ def get_global_BA_yearly(year, data, grid_data):
 #
 
 
-def get_grid_emissions(year, month_period, data, grid_data, keep_time=False):
+def get_monthly_emissions(time, month_period, data, grid_data):
+    emis = grid_ops.to_precision(np.array(data["C"][time:time+month_period]))
+    # Convert from g to kg.
+    emis = np.divide(emis, 1000.)
+    
+    emis = np.multiply(emis, get_cell_area(grid_data))
+    return emis
+
+def get_grid_emissions(year, month_period, data, grid_data,
+                       keep_time=False, chunk=None):
     time = int(year*12)
    
     # Ignore overflow warning.
     np.seterr(over='ignore')
     
-    emis = np.array(data["C"][time:time+month_period])
-    # Convert from g to kg.
-    emis = np.divide(emis, 1000.)
-    
-    emis = np.multiply(emis, grid_data["grid_cell_area"])
     if keep_time:
-        return emis
-    emis = np.sum(emis, axis = 0)
+        return get_monthly_emissions(time, month_period, data, grid_data)
+    emis = grid_ops.sum_over_time(get_monthly_emissions, time, month_period,
+                                  chunk, data, grid_data)
     return emis
 
 def get_global_emissions_yearly(year, data, grid_data):
     emissions_grid = get_grid_emissions(year, 12, data, grid_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -63,38 +91,57 @@ def get_global_emissions_yearly(year, data, grid_data):
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, month_period, data, monthly=False):
-    time = int(year*12)
-    
-    # Ignore division by zero warning. Returns NaN.
-    np.seterr(divide='ignore')
-    
-    BA = np.array(data["BA"][time:time+month_period])
+def get_monthly_fire_data(time, month_period, data):
+    """
+    Returns the monthly emissions and burnt area used for the
+    fuel consumption, per unit area.
+    """
+    BA = grid_ops.to_precision(np.array(data["BA"][time:time+month_period]))
     # Convert to fractional.
     BA = np.divide(BA,100.)
-    if not monthly:
-        BA = np.sum(BA, axis=0)
-    inv_BA = 1./BA
-    # Remove infinities due to division by 0.
-    inv_BA[inv_BA == np.inf] = 0
     
-    emis = data["C"][time:time+month_period]
+    emis = grid_ops.to_precision(data["C"][time:time+month_period])
     # Convert from g to kg.
     emis = np.divide(emis, 1000)
-    if not monthly:
-        emis = np.sum(emis, axis=0)
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or monthly, in which case the
+    monthly fuel consumption is summed.
+    """
+    inv_BA = 1./BA
+    # Remove infinities due to division by 0.
+    inv_BA[inv_BA == np.inf] = 0
     
     fuel_consumption = np.multiply(emis, inv_BA)
     if monthly:
         fuel_consumption = np.sum(fuel_consumption, axis = 0)
     return fuel_consumption
+
+def get_grid_fuel_consumption(year, month_period, data, monthly=False,
+                              chunk=None):
+    time = int(year*12)
+    
+    # Ignore division by zero warning. Returns NaN.
+    np.seterr(divide='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_monthly_fire_data(start, count, data), monthly=True),
+                    time, month_period, chunk)
+    emis, BA = grid_ops.sum_over_time(get_monthly_fire_data, time,
+                                      month_period, chunk, data)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
     
     
 def get_global_mean_FC_yearly(year, data, grid_data):
     time = int(year*12)   
     FC_data = get_grid_fuel_consumption(year,12,data)
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["grid_cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
     
     
@@ -104,3 +151,43 @@ def get_global_mean_FC_yearly_rough(year, data, grid_data):
     global_mean_FC = total_emis/total_BA
     return global_mean_FC
 
+
+#
+# Fire Budget
+#
+
+def get_monthly_fire_budget(time, month_period, data, grid_data):
+    """
+    Returns the monthly emissions and burnt area grids, and the
+    monthly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    cell_area = get_cell_area(grid_data)
+    
+    BA = grid_ops.to_precision(np.array(data["BA"][time:time+month_period]))
+    # Convert to fractional.
+    BA = np.divide(BA,100.)
+    BA_grid = np.multiply(BA, cell_area)
+    
+    emis = grid_ops.to_precision(data["C"][time:time+month_period])
+    # Convert from g to kg.
+    emis_grid = np.divide(np.array(emis), 1000.)
+    emis_grid = np.multiply(emis_grid, cell_area)
+    emis = np.divide(emis, 1000)
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, month_period, data, grid_data, keep_time=False,
+                    monthly=False, chunk=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    time = int(year*12)
+    
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    return grid_ops.fire_budget(get_monthly_fire_budget,
+                    calc_fuel_consumption, time, month_period, chunk,
+                    (data, grid_data), keep_time, monthly)
@@ -1,61 +1,107 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
 
-emis_GLOBFIRM = Dataset('../../model_data/LPJ-GUESS-globfirm_SF1_Cfire.nc','r', format = 'NETCDF4')
-BA_GLOBFIRM = Dataset('../../model_data/LPJ-GUESS-globfirm_SF1_burntArea.nc', 'r', format = 'NETCDF4')
-grid_GLOBFIRM = Dataset('../../model_data/HalfDegree-gridarea-8975.nc',
-                        'r', format = 'NETCDF4')
+import data_registry as registry
+import grid_ops
+import clean_store
+
+emis_GLOBFIRM = registry.get_dataset('globfirm', 'emis_GLOBFIRM')
+BA_GLOBFIRM = registry.get_dataset('globfirm', 'BA_GLOBFIRM')
+grid_GLOBFIRM = registry.get_dataset('globfirm', 'grid_GLOBFIRM')
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_GLOBFIRM):
+    """
+    Returns the cached cell areas of the GLOBFIRM grid.
+    """
+    return registry.get_static_field(grid_data, "cell_area",
+                                     dtype=grid_ops.get_dtype())
+
+
+#
+# Cleaned Inputs
+#
+
+def _clean_negative(values):
+    # Remove negative values.
+    values = np.array(values)
+    values[values<0.]=0
+    return values
+
+
+def get_burnt_area(BA_data=BA_GLOBFIRM):
+    """
+    Returns the burnt area of GLOBFIRM with negative values removed,
+    cleaned once per file, see clean_store.
+    """
+    return clean_store.get_variable(BA_data, "burntArea.", _clean_negative)
+
+
+def get_emissions(emis_data=emis_GLOBFIRM):
+    """
+    Returns the emissions of GLOBFIRM with negative values removed,
+    cleaned once per file, see clean_store.
+    """
+    return clean_store.get_variable(emis_data, "fFire.", _clean_negative)
+
 
 #
 # Burnt Area Analysis
 #
 
-def get_grid_burnt_area(year, year_period, BA_data, grid_data,
-                         keep_time=False):
-    BA = BA_data["burntArea."][year:year+year_period]
+def get_yearly_burnt_area(year, year_period, BA_data, grid_data):
+    BA = get_burnt_area(BA_data)[year:year+year_period]
     BA = np.divide(BA, 100.)
     
-    BA = np.multiply(BA, grid_data["cell_area"])
-    BA = np.array(BA)
-    BA[BA<0.]=0
+    BA = np.multiply(BA, get_cell_area(grid_data))
+    return BA
+
+def get_grid_burnt_area(year, year_period, BA_data, grid_data,
+                         keep_time=False, chunk=None):
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return get_yearly_burnt_area(year, year_period, BA_data, grid_data)
+    BA = grid_ops.sum_over_time(get_yearly_burnt_area, year, year_period,
+                                chunk, BA_data, grid_data)
     return BA
     
 def get_global_BA_yearly(year, BA_data, grid_data):
     BA_grid = get_grid_burnt_area(year, 1, BA_data, grid_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
 #
 # Carbon Emissions Analysis
 #
-                   
-def get_grid_emissions(year, year_period, emis_data, grid_data,
-                        keep_time=False):
+
+def get_yearly_emissions(year, year_period, emis_data, grid_data):
     # Using 1 year equal to 365.25 days.
     sec_per_year = 31557600.
     
+    emis = get_emissions(emis_data)[year:year+year_period]
+    emis = np.multiply(emis, get_cell_area(grid_data))
+    emis *= sec_per_year
+    return emis
+                   
+def get_grid_emissions(year, year_period, emis_data, grid_data,
+                        keep_time=False, chunk=None):
     # Ignore overflow warning.
     np.seterr(over='ignore')
     
-    emis = np.array(emis_data["fFire."][year:year+year_period])
-    emis = np.multiply(emis, grid_data["cell_area"])
-    emis = np.multiply(emis, sec_per_year)
-    emis[emis<0]=0.
-    
     if keep_time:
-        return emis
-    emis = np.sum(emis, axis = 0)
+        return get_yearly_emissions(year, year_period, emis_data, grid_data)
+    emis = grid_ops.sum_over_time(get_yearly_emissions, year, year_period,
+                                  chunk, emis_data, grid_data)
     return emis
 
 def get_global_emissions_yearly(year, emis_data, grid_data):
     emissions_grid = get_grid_emissions(year, 1, emis_data, grid_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -63,43 +109,58 @@ def get_global_emissions_yearly(year, emis_data, grid_data):
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, year_period, emis_data, BA_data, monthly=False):
+def get_yearly_fire_data(year, year_period, emis_data, BA_data):
+    """
+    Returns the yearly emissions and burnt area used for the
+    fuel consumption, per unit area.
+    """
     # Using 1 year equal to 365.25 days.
     sec_per_year = 31557600.
     
-    # Ignore division by zero warning. Returns inf.
-    np.seterr(divide='ignore')
-    # Ignore overflow warning.
-    np.seterr(over='ignore')
-    
-    # Convert from percentage to decimal and eliminate meaningless values.
-    BA = BA_data["burntArea."][year:year+year_period]
+    # Convert from percentage to decimal.
+    BA = get_burnt_area(BA_data)[year:year+year_period]
     BA = np.divide(BA,100.)
-    BA = np.array(BA)
-    BA[BA<0.] = 0
     
-    if not monthly:
-        BA = np.sum(BA, axis=0)
+    emis = get_emissions(emis_data)[year:year+year_period]
+    emis = np.multiply(emis, sec_per_year)
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or yearly, in which case the
+    yearly fuel consumption is summed.
+    """
     inv_BA = np.array(1./BA)
     # Remove infinities due to division by 0.
     inv_BA[inv_BA == np.inf] = 0
     
-    emis = np.array(emis_data["fFire."][year:year+year_period])
-    emis = np.multiply(emis, sec_per_year)
-    emis[emis<0]=0.
-    if not monthly:
-        emis = np.sum(emis,axis=0)
-    
     fuel_consumption = np.multiply(emis, inv_BA)
     if monthly:
         fuel_consumption = np.sum(fuel_consumption, axis = 0)
     return fuel_consumption
 
+def get_grid_fuel_consumption(year, year_period, emis_data, BA_data,
+                              monthly=False, chunk=None):
+    # Ignore division by zero warning. Returns inf.
+    np.seterr(divide='ignore')
+    # Ignore overflow warning.
+    np.seterr(over='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_yearly_fire_data(start, count, emis_data, BA_data),
+                    monthly=True), year, year_period, chunk)
+    emis, BA = grid_ops.sum_over_time(get_yearly_fire_data, year,
+                                      year_period, chunk, emis_data, BA_data)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
+
     
 def get_global_mean_FC_yearly(year, emis_data, BA_data, grid_data): 
     FC_data = get_grid_fuel_consumption(year,1,emis_data, BA_data) 
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
 
 
@@ -109,3 +170,41 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data,grid_data):
     global_mean_FC = total_emis/total_BA
     return global_mean_FC
 
+
+#
+# Fire Budget
+#
+
+def get_yearly_fire_budget(year, year_period, emis_data, BA_data, grid_data):
+    """
+    Returns the yearly emissions and burnt area grids, and the
+    yearly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    # Using 1 year equal to 365.25 days.
+    sec_per_year = 31557600.
+    cell_area = get_cell_area(grid_data)
+    
+    # Convert from percentage to decimal.
+    BA = get_burnt_area(BA_data)[year:year+year_period]
+    BA = np.divide(BA,100.)
+    BA_grid = np.multiply(BA, cell_area)
+    
+    emis = get_emissions(emis_data)[year:year+year_period]
+    emis = np.multiply(emis, sec_per_year)
+    emis_grid = np.multiply(emis, cell_area)
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, year_period, emis_data, BA_data, grid_data,
+                    keep_time=False, monthly=False, chunk=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    return grid_ops.fire_budget(get_yearly_fire_budget,
+                    calc_fuel_consumption, year, year_period, chunk,
+                    (emis_data, BA_data, grid_data), keep_time, monthly)
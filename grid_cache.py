@@ -0,0 +1,180 @@
+"""
+This module is a persistent on-disk cache for computed grids,
+used by spatial_comparison.load_var_grid so that a full figure
+regeneration only computes each grid once across runs.
+
+Grids are stored as .npy files under CACHE_DIR, named by a hash
+of the function name, its arguments, and the size and
+modification time of the source files, so a grid is recomputed
+whenever its inputs change. The least recently used grids are
+deleted once the total size of the cache exceeds MAX_CACHE_SIZE.
+"""
+
+import os
+import hashlib
+
+import numpy as np
+
+
+CACHE_DIR = './cache/grids/'
+
+# Maximum total size of the cache, in bytes.
+MAX_CACHE_SIZE = 8*1024**3
+
+# Bump when the computation of the cached grids changes, so that
+# previously cached grids are no longer used.
+CACHE_VERSION = 2
+
+# Set to False to always compute grids from the source files.
+enabled = True
+
+
+def get_key(name, args, paths):
+    """
+    Returns the cache key for the given function name and
+    arguments, depending on the size and modification time
+    of the given source files.
+    """
+    file_stats = []
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+            file_stats.append((path, stat.st_size, int(stat.st_mtime)))
+        except OSError:
+            file_stats.append((path, None, None))
+    description = repr((CACHE_VERSION, name, tuple(args), file_stats))
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+def load(key, mmap_mode=None):
+    """
+    Returns the grid stored under the given key, or None if
+    it is not in the cache. If mmap_mode is given (e.g. 'r'),
+    the grid is memory-mapped, so that only the parts of it
+    that are indexed are read.
+    """
+    path = _get_file(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        grid = np.load(path, mmap_mode=mmap_mode)
+        mask_path = _get_file(key, mask=True)
+        if os.path.exists(mask_path):
+            grid = np.ma.masked_array(grid, mask=np.load(mask_path,
+                                                mmap_mode=mmap_mode))
+    except (IOError, ValueError):
+        # Incomplete or corrupted file, recompute it.
+        return None
+    # Mark as recently used.
+    os.utime(path, None)
+    return grid
+
+
+def save(key, grid):
+    """
+    Stores the given grid under the given key, and evicts the
+    least recently used grids if the cache grows too large.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    if np.ma.isMaskedArray(grid):
+        _save_file(_get_file(key, mask=True), np.ma.getmaskarray(grid))
+        data = np.ma.getdata(grid)
+    else:
+        data = np.asarray(grid)
+    _save_file(_get_file(key), data)
+    evict()
+
+
+def cached(name, args, paths, compute, mmap_mode=None):
+    """
+    Returns the grid for the given function name and arguments
+    from the cache, or computes it with the function compute
+    (which takes no arguments) and stores it. See load for the
+    mmap_mode argument.
+    """
+    if not enabled:
+        return compute()
+    key = get_key(name, args, paths)
+    grid = load(key, mmap_mode)
+    if grid is None:
+        grid = compute()
+        save(key, grid)
+    return grid
+
+
+def cached_group(name, args, paths, compute, size, mmap_mode=None):
+    """
+    Returns the tuple of size grids for the given function name and
+    arguments from the cache, or computes them together with the
+    function compute (which takes no arguments and returns a tuple)
+    and stores each of them. See load for the mmap_mode argument.
+    """
+    if not enabled:
+        return tuple(compute())
+    keys = [get_key(name, tuple(args) + (i,), paths) for i in range(size)]
+    grids = [load(key, mmap_mode) for key in keys]
+    if any(grid is None for grid in grids):
+        grids = compute()
+        for key, grid in zip(keys, grids):
+            save(key, grid)
+    return tuple(grids)
+
+
+def get_size():
+    """
+    Returns the total size of the cache, in bytes.
+    """
+    return sum(os.path.getsize(path) for path in _list_files())
+
+
+def evict(max_size=None):
+    """
+    Deletes the least recently used grids until the total size
+    of the cache is at most max_size (MAX_CACHE_SIZE by default).
+    """
+    if max_size is None:
+        max_size = MAX_CACHE_SIZE
+    files = [(os.path.getmtime(path), os.path.getsize(path), path)
+                for path in _list_files() if not path.endswith('.mask.npy')]
+    total = get_size()
+    for mtime, size, path in sorted(files):
+        if total <= max_size:
+            break
+        mask_path = path[:-len('.npy')] + '.mask.npy'
+        for old_path in (path, mask_path):
+            if os.path.exists(old_path):
+                total -= os.path.getsize(old_path)
+                os.remove(old_path)
+
+
+def clear():
+    """
+    Deletes all the grids in the cache.
+    """
+    evict(0)
+
+
+def _get_file(key, mask=False):
+    if mask:
+        return os.path.join(CACHE_DIR, key + '.mask.npy')
+    return os.path.join(CACHE_DIR, key + '.npy')
+
+
+def _save_file(path, array):
+    # Write to a temporary file first, so that an interrupted run
+    # never leaves a partial grid under the final name.
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'wb')
+    try:
+        np.save(f, array)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+
+def _list_files():
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    return [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR)
+                if name.endswith('.npy')]
@@ -0,0 +1,387 @@
+"""
+This module contains numerical helpers shared by the model
+analysis modules.
+
+The accessors of the models read and reduce their time window
+through these helpers, which can process the window in chunks
+of a fixed number of time steps, keeping only running sums, so
+that peak memory does not depend on the length of the period.
+The per-pft fields are reduced to grids by contract_pfts, without
+temporaries of the size of the per-pft fields.
+
+The helpers can also write their results directly in the standard
+orientation (latitudes from south to north, longitudes from -180
+to 180), given as an orient pair (flip_lat, roll_lon). Flipped
+latitudes are a view, and rolled longitudes are written as two
+halves into their final place, either in the running sums or in
+a preallocated buffer holding the whole time series, so that
+standardising never needs its own copy of the grid.
+
+The precision of the grids is set once for the whole pipeline by
+set_precision, see there for the error of the 'float32' mode.
+"""
+
+import numpy as np
+
+
+# Precisions of the grids, see set_precision.
+PRECISIONS = ['float64', 'float32']
+
+# Precision of the grids computed by the accessors.
+precision = 'float64'
+
+
+def set_precision(name):
+    """
+    Sets the precision of the grids computed by the accessors of
+    the model modules (and so by spatial_comparison.load_var_grid),
+    either 'float64' (the default) or 'float32'.
+
+    In 'float32' mode the inputs, cell areas and month lengths are
+    kept in float32 through the pipeline, which halves the memory
+    and the bandwidth of the per-pft fields and of the time series,
+    while the sums over time are accumulated in float64 and only the
+    final grids are rounded to float32. Regional and global sums are
+    float64 in both modes.
+
+    Every value of a 'float32' grid differs from the 'float64' grid
+    by at most (no_pfts + 5)*2**-24 times the sum of the absolute
+    values of its terms: one rounding per term of the sum over the
+    pfts, per scaling factor (land cover, land mask, cell area, month
+    length) and for the final grid. This is about 1.1e-6 for the 13
+    pfts of the per-pft models and 3e-7 for the others.
+
+    This is a bound on the relative error of the value itself only
+    where all its terms are non-negative, which cleaning guarantees
+    for BLAZE and GLOBFIRM, whose inputs are clipped at 0. CTEM clips
+    its emissions only after the sum over the pfts, and JSBACH, CLM
+    and SPITFIRE never clip theirs, so where terms cancel the
+    relative error of a value, and of the fuel consumption computed
+    from it, is not bounded. Where the terms are non-negative, fuel
+    consumption, a ratio of two such grids, is within twice the
+    bound, and the float64 regional and global sums within the same
+    bound as the grids.
+    """
+    global precision
+    if name not in PRECISIONS:
+        raise ValueError('Unknown precision ' + str(name))
+    precision = name
+
+
+def get_dtype():
+    """
+    Returns the type of the inputs in the current precision, or
+    None in 'float64' mode, where they keep their own type.
+    """
+    if precision == 'float32':
+        return np.float32
+    return None
+
+
+def get_sum_dtype():
+    """
+    Returns the type of the sums over time in the current precision,
+    or None in 'float64' mode, where they keep the type of the data.
+    """
+    if precision == 'float32':
+        return np.float64
+    return None
+
+
+def to_precision(array):
+    """
+    Returns the given floating point array in the current precision,
+    without a copy if it already is.
+    """
+    dtype = get_dtype()
+    if (dtype is None or not np.issubdtype(np.result_type(array), np.floating)
+            or np.result_type(array) == dtype):
+        return array
+    return array.astype(dtype)
+
+
+def iter_chunks(time, period, chunk=None):
+    """
+    Yields the (start, count) pairs of consecutive windows of
+    at most chunk time steps covering the period starting at
+    the index time. If chunk is None, yields the whole period.
+    """
+    if not chunk:
+        yield time, period
+        return
+    for start in range(time, time+period, chunk):
+        yield start, min(chunk, time+period-start)
+
+
+def contract_pfts(data, cover=None, cell_scale=None, step_scale=None,
+                  steps_per_cover=1):
+    """
+    Returns the sum over the pfts of the per-pft data (time, pft,
+    lat, lon), weighted by the land cover fractions cover if given,
+    as (time, lat, lon), multiplied by the per-cell factors
+    cell_scale (e.g. cell areas) and the per-time-step factors
+    step_scale (e.g. seconds per month) if given.
+
+    The weighted sum is a single np.einsum contraction, and the
+    factors, which do not depend on the pft, are applied in place
+    to its result, so that no (time, pft, lat, lon) temporary is
+    allocated. If cover has one entry per steps_per_cover time steps
+    (e.g. yearly land cover of monthly data), the time steps are
+    viewed as (covers, steps_per_cover, pft, lat, lon) so that it
+    applies by broadcasting.
+
+    The sum is done in the precision of all the inputs, or in
+    float32 in 'float32' mode (see set_precision). Masked
+    values are left out of the sum, and cells where every pft is
+    masked are masked, as in np.ma.sum.
+    """
+    shape = np.shape(data)
+    inputs = [data, cover, cell_scale, step_scale]
+    dtype = np.result_type(*[np.result_type(value) for value in inputs
+                             if value is not None])
+    if get_dtype() is not None:
+        dtype = get_dtype()
+    if cover is None:
+        result = np.sum(data, axis=1, dtype=dtype)
+    else:
+        steps_shape = (-1, steps_per_cover) + shape[1:]
+        cover_shape = (-1, 1) + shape[1:]
+        mask = None
+        if (np.ma.getmask(data) is not np.ma.nomask
+                or np.ma.getmask(cover) is not np.ma.nomask):
+            # Boolean, so 8 times smaller than a float64 temporary.
+            mask = np.logical_or(
+                np.reshape(np.ma.getmaskarray(data), steps_shape),
+                np.reshape(np.ma.getmaskarray(cover), cover_shape))
+            mask = np.all(mask, axis=2)
+        steps = np.reshape(np.ma.filled(data, 0.), steps_shape)
+        cover = np.reshape(np.ma.filled(cover, 0.), (-1,) + shape[1:])
+        result = np.einsum('csp...,cp...->cs...', steps, cover, dtype=dtype,
+                           casting='same_kind')
+        result = np.reshape(result, (shape[0],) + shape[2:])
+        if mask is not None:
+            result = np.ma.masked_array(result,
+                                        mask=np.reshape(mask, result.shape))
+    if cell_scale is not None:
+        result *= cell_scale
+    if step_scale is not None:
+        result *= np.reshape(step_scale, (-1,) + (1,)*(result.ndim-1))
+    return result
+
+
+def place(grid, orient=None, out=None, time_index=None, add=False):
+    """
+    Returns the grid, with or without a time axis, in the standard
+    orientation given by orient, a (flip_lat, roll_lon) pair, or
+    unchanged if orient is None.
+
+    If out is given, the grid is written (or added, if add is True)
+    into out, at time_index along its time axis if given, and out
+    is returned. Otherwise flipped latitudes are returned as a view,
+    and rolled longitudes are written into a new array.
+    """
+    flip_lat, roll_lon = orient or (False, False)
+    if flip_lat:
+        grid = grid[...,::-1,:]
+    if out is None:
+        if not roll_lon:
+            return grid
+        out = _empty(np.shape(grid), grid)
+    if roll_lon:
+        # Same as np.roll by half the longitudes.
+        no_lons = np.shape(grid)[-1]
+        shift = no_lons//2
+        halves = [(slice(shift, None), slice(None, no_lons-shift)),
+                  (slice(None, shift), slice(no_lons-shift, None))]
+    else:
+        halves = [(slice(None), slice(None))]
+    for dst, src in halves:
+        if time_index is None:
+            index = (Ellipsis, dst)
+        else:
+            index = (time_index, Ellipsis, dst)
+        if add:
+            out[index] += grid[...,src]
+        else:
+            out[index] = grid[...,src]
+    return out
+
+
+def accumulate(reduce_window, time, period, chunk=None, orient=None):
+    """
+    Calls reduce_window(start, count) for consecutive windows of
+    at most chunk time steps covering the given period, and
+    returns the sum of the results, which can be arrays or tuples
+    of arrays. Only the running sum is kept in memory.
+
+    If orient is given, the sum is kept in the standard orientation,
+    see place. In 'float32' mode the running sum is kept in float64,
+    and rounded to float32 when returned.
+
+    Masked values are summed as zeros, and a cell of the sum is only
+    masked if it is masked in every window, as in np.ma.sum over the
+    whole period, so that the result does not depend on chunk.
+    """
+    totals = masks = None
+    is_tuple = False
+    for start, count in iter_chunks(time, period, chunk):
+        result = reduce_window(start, count)
+        is_tuple = isinstance(result, tuple)
+        if not is_tuple:
+            result = (result,)
+        if totals is None:
+            totals = [_widen(place(np.ma.filled(new, 0.), orient))
+                      for new in result]
+            masks = [_get_mask(new, orient) for new in result]
+        else:
+            for i, new in enumerate(result):
+                totals[i] = _add(totals[i], np.ma.filled(new, 0.), orient)
+                if masks[i] is not None:
+                    masks[i] &= place(np.ma.getmaskarray(new), orient)
+    result = []
+    for running, mask in zip(totals, masks):
+        running = to_precision(running)
+        if mask is not None:
+            running = np.ma.masked_array(running, mask=mask)
+        result.append(running)
+    if is_tuple:
+        return tuple(result)
+    return result[0]
+
+
+def sum_over_time(get_window, time, period, chunk, *args, **kwargs):
+    """
+    Returns the sum over the first (time) axis of the array, or
+    tuple of arrays, returned by get_window(start, count, *args)
+    for the given period, reading at most chunk time steps at a
+    time. The orient keyword argument is passed to accumulate.
+    """
+    def reduce_window(start, count):
+        result = get_window(start, count, *args)
+        if isinstance(result, tuple):
+            return tuple(_sum(data) for data in result)
+        return _sum(result)
+    return accumulate(reduce_window, time, period, chunk,
+                      kwargs.get('orient'))
+
+
+def collect(get_window, time, period, chunk, *args, **kwargs):
+    """
+    Returns the array, or tuple of arrays, returned by
+    get_window(start, count, *args) for the whole period, keeping
+    its time axis, reading at most chunk time steps at a time.
+
+    The windows are written into a buffer allocated once for the
+    whole period, in the standard orientation given by the orient
+    keyword argument (see place).
+    """
+    orient = kwargs.get('orient')
+    series = {}
+    is_tuple = False
+    for start, count in iter_chunks(time, period, chunk):
+        result = get_window(start, count, *args)
+        is_tuple = isinstance(result, tuple)
+        if not is_tuple:
+            result = (result,)
+        for i, data in enumerate(result):
+            _store(series, i, data, start-time, period, orient)
+    result = tuple(series[i] for i in range(len(series)))
+    if is_tuple:
+        return result
+    return result[0]
+
+
+def fire_budget(get_window, calc_fuel_consumption, time, period, chunk,
+                args, keep_time=False, monthly=False, orient=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids for
+    the given period, as (emis, BA, FC), from a single read of each
+    input.
+
+    get_window(start, count, *args) returns, for each time step of
+    the window, the emissions and burnt area grids and the emissions
+    and burnt area used for the fuel consumption. The latter are
+    combined by calc_fuel_consumption(emis, BA, monthly), either
+    after summing over the period or, if monthly is True, for each
+    time step.
+
+    If keep_time is True, the emissions and burnt area grids keep
+    their time axis, and are written window by window into buffers
+    allocated once for the whole period.
+
+    If orient is given, the grids are returned in the standard
+    orientation, see place.
+    """
+    series = {}
+    def reduce_window(start, count):
+        emis, BA, FC_emis, FC_BA = get_window(start, count, *args)
+        if keep_time:
+            _store(series, 'emis', emis, start-time, period, orient)
+            _store(series, 'BA', BA, start-time, period, orient)
+            grids = ()
+        else:
+            grids = (_sum(emis), _sum(BA))
+        if monthly:
+            return grids + (calc_fuel_consumption(FC_emis, FC_BA,
+                                                  monthly=True),)
+        return grids + (_sum(FC_emis), _sum(FC_BA))
+    result = accumulate(reduce_window, time, period, chunk, orient)
+    if keep_time:
+        result = (series['emis'], series['BA']) + result
+    if monthly:
+        return result
+    emis, BA, FC_emis, FC_BA = result
+    return emis, BA, calc_fuel_consumption(FC_emis, FC_BA)
+
+
+def _store(series, key, data, offset, period, orient):
+    # Write a window of a time series into its buffer, allocated on
+    # the first window. A single window covering the whole period is
+    # used as it is, without a buffer.
+    if key not in series:
+        if len(data) == period:
+            series[key] = place(data, orient)
+            return
+        series[key] = _empty((period,) + np.shape(data)[1:], data)
+    place(data, orient, out=series[key],
+          time_index=slice(offset, offset+len(data)))
+
+
+def _empty(shape, like):
+    # New array of the given shape, masked if like is masked. The
+    # mask is allocated, so that writes into parts of it are kept.
+    data = np.empty(shape, dtype=np.result_type(like))
+    if np.ma.isMaskedArray(like):
+        return np.ma.masked_array(data, mask=np.zeros(shape, dtype='bool'))
+    return data
+
+
+def _sum(data):
+    # Sum over the time axis, in float64 in 'float32' mode.
+    return np.sum(data, axis=0, dtype=get_sum_dtype())
+
+
+def _widen(total):
+    # First running sum of accumulate, in float64 in 'float32' mode.
+    if get_sum_dtype() is None or np.result_type(total) == get_sum_dtype():
+        return total
+    return total.astype(get_sum_dtype())
+
+
+def _get_mask(new, orient):
+    # First running mask of accumulate, or None if new is not masked.
+    if not np.ma.isMaskedArray(new):
+        return None
+    return np.array(place(np.ma.getmaskarray(new), orient))
+
+
+def _add(running, new, orient=None):
+    # Add in place where possible, to avoid a new allocation.
+    try:
+        if orient is None:
+            running += new
+        else:
+            place(new, orient, out=running, add=True)
+    except TypeError:
+        running = running + place(new, orient)
+    return running
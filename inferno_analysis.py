@@ -1,18 +1,73 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
-                    
-emis_INFERNO = Dataset('../../model_data/Inferno_S1_fFirepft.nc', 
-                'r', format = 'NETCDF4')
-BA_INFERNO = Dataset('../../model_data/Inferno_S1_burntArea.nc', 
-                'r', format = 'NETCDF4')              
-grid_INFERNO = Dataset('../../model_data/Inferno_grid.nc', 
-                    'r', format = 'NETCDF4')
-landmask_INFERNO = Dataset('../../model_data/CRU-NCEP-LandMask.nc',
-                    'r', format = 'NETCDF4')
-landCover_INFERNO = Dataset('../../model_data/Inferno_S1_LandCoverFrac.nc',
-                    'r', format = 'NETCDF4')
+
+import data_registry as registry
+import model_calendar
+import grid_ops
+import clean_store
+
+emis_INFERNO = registry.get_dataset('inferno', 'emis_INFERNO')
+BA_INFERNO = registry.get_dataset('inferno', 'BA_INFERNO')
+grid_INFERNO = registry.get_dataset('inferno', 'grid_INFERNO')
+landmask_INFERNO = registry.get_dataset('inferno', 'landmask_INFERNO')
+landCover_INFERNO = registry.get_dataset('inferno', 'landCover_INFERNO')
+
+
+#
+# Calendar
+#
+
+def get_calendar(data=emis_INFERNO):
+    """
+    Returns the cached monthly calendar of INFERNO, taken from
+    the time axis (in seconds) of the given dataset.
+    """
+    return model_calendar.get_calendar(data, rule='elapsed_seconds')
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_INFERNO):
+    """
+    Returns the cached cell areas of the INFERNO grid.
+    """
+    return registry.get_static_field(grid_data, "cell_area",
+                                     dtype=grid_ops.get_dtype())
+
+
+def _clean_landmask(landmask):
+    # Remove fill values.
+    landmask[landmask > 1.] = 0
+
+
+def get_landmask(landmask=landmask_INFERNO):
+    """
+    Returns the cached land mask used for INFERNO, with
+    fill values removed.
+    """
+    return registry.get_static_field(landmask, "lsm", _clean_landmask,
+                                     dtype=grid_ops.get_dtype())
+
+
+#
+# Cleaned Inputs
+#
+
+def _clean_burnt_area(BA):
+    # Remove negative values.
+    BA[BA<0.]=0
+    return BA
+
+
+def get_burnt_area(BA_data=BA_INFERNO):
+    """
+    Returns the burnt area of INFERNO with negative values removed,
+    cleaned once per file, see clean_store.
+    """
+    return clean_store.get_variable(BA_data, "burntArea", _clean_burnt_area)
                 
 
  
@@ -20,43 +75,42 @@ landCover_INFERNO = Dataset('../../model_data/Inferno_S1_LandCoverFrac.nc',
 # Burnt Area Analysis
 #
 
-def get_grid_burnt_area(year, month_period, BA_data, grid_data, 
-                    landmask, landCover_data, keep_time=False):
-    np.seterr(over='ignore')
-    time = int(year*12)
-    sec_per_month = []
-    for i in range(month_period):
-        if time+i == 0:
-            sec_per_month.append(BA_data["time"][0])
-        else:
-            sec_per_month.append(BA_data["time"][time+i]-BA_data["time"][time+i-1])
-  
-    sec_per_month= np.array(sec_per_month)
+def get_monthly_burnt_area(time, month_period, BA_data, grid_data,
+                           landmask, landCover_data):
+    sec_per_month = get_calendar(BA_data).get_sec_per_month(time, month_period)
     
-    # Remove fill values.
-    landmask = np.array(landmask["lsm"])
-    landmask[landmask > 1.] = 0
+    landmask = get_landmask(landmask)
     
+    # The land mask does not depend on the pft, so it is applied
+    # to the pft sums.
     landCover = landCover_data["LandCoverFrac"][time:time+month_period, :9]
-    landCover= np.multiply(landCover,landmask)
+    landCover = grid_ops.to_precision(landCover)
     
     # Possibly convert to decimals and multiply by landCover (?)
-    BA = BA_data["burntArea"][time:time+month_period]
-    BA[BA<0.]=0
-    BA = np.multiply(BA, landCover)
-    BA = np.multiply(BA, grid_data["cell_area"])
-    BA = np.sum(BA, axis=1)
-    BA = np.multiply(BA, sec_per_month[:, np.newaxis, np.newaxis])
+    BA = get_burnt_area(BA_data)[time:time+month_period]
+    cell_scale = np.multiply(landmask, get_cell_area(grid_data))
+    BA = grid_ops.contract_pfts(BA, landCover, cell_scale, sec_per_month)
+    return BA
+
+def get_grid_burnt_area(year, month_period, BA_data, grid_data, 
+                    landmask, landCover_data, keep_time=False, chunk=None,
+                    orient=None):
+    np.seterr(over='ignore')
+    time = int(year*12)
     
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return grid_ops.collect(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data, landmask,
+                                landCover_data, orient=orient)
+    BA = grid_ops.sum_over_time(get_monthly_burnt_area, time, month_period,
+                    chunk, BA_data, grid_data, landmask, landCover_data,
+                    orient=orient)
     return BA
     
 def get_global_BA_yearly(year, BA_data, grid_data, landmask, landCover_data):
     BA_grid = get_grid_burnt_area(year, 12, BA_data, grid_data,
                                         landmask, landCover_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -64,41 +118,43 @@ def get_global_BA_yearly(year, BA_data, grid_data, landmask, landCover_data):
 # Carbon Emissions Analysis
 #
                     
-def get_grid_emissions(year, month_period, emis_data, grid_data, 
-                    landmask, landCover_data, keep_time=False):
-    time = int(year*12)
-    sec_per_month = []
-    for i in range(month_period):
-        if time+i == 0:
-            sec_per_month.append(emis_data["time"][0])
-        else:
-            sec_per_month.append(emis_data["time"][time+i]-emis_data["time"][time+i-1])      
-    sec_per_month= np.array(sec_per_month)
-    
-    # Ignore overflow warning.
-    np.seterr(over='ignore')
+def get_monthly_emissions(time, month_period, emis_data, grid_data,
+                          landmask, landCover_data):
+    sec_per_month = get_calendar(emis_data).get_sec_per_month(time, month_period)
     
-    # Remove fill values.    
-    landmask = np.array(landmask["lsm"])
-    landmask[landmask > 1.] = 0
+    landmask = get_landmask(landmask)
     
+    # The land mask does not depend on the pft, so it is applied
+    # to the pft sums.
     landCover = landCover_data["LandCoverFrac"][time:time+month_period, :9]
-    landCover= np.multiply(landCover,landmask)
+    landCover = grid_ops.to_precision(landCover)
     
     emis = emis_data["fFirepft"][time:time + month_period]
-    emis = np.multiply(emis, landCover)
-    emis = np.multiply(emis, grid_data["cell_area"])
-    emis = np.sum(emis, axis = 1)
-    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
+    emis = grid_ops.to_precision(emis)
+    cell_scale = np.multiply(landmask, get_cell_area(grid_data))
+    emis = grid_ops.contract_pfts(emis, landCover, cell_scale, sec_per_month)
+    return emis
+
+def get_grid_emissions(year, month_period, emis_data, grid_data, 
+                    landmask, landCover_data, keep_time=False, chunk=None,
+                    orient=None):
+    time = int(year*12)
+    
+    # Ignore overflow warning.
+    np.seterr(over='ignore')
     
     if keep_time:
-        return emis
-    emis = np.sum(emis, axis = 0)
+        return grid_ops.collect(get_monthly_emissions, time, month_period,
+                                chunk, emis_data, grid_data, landmask,
+                                landCover_data, orient=orient)
+    emis = grid_ops.sum_over_time(get_monthly_emissions, time, month_period,
+                    chunk, emis_data, grid_data, landmask, landCover_data,
+                    orient=orient)
     return emis
     
 def get_global_emissions_yearly(year, emis_data, grid_data, landmask, landCover_data):
     emissions_grid = get_grid_emissions(year, 12, emis_data, grid_data, landmask, landCover_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -106,33 +162,32 @@ def get_global_emissions_yearly(year, emis_data, grid_data, landmask, landCover_
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, 
-                            landmask, landCover_data, monthly=False):
-    time = int(year*12)
-    
-    # Ignore division by zero warning. Returns NaN.
-    np.seterr(divide='ignore')
-    
-    # Remove fill values.
-    landmask = np.array(landmask["lsm"])
-    landmask[landmask > 1.] = 0
+def get_monthly_fire_data(time, month_period, emis_data, BA_data,
+                          landmask, landCover_data):
+    """
+    Returns the monthly emissions and burnt area used for the
+    fuel consumption, per unit area and summed over the pfts.
+    """
+    landmask = get_landmask(landmask)
     
+    # The land mask does not depend on the pft, so it is applied
+    # to the pft sums.
     landCover = landCover_data["LandCoverFrac"][time:time+month_period, :9]
-    landCover= np.multiply(landCover,landmask)
+    landCover = grid_ops.to_precision(landCover)
     
-    emis = emis_data["fFirepft"][time:time+month_period]
-    emis = np.multiply(emis, landCover)
-    emis = np.sum(emis,axis=1)
-    if not monthly:
-        emis = np.sum(emis,axis=0)
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    emis = grid_ops.contract_pfts(emis, landCover, landmask)
     
-    BA = BA_data["burntArea"][time:time+month_period]
-    BA[BA<0.]=0
-    BA = np.multiply(BA, landCover)
-    BA = np.sum(BA,axis=1)
-    if not monthly:
-        BA = np.sum(BA,axis=0)
+    BA = get_burnt_area(BA_data)[time:time+month_period]
+    BA = grid_ops.contract_pfts(BA, landCover, landmask)
+    return emis, BA
 
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or monthly, in which case the
+    monthly fuel consumption is summed.
+    """
     inv_BA = 1./BA
     # Remove infinities due to division by 0.
     inv_BA[inv_BA == np.inf] = 0
@@ -141,6 +196,25 @@ def get_grid_fuel_consumption(year, month_period, emis_data, BA_data,
     if monthly:
         fuel_consumption = np.sum(fuel_consumption, axis = 0)
     return fuel_consumption
+
+def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, 
+                    landmask, landCover_data, monthly=False, chunk=None,
+                    orient=None):
+    time = int(year*12)
+    
+    # Ignore division by zero warning. Returns NaN.
+    np.seterr(divide='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_monthly_fire_data(start, count, emis_data, BA_data,
+                                           landmask, landCover_data),
+                    monthly=True), time, month_period, chunk, orient=orient)
+    emis, BA = grid_ops.sum_over_time(get_monthly_fire_data, time,
+                        month_period, chunk, emis_data, BA_data,
+                        landmask, landCover_data, orient=orient)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
     
     
 def get_global_mean_FC_yearly(year, emis_data, BA_data, 
@@ -149,7 +223,7 @@ def get_global_mean_FC_yearly(year, emis_data, BA_data,
     FC_data = get_grid_fuel_consumption(year,12,emis_data, BA_data, 
                                         landmask, landCover_data)
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
     
 
@@ -158,4 +232,57 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data, grid_data, landmas
     total_BA = get_global_BA_yearly(year,BA_data,grid_data,landmask,landCover_data)
     global_mean_FC = total_emis/total_BA
     return global_mean_FC
-   
+
+
+#
+# Fire Budget
+#
+
+def get_monthly_fire_budget(time, month_period, emis_data, BA_data,
+                            grid_data, landmask, landCover_data):
+    """
+    Returns the monthly emissions and burnt area grids, and the
+    monthly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    emis_sec_per_month = get_calendar(emis_data).get_sec_per_month(time,
+                                                            month_period)
+    BA_sec_per_month = get_calendar(BA_data).get_sec_per_month(time,
+                                                            month_period)
+    cell_area = get_cell_area(grid_data)
+    
+    landmask = get_landmask(landmask)
+    
+    # The land mask does not depend on the pft, so it is applied
+    # to the pft sums.
+    landCover = landCover_data["LandCoverFrac"][time:time+month_period, :9]
+    landCover = grid_ops.to_precision(landCover)
+    
+    BA = get_burnt_area(BA_data)[time:time+month_period]
+    BA = grid_ops.contract_pfts(BA, landCover, landmask)
+    BA_grid = np.multiply(BA, cell_area)
+    BA_grid *= BA_sec_per_month[:, np.newaxis, np.newaxis]
+    
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    emis = grid_ops.contract_pfts(emis, landCover, landmask)
+    emis_grid = np.multiply(emis, cell_area)
+    emis_grid *= emis_sec_per_month[:, np.newaxis, np.newaxis]
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, month_period, emis_data, BA_data, grid_data,
+                    landmask, landCover_data, keep_time=False, monthly=False,
+                    chunk=None, orient=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    time = int(year*12)
+    
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    return grid_ops.fire_budget(get_monthly_fire_budget,
+                    calc_fuel_consumption, time, month_period, chunk,
+                    (emis_data, BA_data, grid_data, landmask, landCover_data),
+                    keep_time, monthly, orient=orient)
@@ -1,35 +1,89 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
 
+import data_registry as registry
+import model_calendar
+import grid_ops
+import clean_store
 
-emis_JSBACH = Dataset('../../model_data/JSBACH_SF1_fFirepft.nc', 
-                'r', format = 'NETCDF4')
-BA_JSBACH = Dataset('../../model_data/JSBACH_SF1burntArea.nc', 
-                'r', format = 'NETCDF4')                              
-grid_JSBACH = Dataset('../../model_data/JSBACH_grid.nc', 
-                    'r', format = 'NETCDF4')               
+emis_JSBACH = registry.get_dataset('jsbach', 'emis_JSBACH')
+BA_JSBACH = registry.get_dataset('jsbach', 'BA_JSBACH')
+grid_JSBACH = registry.get_dataset('jsbach', 'grid_JSBACH')
 
 
 #
-# Burnt Area Analysis
+# Calendar
+#
+
+def get_calendar(data=emis_JSBACH):
+    """
+    Returns the cached monthly calendar of JSBACH, taken from
+    the time axis of the emissions data.
+    """
+    return model_calendar.get_calendar(data)
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_JSBACH):
+    """
+    Returns the cached cell areas of the JSBACH grid.
+    """
+    return registry.get_static_field(grid_data, "area",
+                                     dtype=grid_ops.get_dtype())
+
+
+#
+# Cleaned Inputs
 #
 
-def get_grid_burnt_area(year, month_period, BA_data, grid_data, keep_time=False):
-    BA = BA_data["burntArea"][year*12:year*12+month_period]
+def _clean_burnt_area(BA):
+    # Remove fill values.
     BA[BA>1e3] = 0
-    
-    BA = np.multiply(BA, grid_data["area"])
-    BA = np.sum(BA, axis=1)
+    return BA
+
+
+def _remove_small_burnt_area(BA):
+    # Remove values too small to be meaningful from a window of the
+    # cleaned burnt area, for the fuel consumption only.
+    BA = BA.copy()
+    BA[BA<1e-15] = 0
+    return BA
+
+
+def get_burnt_area(BA_data=BA_JSBACH):
+    """
+    Returns the burnt area of JSBACH with fill values removed,
+    cleaned once per file, see clean_store.
+    """
+    return clean_store.get_variable(BA_data, "burntArea", _clean_burnt_area)
+
+
+#
+# Burnt Area Analysis
+#
+
+def get_monthly_burnt_area(time, month_period, BA_data, grid_data):
+    BA = get_burnt_area(BA_data)[time:time+month_period]
+    BA = grid_ops.contract_pfts(BA, cell_scale=get_cell_area(grid_data))
+    return BA
+
+def get_grid_burnt_area(year, month_period, BA_data, grid_data,
+                        keep_time=False, chunk=None, orient=None):
+    time = int(year*12)
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return grid_ops.collect(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data, orient=orient)
+    BA = grid_ops.sum_over_time(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data, orient=orient)
     return BA
     
 def get_global_BA_yearly(year, BA_data, grid_data):
     BA_grid = get_grid_burnt_area(year, 12, BA_data, grid_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -38,32 +92,31 @@ def get_global_BA_yearly(year, BA_data, grid_data):
 #
 
 
-def get_grid_emissions(year, month_period, emis_data, grid_data, keep_time=False):
+def get_monthly_emissions(time, month_period, emis_data, grid_data):
+    sec_per_month = get_calendar(emis_data).get_sec_per_month(time, month_period)
+    
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    emis = grid_ops.contract_pfts(emis, cell_scale=get_cell_area(grid_data),
+                                  step_scale=sec_per_month)
+    return emis
+
+def get_grid_emissions(year, month_period, emis_data, grid_data,
+                       keep_time=False, chunk=None, orient=None):
     time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(emis_data["time"]):
-            days_per_month.append(emis_data["time"][time+i+1]-emis_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
     
     # Ignore overflow warning.
     np.seterr(over='ignore')
     
-    emis = emis_data["fFirepft"][time:time+month_period]
-    emis = np.multiply(emis, grid_data["area"])
-    emis = np.sum(emis, axis = 1)
-    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
-    
     if keep_time:
-        return emis
-    emis = np.sum(emis, axis = 0)
+        return grid_ops.collect(get_monthly_emissions, time, month_period,
+                                chunk, emis_data, grid_data, orient=orient)
+    emis = grid_ops.sum_over_time(get_monthly_emissions, time, month_period,
+                                  chunk, emis_data, grid_data, orient=orient)
     return emis
 
 def get_global_emissions_yearly(year, emis_data, grid_data):
     emissions_grid = get_grid_emissions(year, 12, emis_data, grid_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -71,52 +124,61 @@ def get_global_emissions_yearly(year, emis_data, grid_data):
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, monthly=False):
-    time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(emis_data["time"]):
-            days_per_month.append(emis_data["time"][time+i+1]-emis_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
-    
-    # Ignore division by zero warning. Returns NaN.
-    np.seterr(divide='ignore')
+def get_monthly_fire_data(time, month_period, emis_data, BA_data):
+    """
+    Returns the monthly emissions and burnt area used for the
+    fuel consumption, per unit area and summed over the pfts.
+    """
+    sec_per_month = get_calendar(emis_data).get_sec_per_month(time, month_period)
     
-    BA = BA_JSBACH["burntArea"][time:time+month_period]
-    BA = np.array(BA)
+    BA = get_burnt_area(BA_data)[time:time+month_period]
+    BA = _remove_small_burnt_area(BA)
     
-    # Remove fill values.
-    BA[BA>1e3] = 0
-    BA[BA<1e-15]=0
+    # Add up pft dependency.
+    BA = grid_ops.contract_pfts(BA)
     
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
     # Add up pft dependency.
-    BA = np.sum(BA,axis=1)
-    if not monthly:
-        BA=np.sum(BA,axis=0)
+    emis = grid_ops.contract_pfts(emis, step_scale=sec_per_month)
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or monthly, in which case the
+    monthly fuel consumption is summed.
+    """
     inv_BA = 1./BA
     # Remove infinities due to division by 0.
     inv_BA[inv_BA == np.inf] = 0
     
-    emis = emis_data["fFirepft"][time:time+month_period]
-    # Add up pft dependency.
-    emis = np.sum(emis, axis=1)
-    emis = np.multiply(emis,sec_per_month[:, np.newaxis, np.newaxis])
-    if not monthly:
-        emis=np.sum(emis,axis=0)
-    
     fuel_consumption = np.multiply(emis, inv_BA)
     if monthly:
         fuel_consumption = np.sum(fuel_consumption, axis = 0)
     return fuel_consumption
+
+def get_grid_fuel_consumption(year, month_period, emis_data, BA_data,
+                              monthly=False, chunk=None, orient=None):
+    time = int(year*12)
+    
+    # Ignore division by zero warning. Returns NaN.
+    np.seterr(divide='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_monthly_fire_data(start, count, emis_data, BA_data),
+                    monthly=True), time, month_period, chunk, orient=orient)
+    emis, BA = grid_ops.sum_over_time(get_monthly_fire_data, time,
+                        month_period, chunk, emis_data, BA_data, orient=orient)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
     
     
 def get_global_mean_FC_yearly(year, emis_data, BA_data, grid_data):
     time = int(year*12)   
     FC_data = get_grid_fuel_consumption(year,12,emis_data, BA_data)
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
     
     
@@ -126,3 +188,46 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data, grid_data):
     global_mean_FC = total_emis/total_BA
     return global_mean_FC
 
+
+#
+# Fire Budget
+#
+
+def get_monthly_fire_budget(time, month_period, emis_data, BA_data,
+                            grid_data):
+    """
+    Returns the monthly emissions and burnt area grids, and the
+    monthly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    sec_per_month = get_calendar(emis_data).get_sec_per_month(time, month_period)
+    cell_area = get_cell_area(grid_data)
+    
+    BA_grid = get_burnt_area(BA_data)[time:time+month_period]
+    BA = _remove_small_burnt_area(BA_grid)
+    # Add up pft dependency.
+    BA = grid_ops.contract_pfts(BA)
+    BA_grid = grid_ops.contract_pfts(BA_grid, cell_scale=cell_area)
+    
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    # Add up pft dependency, the cell areas do not depend on the pft.
+    emis = grid_ops.contract_pfts(emis, step_scale=sec_per_month)
+    emis_grid = np.multiply(emis, cell_area)
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, month_period, emis_data, BA_data, grid_data,
+                    keep_time=False, monthly=False, chunk=None, orient=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    time = int(year*12)
+    
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    return grid_ops.fire_budget(get_monthly_fire_budget,
+                    calc_fuel_consumption, time, month_period, chunk,
+                    (emis_data, BA_data, grid_data), keep_time, monthly,
+                    orient=orient)
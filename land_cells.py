@@ -0,0 +1,109 @@
+"""
+This module holds the compressed layout of the grids of a model,
+which keeps only the cells that burn during the period analysed,
+as a 1-D vector of values, together with the flat indices of those
+cells in the standard grid.
+
+More than two thirds of a global grid is ocean or never burns, and
+only holds zeros. Totals, histograms, regional sums, interpolations
+and correlations over the compressed vectors give the same results
+as over the full grids, as long as the cells left out are counted
+as zeros where it matters (see pearsonr), and the vectors are only
+expanded back to 2-D grids to draw maps.
+
+The layout of each model is built by spatial_comparison.get_land_cells.
+"""
+
+import numpy as np
+import scipy.special as special
+
+
+class LandCells(object):
+    """
+    Compressed layout of the cells of a grid of the given 2-D shape
+    (lat, lon), at the given flat indices, in increasing order.
+    """
+    def __init__(self, index, shape):
+        self.index = np.asarray(index, dtype='intp')
+        self.shape = tuple(shape)
+        # Number of cells of the full grid.
+        self.size = self.shape[0]*self.shape[1]
+
+    def __len__(self):
+        return len(self.index)
+
+    def compress(self, grid):
+        """
+        Returns the values of the grid, with or without leading axes
+        (e.g. time), at the cells of the layout, as an array of shape
+        (..., cells). Masked grids give masked vectors.
+        """
+        lead_shape = np.shape(grid)[:-2]
+        return np.reshape(grid, lead_shape + (self.size,))[...,self.index]
+
+    def expand(self, values, fill=0.):
+        """
+        Returns the compressed values, with or without leading axes,
+        as grids of the full shape, with the given fill value in the
+        cells left out. Masked values stay masked.
+        """
+        lead_shape = np.shape(values)[:-1]
+        grid = np.empty(lead_shape + (self.size,),
+                        dtype=np.result_type(np.ma.getdata(values), fill))
+        grid.fill(fill)
+        grid[...,self.index] = np.ma.getdata(values)
+        if np.ma.isMaskedArray(values):
+            mask = np.zeros(grid.shape, dtype='bool')
+            mask[...,self.index] = np.ma.getmaskarray(values)
+            grid = np.ma.masked_array(grid, mask=mask)
+        return np.reshape(grid, lead_shape + self.shape)
+
+    def compress_matrix(self, matrix):
+        """
+        Returns the given sparse matrix with a column for each cell of
+        the full grid, e.g. a region matrix, restricted to the columns
+        of the cells of the layout.
+        """
+        return matrix.tocsc()[:,self.index].tocsr()
+
+    def union(self, other):
+        """
+        Returns the layout of the cells in either this or the other
+        layout, of the same grid.
+        """
+        return LandCells(np.union1d(self.index, other.index), self.shape)
+
+
+def from_mask(mask):
+    """
+    Returns the layout of the cells where the given 2-D boolean grid
+    is True.
+    """
+    mask = np.asarray(mask, dtype='bool')
+    return LandCells(np.flatnonzero(mask), mask.shape)
+
+
+def pearsonr(x, y, size):
+    """
+    Returns the Pearson correlation coefficient and its two-tailed
+    p-value, as scipy.stats.pearsonr does, of two grids of size cells
+    given as vectors compressed with the same layout, whose other
+    cells are all zero. Masks are ignored, as in scipy.stats.pearsonr.
+    """
+    x = np.asarray(np.ma.getdata(x), dtype='float64')
+    y = np.asarray(np.ma.getdata(y), dtype='float64')
+    no_left_out = size - len(x)
+    x_mean = np.sum(x)/size
+    y_mean = np.sum(y)/size
+    x_dev = x - x_mean
+    y_dev = y - y_mean
+    # The deviations of the cells left out are minus the means.
+    cov = np.dot(x_dev, y_dev) + no_left_out*x_mean*y_mean
+    x_var = np.dot(x_dev, x_dev) + no_left_out*x_mean**2
+    y_var = np.dot(y_dev, y_dev) + no_left_out*y_mean**2
+    r = np.clip(cov/np.sqrt(x_var*y_var), -1., 1.)
+    df = size - 2
+    if abs(r) == 1.:
+        return r, 0.
+    t_squared = r*r*df/((1.-r)*(1.+r))
+    return r, special.betainc(0.5*df, 0.5, df/(df+t_squared))
@@ -1,41 +1,91 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
-                    
-emis_MC2 = Dataset('../../model_data/MC2_GlobalFire_Cfire.nc', 
-                'r', format = 'NETCDF4')
-BA_MC2 = Dataset('../../model_data/MC2_GlobalFire_BA.nc', 
-                'r', format = 'NETCDF4')                
-grid_MC2 = Dataset('../../model_data/HalfDegree-gridarea-8975.nc', 
-                    'r', format = 'NETCDF4')
+
+import data_registry as registry
+import grid_ops
+import clean_store
+
+emis_MC2 = registry.get_dataset('mc2', 'emis_MC2')
+BA_MC2 = registry.get_dataset('mc2', 'BA_MC2')
+grid_MC2 = registry.get_dataset('mc2', 'grid_MC2')
+
 
 #
-# Burnt Area Analysis
+# Static Grid Data
 #
 
+def get_cell_area(grid_data=grid_MC2):
+    """
+    Returns the cached cell areas of the MC2 grid.
+    """
+    return registry.get_static_field(grid_data, "cell_area",
+                                     dtype=grid_ops.get_dtype())
+
 
-def get_grid_burnt_area(year, year_period, BA_data, grid_data, keep_time=False):    
-    BA = BA_data["BA"][year:year+year_period]
+#
+# Cleaned Inputs
+#
+
+def _clean_burnt_area(BA):
+    # Convert from percentage to decimal and eliminate meaningless values.
     BA = np.divide(BA,100.)
-    
     BA = np.array(BA)
     BA[BA>1.]=0
-    
-    BA = np.multiply(BA, grid_data["cell_area"])    
-    
+    return BA
+
+
+def _clean_emissions(emis):
+    # Remove fill values, i.e. values over 1e30 once converted to
+    # yearly totals, using 1 year equal to 365.25 days.
+    emis = np.array(emis)
+    emis[emis*31557600.>1e30]=0.
+    return emis
+
+
+def get_burnt_area(BA_data=BA_MC2):
+    """
+    Returns the burnt area fractions of MC2, as decimals and with
+    meaningless values removed, cleaned once per file, see
+    clean_store.
+    """
+    return clean_store.get_variable(BA_data, "BA", _clean_burnt_area)
+
+
+def get_emissions(emis_data=emis_MC2):
+    """
+    Returns the emissions of MC2 with fill values removed, cleaned
+    once per file, see clean_store.
+    """
+    return clean_store.get_variable(emis_data, "Cfire", _clean_emissions)
+
+
+#
+# Burnt Area Analysis
+#
+
+
+def get_yearly_burnt_area(year, year_period, BA_data, grid_data):
+    BA = get_burnt_area(BA_data)[year:year+year_period]
+    BA = np.multiply(BA, get_cell_area(grid_data))    
+    return BA
+
+def get_grid_burnt_area(year, year_period, BA_data, grid_data,
+                        keep_time=False, chunk=None):
     if keep_time:
+        BA = get_yearly_burnt_area(year, year_period, BA_data, grid_data)
         last_yr = year+year_period
         if last_yr > 107:
-            nan_arr = np.empty((last_yr-108,360,720))*np.nan
+            nan_arr = np.empty((last_yr-108,360,720), dtype=BA.dtype)*np.nan
             BA = np.concatenate((BA,nan_arr),axis=0)
         return BA
-    BA= np.sum(BA, axis=0)
+    BA = grid_ops.sum_over_time(get_yearly_burnt_area, year, year_period,
+                                chunk, BA_data, grid_data)
     return BA
 
 def get_global_BA_yearly(year, BA_data, grid_data):
     BA_grid = get_grid_burnt_area(year, 1, BA_data, grid_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -43,31 +93,34 @@ def get_global_BA_yearly(year, BA_data, grid_data):
 # Carbon Emissions Analysis
 #
 
-def get_grid_emissions(year, year_period, emis_data, grid_data, keep_time=False):
+def get_yearly_emissions(year, year_period, emis_data, grid_data):
     # Using 1 year equal to 365.25 days.
     sec_per_year = 31557600.
     
+    emis = get_emissions(emis_data)[year:year+year_period]
+    emis = np.multiply(emis,get_cell_area(grid_data))
+    emis *= sec_per_year
+    return emis
+
+def get_grid_emissions(year, year_period, emis_data, grid_data,
+                       keep_time=False, chunk=None):
     # Ignore overflow warning.
     np.seterr(over='ignore')
     
-    emis = emis_data["Cfire"][year:year+year_period]
-    emis = np.multiply(emis,grid_data["cell_area"])
-    emis = np.multiply(emis, sec_per_year)
-    emis = np.array(emis)
-    emis[emis>1e30]=0.
-    
     if keep_time:
+        emis = get_yearly_emissions(year, year_period, emis_data, grid_data)
         last_yr = year+year_period
         if last_yr > 107:
-            nan_arr = np.empty((last_yr-108,360,720))*np.nan
+            nan_arr = np.empty((last_yr-108,360,720), dtype=emis.dtype)*np.nan
             emis = np.concatenate((emis,nan_arr),axis=0)
         return emis
-    emis = np.sum(emis, axis = 0)
+    emis = grid_ops.sum_over_time(get_yearly_emissions, year, year_period,
+                                  chunk, emis_data, grid_data)
     return emis
 
 def get_global_emissions_yearly(year, emis_data, grid_data):
     emissions_grid = get_grid_emissions(year, 1, emis_data, grid_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -75,45 +128,57 @@ def get_global_emissions_yearly(year, emis_data, grid_data):
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, year_period, emis_data, BA_data, monthly=False):
+def get_yearly_fire_data(year, year_period, emis_data, BA_data):
+    """
+    Returns the yearly emissions and burnt area used for the
+    fuel consumption, per unit area.
+    """
     # Using 1 year equal to 365.25 days.
     sec_per_year = 31557600.
     
-    # Ignore division by zero warning. Returns inf.
-    np.seterr(divide='ignore')
-    # Ignore overflow warning.
-    np.seterr(over='ignore')
-    
-    # Convert from percentage to decimal and eliminate meaningless values.
-    BA = BA_data["BA"][year:year+year_period]
-    BA = np.divide(BA,100.)
-    BA = np.array(BA)
-    BA[BA>1.] = 0
-    if not monthly:
-        BA = np.sum(BA, axis=0)
+    BA = get_burnt_area(BA_data)[year:year+year_period]
     
+    emis = get_emissions(emis_data)[year:year+year_period]
+    emis = np.multiply(emis, sec_per_year)
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or yearly, in which case the
+    yearly fuel consumption is summed.
+    """
     inv_BA = np.array(1./BA)
     # Remove infinities due to division by 0.
     inv_BA[inv_BA == np.inf] = 0
     
-    emis = emis_data["Cfire"][year:year+year_period]
-    emis = np.multiply(emis, sec_per_year)
-    emis = np.array(emis)
-    emis[emis>1e30]=0
-    if not monthly:
-        emis = np.sum(emis,axis=0)
-    
     fuel_consumption = np.multiply(emis, inv_BA)
     if monthly:
         fuel_consumption = np.sum(fuel_consumption, axis = 0)
     return fuel_consumption
 
+def get_grid_fuel_consumption(year, year_period, emis_data, BA_data,
+                              monthly=False, chunk=None):
+    # Ignore division by zero warning. Returns inf.
+    np.seterr(divide='ignore')
+    # Ignore overflow warning.
+    np.seterr(over='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_yearly_fire_data(start, count, emis_data, BA_data),
+                    monthly=True), year, year_period, chunk)
+    emis, BA = grid_ops.sum_over_time(get_yearly_fire_data, year,
+                                      year_period, chunk, emis_data, BA_data)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
+
     
 def get_global_mean_FC_yearly(year, emis_data, BA_data, grid_data): 
     FC_data = get_grid_fuel_consumption(year,1,emis_data, BA_data, grid_data) 
     
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
 
 
@@ -123,3 +188,47 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data,grid_data):
     global_mean_FC = total_emis/total_BA
     return global_mean_FC
 
+
+#
+# Fire Budget
+#
+
+def get_yearly_fire_budget(year, year_period, emis_data, BA_data, grid_data):
+    """
+    Returns the yearly emissions and burnt area grids, and the
+    yearly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    # Using 1 year equal to 365.25 days.
+    sec_per_year = 31557600.
+    cell_area = get_cell_area(grid_data)
+    
+    BA = get_burnt_area(BA_data)[year:year+year_period]
+    BA_grid = np.multiply(BA, cell_area)
+    
+    emis = get_emissions(emis_data)[year:year+year_period]
+    emis = np.multiply(emis, sec_per_year)
+    emis_grid = np.multiply(emis, cell_area)
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, year_period, emis_data, BA_data, grid_data,
+                    keep_time=False, monthly=False, chunk=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    emis, BA, fuel_consumption = grid_ops.fire_budget(
+                    get_yearly_fire_budget, calc_fuel_consumption,
+                    year, year_period, chunk,
+                    (emis_data, BA_data, grid_data), keep_time, monthly)
+    if keep_time:
+        last_yr = year+year_period
+        if last_yr > 107:
+            nan_arr = np.empty((last_yr-108,360,720), dtype=emis.dtype)*np.nan
+            emis = np.concatenate((emis,nan_arr),axis=0)
+            BA = np.concatenate((BA,nan_arr),axis=0)
+    return emis, BA, fuel_consumption
@@ -0,0 +1,268 @@
+"""
+This module is the registry of the model adapters, which declare
+once, for each model, what the spatial_comparison module needs to
+read its outputs: the inputs of each accessor, the first year of
+its record, whether it has monthly or yearly outputs, the names
+of its coordinates, and how its grid is converted to the standard
+format (latitudes from south to north, longitudes from -180 to
+180).
+
+Flipped latitudes are converted to the standard format as a view.
+Models with rolled longitudes write their grids in the standard
+format while reducing them (see grid_ops.place), so that no copy is
+made to standardise them.
+"""
+
+import numpy as np
+
+import jsbach_analysis as jsbach
+import clm_analysis as clm
+import ctem_analysis as ctem
+import blaze_analysis as blaze
+import orchidee_analysis as orchidee
+import inferno_analysis as inferno
+import spitfire_analysis as spitfire
+import mc2_analysis as mc2
+import globfirm_analysis as globfirm
+
+import gfed_analysis as gfed
+
+import data_registry as registry
+import grid_ops
+
+
+class ModelAdapter(object):
+    """
+    Declaration of how the outputs of a model are read and
+    standardised.
+
+    Argument inputs maps each kind of output ('budget', 'FC',
+    'emis' and 'BA') to the names, in the model module, of the
+    datasets passed to the corresponding accessor
+    (get_fire_budget, get_grid_fuel_consumption,
+    get_grid_emissions and get_grid_burnt_area), after the year
+    and period.
+
+    Argument first_year is the first year of the record, and
+    steps_per_year is 12 for monthly outputs and 1 for yearly ones.
+
+    If flip_lat is True the latitudes of the model go from north
+    to south, and if roll_lon is True its longitudes go from 0 to
+    360. Argument axes can give the longitudes and latitudes of
+    the grid directly, in the standard format, instead of reading
+    them from the grid file.
+
+    If orient_on_read is True the accessors of the model take an
+    orient keyword argument, and return their grids already in the
+    standard format.
+    """
+    def __init__(self, name, module, first_year, inputs, grid_name,
+                 steps_per_year=12, lon_name='longitude',
+                 lat_name='latitude', flip_lat=False, roll_lon=False,
+                 axes=None, orient_on_read=False):
+        self.name = name
+        self.module = module
+        self.first_year = first_year
+        self.inputs = inputs
+        self.grid_name = grid_name
+        self.steps_per_year = steps_per_year
+        self.lon_name = lon_name
+        self.lat_name = lat_name
+        self.flip_lat = flip_lat
+        self.roll_lon = roll_lon
+        self.axes = axes
+        self.orient_on_read = orient_on_read
+
+    def get_time(self, year):
+        """
+        Returns the year relative to the start of the record, for
+        the given year in absolute terms, e.g. 1997.
+        """
+        return year - self.first_year
+
+    def get_steps(self, year_period):
+        """
+        Returns the number of time steps of the given number of
+        years.
+        """
+        return year_period*self.steps_per_year
+
+    def get_args(self, kind):
+        """
+        Returns the datasets passed to the accessor of the given
+        kind of output.
+        """
+        return [getattr(self.module, name) for name in self.inputs[kind]]
+
+    def compute(self, kind, year, year_period, **kwargs):
+        """
+        Calls the accessor of the given kind of output for the given
+        year (in absolute terms) and period, with the model's inputs
+        and the given keyword arguments, and returns its result (a
+        grid or a tuple of grids) in the standard format.
+        """
+        function = {'budget': self.module.get_fire_budget,
+                    'FC': self.module.get_grid_fuel_consumption,
+                    'emis': self.module.get_grid_emissions,
+                    'BA': self.module.get_grid_burnt_area}[kind]
+        if self.orient_on_read:
+            kwargs['orient'] = self.get_orient()
+        result = function(self.get_time(year), self.get_steps(year_period),
+                          *self.get_args(kind), **kwargs)
+        if self.orient_on_read:
+            return result
+        if isinstance(result, tuple):
+            return tuple(self.to_standard(grid) for grid in result)
+        return self.to_standard(result)
+
+    def get_orient(self):
+        """
+        Returns the (flip_lat, roll_lon) pair of the model, as used
+        by grid_ops.place, or None if its grid is already in the
+        standard format.
+        """
+        if not (self.flip_lat or self.roll_lon):
+            return None
+        return (self.flip_lat, self.roll_lon)
+
+    def to_standard(self, grid):
+        """
+        Converts a grid of the model, with or without a time axis,
+        to the standard format. Flipped latitudes are returned as a
+        view of the grid.
+        """
+        return grid_ops.place(grid, self.get_orient())
+
+    def get_cell_area(self):
+        """
+        Returns the cell areas of the model in the standard format.
+        """
+        return self.to_standard(self.module.get_cell_area())
+
+    def to_per_area(self, grid):
+        """
+        Converts a standard grid in absolute units to per m^2 units.
+        """
+        return np.divide(grid, self.get_cell_area())
+
+    def get_lons_lats(self, standard=True):
+        """
+        Returns the longitudes and latitudes of the model, see
+        spatial_comparison.get_lons_lats.
+        """
+        if self.axes is not None:
+            # Given axes are already in the standard format.
+            lons, lats = np.array(self.axes[0]), np.array(self.axes[1])
+            if standard:
+                return lons, lats
+            return lons, lats, 0.
+        grid_data = getattr(self.module, self.grid_name)
+        lats = np.array(registry.get_static_field(grid_data, self.lat_name))
+        lons = np.array(registry.get_static_field(grid_data, self.lon_name))
+        lon_shift = 0.
+        if self.roll_lon:
+            lon_shift = np.max(lons)/2.
+        if standard:
+            if self.flip_lat:
+                lats = lats[::-1]
+            return lons - lon_shift, lats
+        return lons, lats, lon_shift
+
+
+ADAPTERS = {}
+
+
+def register(adapter):
+    """
+    Adds the given adapter to the registry, under its name.
+    """
+    ADAPTERS[adapter.name] = adapter
+    return adapter
+
+
+def get_adapter(model):
+    """
+    Returns the adapter of the given model.
+    """
+    return ADAPTERS[model]
+
+
+register(ModelAdapter('gfed', gfed, 1997,
+    {'budget': ['data_GFED', 'grid_GFED'],
+     'FC': ['data_GFED'],
+     'emis': ['data_GFED', 'grid_GFED'],
+     'BA': ['data_GFED', 'grid_GFED']},
+    'grid_GFED', flip_lat=True,
+    axes=(np.arange(-179.875, 180., 0.25), np.arange(-89.875, 90., 0.25))))
+
+register(ModelAdapter('jsbach', jsbach, 1700,
+    {'budget': ['emis_JSBACH', 'BA_JSBACH', 'grid_JSBACH'],
+     'FC': ['emis_JSBACH', 'BA_JSBACH'],
+     'emis': ['emis_JSBACH', 'grid_JSBACH'],
+     'BA': ['BA_JSBACH', 'grid_JSBACH']},
+    'grid_JSBACH', flip_lat=True, roll_lon=True, orient_on_read=True))
+
+register(ModelAdapter('clm', clm, 1700,
+    {'budget': ['emis_CLM', 'BA_CLM', 'grid_CLM', 'time_data'],
+     'FC': ['emis_CLM', 'BA_CLM', 'time_data'],
+     'emis': ['emis_CLM', 'grid_CLM', 'time_data'],
+     'BA': ['BA_CLM', 'grid_CLM', 'time_data']},
+    'grid_CLM', lon_name='lon', lat_name='lat', roll_lon=True,
+    orient_on_read=True))
+
+register(ModelAdapter('ctem', ctem, 1861,
+    {'budget': ['emis_CTEM', 'BA_CTEM', 'grid_CTEM', 'landCover_CTEM'],
+     'FC': ['emis_CTEM', 'BA_CTEM', 'landCover_CTEM'],
+     'emis': ['emis_CTEM', 'grid_CTEM', 'landCover_CTEM'],
+     'BA': ['BA_CTEM', 'grid_CTEM', 'landCover_CTEM']},
+    'grid_CTEM', lon_name='lon', lat_name='lat', roll_lon=True,
+    orient_on_read=True))
+
+register(ModelAdapter('blaze', blaze, 1700,
+    {'budget': ['emis_BLAZE', 'BA_BLAZE', 'grid_BLAZE', 'time_data'],
+     'FC': ['emis_BLAZE', 'BA_BLAZE', 'time_data'],
+     'emis': ['emis_BLAZE', 'grid_BLAZE', 'time_data'],
+     'BA': ['BA_BLAZE', 'grid_BLAZE']},
+    'grid_BLAZE', lon_name='lon', lat_name='lat'))
+
+register(ModelAdapter('orchidee', orchidee, 1700,
+    {'budget': ['emis_ORCHIDEE', 'BA_ORCHIDEE', 'grid_ORCHIDEE',
+                'landCover_ORCHIDEE', 'time_data'],
+     'FC': ['emis_ORCHIDEE', 'BA_ORCHIDEE', 'landCover_ORCHIDEE',
+            'time_data'],
+     'emis': ['emis_ORCHIDEE', 'grid_ORCHIDEE', 'landCover_ORCHIDEE',
+              'time_data'],
+     'BA': ['BA_ORCHIDEE', 'grid_ORCHIDEE', 'landCover_ORCHIDEE']},
+    'grid_ORCHIDEE', flip_lat=True))
+
+register(ModelAdapter('inferno', inferno, 1700,
+    {'budget': ['emis_INFERNO', 'BA_INFERNO', 'grid_INFERNO',
+                'landmask_INFERNO', 'landCover_INFERNO'],
+     'FC': ['emis_INFERNO', 'BA_INFERNO', 'landmask_INFERNO',
+            'landCover_INFERNO'],
+     'emis': ['emis_INFERNO', 'grid_INFERNO', 'landmask_INFERNO',
+              'landCover_INFERNO'],
+     'BA': ['BA_INFERNO', 'grid_INFERNO', 'landmask_INFERNO',
+            'landCover_INFERNO']},
+    'grid_INFERNO', roll_lon=True, orient_on_read=True))
+
+register(ModelAdapter('spitfire', spitfire, 1700,
+    {'budget': ['emis_SPITFIRE', 'BA_SPITFIRE', 'grid_SPITFIRE'],
+     'FC': ['emis_SPITFIRE', 'BA_SPITFIRE'],
+     'emis': ['emis_SPITFIRE', 'grid_SPITFIRE'],
+     'BA': ['BA_SPITFIRE', 'grid_SPITFIRE']},
+    'grid_SPITFIRE'))
+
+register(ModelAdapter('mc2', mc2, 1901,
+    {'budget': ['emis_MC2', 'BA_MC2', 'grid_MC2'],
+     'FC': ['emis_MC2', 'BA_MC2'],
+     'emis': ['emis_MC2', 'grid_MC2'],
+     'BA': ['BA_MC2', 'grid_MC2']},
+    'grid_MC2', steps_per_year=1))
+
+register(ModelAdapter('globfirm', globfirm, 1700,
+    {'budget': ['emis_GLOBFIRM', 'BA_GLOBFIRM', 'grid_GLOBFIRM'],
+     'FC': ['emis_GLOBFIRM', 'BA_GLOBFIRM'],
+     'emis': ['emis_GLOBFIRM', 'grid_GLOBFIRM'],
+     'BA': ['BA_GLOBFIRM', 'grid_GLOBFIRM']},
+    'grid_GLOBFIRM', steps_per_year=1))
@@ -0,0 +1,109 @@
+"""
+This module holds the monthly calendars of the models, used
+to convert monthly mean rates into monthly totals.
+
+The calendar of a model is computed once from a single read
+of its time axis, and the accessor functions of the model
+modules slice into it instead of looking up the time axis
+month by month.
+
+The lengths are returned in the precision of the grids, see
+grid_ops.set_precision.
+"""
+
+import numpy as np
+
+import data_registry as registry
+import grid_ops
+
+
+# Length in days given to months past the end of the time axis.
+FALLBACK_DAYS = 31
+
+# Calendars already computed, keyed by path and rule.
+_calendars = {}
+
+
+class MonthlyCalendar(object):
+    """
+    Lengths of all the months of a model's record, in days and
+    in seconds. Months past the end of the record are given a
+    length of FALLBACK_DAYS days.
+    """
+    def __init__(self, days_per_month, sec_per_month=None):
+        self.days_per_month = np.asarray(days_per_month, dtype='float64')
+        if sec_per_month is None:
+            sec_per_month = np.multiply(self.days_per_month, 86400)
+        self.sec_per_month = np.asarray(sec_per_month, dtype='float64')
+
+    def __len__(self):
+        return len(self.days_per_month)
+
+    def get_days_per_month(self, time, month_period):
+        """
+        Returns the length in days of each month in the given
+        period, where time is the index of the first month.
+        """
+        return self._slice(self.days_per_month, time, month_period,
+                           FALLBACK_DAYS)
+
+    def get_sec_per_month(self, time, month_period):
+        """
+        Returns the length in seconds of each month in the given
+        period, where time is the index of the first month.
+        """
+        return self._slice(self.sec_per_month, time, month_period,
+                           FALLBACK_DAYS*86400)
+
+    def _slice(self, lengths, time, month_period, fallback):
+        lengths = lengths[time:time+month_period]
+        no_missing = month_period - len(lengths)
+        if no_missing > 0:
+            lengths = np.concatenate((lengths,
+                                    np.repeat(float(fallback), no_missing)))
+        return grid_ops.to_precision(lengths)
+
+
+def calendar_from_days(time_axis):
+    """
+    Creates a calendar from a time axis given in days, where
+    the length of each month is the time to the next step. The
+    last month is given a length of FALLBACK_DAYS days.
+    """
+    time_axis = np.asarray(time_axis, dtype='float64')
+    days_per_month = np.append(np.diff(time_axis), FALLBACK_DAYS)
+    return MonthlyCalendar(days_per_month)
+
+
+def calendar_from_elapsed_seconds(time_axis):
+    """
+    Creates a calendar from a time axis given in seconds, where
+    the length of each month is the time since the previous
+    step, and the length of the first month is its time value
+    (as used by INFERNO).
+    """
+    time_axis = np.asarray(time_axis, dtype='float64')
+    sec_per_month = np.concatenate((time_axis[:1], np.diff(time_axis)))
+    return MonthlyCalendar(np.divide(sec_per_month, 86400.), sec_per_month)
+
+
+def get_calendar(time_data, rule='days'):
+    """
+    Returns the calendar for the time axis of the given dataset,
+    computed only once per file.
+
+    Argument rule can be 'days', for time axes in days where the
+    month length is the time to the next step, or 'elapsed_seconds'
+    for time axes in seconds where the month length is the time
+    since the previous step (INFERNO).
+    """
+    key = (registry.get_dataset_path(time_data), rule)
+    if key not in _calendars:
+        time_axis = registry.get_time_axis(time_data)
+        if rule == 'days':
+            _calendars[key] = calendar_from_days(time_axis)
+        elif rule == 'elapsed_seconds':
+            _calendars[key] = calendar_from_elapsed_seconds(time_axis)
+        else:
+            raise ValueError('Unknown calendar rule: ' + str(rule))
+    return _calendars[key]
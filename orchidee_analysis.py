@@ -1,51 +1,106 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
 
+import data_registry as registry
+import model_calendar
+import grid_ops
+import clean_store
 
-emis_ORCHIDEE = Dataset('../../model_data/ORCHIDEE_SF1_fFirepft.nc', 
-                'r', format = 'NETCDF4')             
-BA_ORCHIDEE = Dataset('../../model_data/ORCHIDEE_SF1_burntArea.nc', 
-                'r', format = 'NETCDF4')                              
-grid_ORCHIDEE = Dataset('../../model_data/HalfDegree-gridarea-8975-inverted.nc', 
-                    'r', format = 'NETCDF4')
-landCover_ORCHIDEE = Dataset('../../model_data/ORCHIDEE_SF1_landCoverFrac.nc', 
-                'r', format = 'NETCDF4')                                  
-                    
-# ORCHIDEE has no useful separate time data, must use JSBACH data which matches it.             
-time_data = Dataset('../../model_data/JSBACH_SF1_fFirepft.nc', 
-                'r', format = 'NETCDF4')
+emis_ORCHIDEE = registry.get_dataset('orchidee', 'emis_ORCHIDEE')
+BA_ORCHIDEE = registry.get_dataset('orchidee', 'BA_ORCHIDEE')
+grid_ORCHIDEE = registry.get_dataset('orchidee', 'grid_ORCHIDEE')
+landCover_ORCHIDEE = registry.get_dataset('orchidee', 'landCover_ORCHIDEE')
+time_data = registry.get_dataset('orchidee', 'time_data')
 
 
 #
-# Burnt Area Analysis
+# Calendar
 #
 
-def get_grid_burnt_area(year, month_period, BA_data, grid_data, 
-                        landCover_data, keep_time=False):
+def get_calendar(time_data=time_data):
+    """
+    Returns the cached monthly calendar of ORCHIDEE, taken from
+    the JSBACH time axis, which matches it.
+    """
+    return model_calendar.get_calendar(time_data)
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_ORCHIDEE):
+    """
+    Returns the cached cell areas of the ORCHIDEE grid.
+    """
+    return registry.get_static_field(grid_data, "cell_area",
+                                     dtype=grid_ops.get_dtype())
+
+
+#
+# Time Windows
+#
+
+def check_chunk(chunk):
+    """
+    Land cover is only given yearly, so the time windows read at
+    once must cover whole years.
+    """
+    if chunk and chunk % 12:
+        raise ValueError('ORCHIDEE chunks must be a multiple of 12 months, '
+                         'got ' + str(chunk))
+
+
+def _clean_land_cover(landCover):
     # Remove meaningless values (fill and small negative), and make decimal.
-    landCover = landCover_data["landCoverFrac"][year:int(year+month_period/12)]
-    landCover = np.array(landCover)
+    landCover = np.ma.getdata(landCover)
+    #landCover[landCover>100] = 0
     landCover = np.divide(landCover,100.)
-    landCover = np.repeat(landCover, 12, axis=0)    
-    
-    BA = BA_data["burntArea"][year*12:year*12+month_period]
-    BA = np.multiply(landCover, BA)
-    
+    return landCover
+
+
+def get_land_cover(time, month_period, landCover_data):
+    """
+    Returns the yearly land cover fractions of the years of the
+    given window, as (years, pft, lat, lon), which apply to the
+    months of each year through grid_ops.contract_pfts. They are
+    converted to decimals once per file, see clean_store.
+    """
+    year = time//12
+    landCover = clean_store.get_variable(landCover_data, "landCoverFrac",
+                                         _clean_land_cover)
+    return landCover[year:int(year+month_period/12)]
+
+
+#
+# Burnt Area Analysis
+#
+
+def get_monthly_burnt_area(time, month_period, BA_data, grid_data,
+                           landCover_data):
+    landCover = get_land_cover(time, month_period, landCover_data)
     
-    BA = np.sum(BA, axis=1)
+    BA = grid_ops.to_precision(BA_data["burntArea"][time:time+month_period])
+    BA = grid_ops.contract_pfts(BA, landCover, steps_per_cover=12)
     BA[BA>1e5]=0.
-    BA = np.multiply(BA, grid_data["cell_area"])
-    
+    BA *= get_cell_area(grid_data)
+    return BA
+
+def get_grid_burnt_area(year, month_period, BA_data, grid_data, 
+                        landCover_data, keep_time=False, chunk=None):
+    check_chunk(chunk)
+    time = int(year*12)
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return get_monthly_burnt_area(time, month_period, BA_data,
+                                      grid_data, landCover_data)
+    BA = grid_ops.sum_over_time(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data, landCover_data)
     return BA
     
 def get_global_BA_yearly(year, BA_data, grid_data, landCover_data):
     BA_grid = get_grid_burnt_area(year, 12, BA_data, grid_data, landCover_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -54,43 +109,38 @@ def get_global_BA_yearly(year, BA_data, grid_data, landCover_data):
 #
 
                 
+def get_monthly_emissions(time, month_period, emis_data, grid_data,
+                          landCover_data, time_data):
+    sec_per_month = get_calendar(time_data).get_sec_per_month(time, month_period)
+    
+    landCover = get_land_cover(time, month_period, landCover_data)
+
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    emis = np.ma.getdata(emis)
+    emis = grid_ops.contract_pfts(emis, landCover, get_cell_area(grid_data),
+                                  sec_per_month, steps_per_cover=12)
+    emis[emis==np.inf]=0.
+    return emis
+
 def get_grid_emissions(year, month_period, emis_data, grid_data, 
-                    landCover_data, time_data, keep_time=False):
+                    landCover_data, time_data, keep_time=False, chunk=None):
+    check_chunk(chunk)
     time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(time_data["time"]):
-            days_per_month.append(time_data["time"][time+i+1]-time_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
     
     # Ignore overflow warning.
     np.seterr(over='ignore')
     
-    # Remove meaningless values (fill and small negative), and make decimal.
-    landCover = landCover_data["landCoverFrac"][year:int(year+month_period/12.)]
-    landCover = np.array(landCover)
-    landCover = np.divide(landCover,100.)
-    landCover = np.repeat(landCover, 12, axis=0)
-
-    emis = emis_data["fFirepft"][time:time+month_period]
-    emis = np.array(emis)
-    emis = np.multiply(emis, landCover)
-    emis = np.sum(emis, axis=1)
-    emis = np.multiply(emis, grid_data["cell_area"])
-    emis = np.multiply(emis, sec_per_month[:, np.newaxis, np.newaxis])
-    emis[emis==np.inf]=0.
-    
     if keep_time:
-        return emis
-    emis = np.sum(emis, axis = 0)
+        return get_monthly_emissions(time, month_period, emis_data,
+                                     grid_data, landCover_data, time_data)
+    emis = grid_ops.sum_over_time(get_monthly_emissions, time, month_period,
+                    chunk, emis_data, grid_data, landCover_data, time_data)
     return emis
 
 def get_global_emissions_yearly(year, emis_data, grid_data, landCover_data, time_data):
     emissions_grid = get_grid_emissions(year, 12, emis_data, grid_data, 
                                         landCover_data, time_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -98,50 +148,39 @@ def get_global_emissions_yearly(year, emis_data, grid_data, landCover_data, time
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, 
-                            landCover_data, time_data, monthly=False):
-    time = int(year*12)
-    days_per_month = []
-    for i in range(month_period):
-        if time+i+1 < len(time_data["time"]):
-            days_per_month.append(time_data["time"][time+i+1]-time_data["time"][time+i])
-        else:
-            days_per_month.append(31)
-    sec_per_month = np.multiply(days_per_month, 86400)
-    
-    # Ignore division by zero warning. Returns inf or NaN.
-    np.seterr(divide='ignore')
-    # Ignore overflow warning.
-    np.seterr(over='ignore')
+def get_monthly_fire_data(time, month_period, emis_data, BA_data,
+                          landCover_data, time_data):
+    """
+    Returns the monthly emissions and burnt area used for the
+    fuel consumption, per unit area and summed over the pfts.
+    """
+    sec_per_month = get_calendar(time_data).get_sec_per_month(time, month_period)
     
-    # Remove meaningless values (fill and small negative), and make decimal.
-    landCover = landCover_data["landCoverFrac"][year:int(year+month_period/12.)]
-    landCover = np.array(landCover)
-    #landCover[landCover>100] = 0
-    landCover = np.divide(landCover,100.)
-    landCover = np.repeat(landCover, 12, axis=0)
-
-    BA = np.array(BA_data["burntArea"][time:time+month_period])
-    BA = np.multiply(landCover, BA)
+    landCover = get_land_cover(time, month_period, landCover_data)
 
+    BA = np.ma.getdata(BA_data["burntArea"][time:time+month_period])
+    BA = grid_ops.to_precision(BA)
     # Assume fractional, add up pft dependency.
-    BA = np.sum(BA, axis=1)
-    if not monthly:
-        BA=np.sum(BA,axis=0)
+    BA = grid_ops.contract_pfts(BA, landCover, steps_per_cover=12)
     
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    emis = np.ma.getdata(emis)
+    # Add up pft dependency.
+    emis = grid_ops.contract_pfts(emis, landCover, step_scale=sec_per_month,
+                                  steps_per_cover=12)
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or monthly, in which case the
+    monthly fuel consumption is summed.
+    """
     BA[BA>1e5]=0.
     inv_BA = 1./BA
     # Remove infinities.
     inv_BA[inv_BA==np.inf] = 0.
     
-    emis = emis_data["fFirepft"][time:time+month_period]
-    emis = np.array(emis)
-    emis= np.multiply(emis, landCover)
-    # Add up pft dependency.
-    emis = np.sum(emis, axis=1)
-    emis = np.multiply(emis,sec_per_month[:, np.newaxis, np.newaxis])
-    if not monthly:
-        emis = np.sum(emis, axis=0)
     emis[emis==np.inf]=0.
     
     fuel_consumption = np.multiply(emis, inv_BA)
@@ -149,12 +188,33 @@ def get_grid_fuel_consumption(year, month_period, emis_data, BA_data,
         fuel_consumption = np.sum(fuel_consumption, axis = 0)
     return fuel_consumption
 
+def get_grid_fuel_consumption(year, month_period, emis_data, BA_data, 
+                    landCover_data, time_data, monthly=False, chunk=None):
+    check_chunk(chunk)
+    time = int(year*12)
+    
+    # Ignore division by zero warning. Returns inf or NaN.
+    np.seterr(divide='ignore')
+    # Ignore overflow warning.
+    np.seterr(over='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_monthly_fire_data(start, count, emis_data, BA_data,
+                                           landCover_data, time_data),
+                    monthly=True), time, month_period, chunk)
+    emis, BA = grid_ops.sum_over_time(get_monthly_fire_data, time,
+                        month_period, chunk, emis_data, BA_data,
+                        landCover_data, time_data)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
+
     
 def get_global_mean_FC_yearly(year, emis_data, BA_data, grid_data, landCover_data, time_data):
     time = int(year*12)   
     FC_data = get_grid_fuel_consumption(year,12,emis_data, BA_data, landCover_data, time_data) 
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
     
     
@@ -162,5 +222,58 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data, grid_data, landCov
     total_emis = get_global_emissions_yearly(year,emis_data,grid_data,landCover_data,time_data)
     total_BA = get_global_BA_yearly(year,BA_data,grid_data,landCover_data)
     global_mean_FC = total_emis/total_BA
-    return global_mean_FC  
+    return global_mean_FC
+
 
+#
+# Fire Budget
+#
+
+def get_monthly_fire_budget(time, month_period, emis_data, BA_data,
+                            grid_data, landCover_data, time_data):
+    """
+    Returns the monthly emissions and burnt area grids, and the
+    monthly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    sec_per_month = get_calendar(time_data).get_sec_per_month(time, month_period)
+    cell_area = get_cell_area(grid_data)
+    
+    landCover = get_land_cover(time, month_period, landCover_data)
+    
+    BA_grid = BA_data["burntArea"][time:time+month_period]
+    BA_grid = grid_ops.to_precision(BA_grid)
+    BA = np.ma.getdata(BA_grid)
+    BA_grid = grid_ops.contract_pfts(BA_grid, landCover, steps_per_cover=12)
+    BA_grid[BA_grid>1e5]=0.
+    BA_grid *= cell_area
+    # Assume fractional, add up pft dependency.
+    BA = grid_ops.contract_pfts(BA, landCover, steps_per_cover=12)
+    
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    emis = np.ma.getdata(emis)
+    # Add up pft dependency, the cell areas do not depend on the pft.
+    emis = grid_ops.contract_pfts(emis, landCover, step_scale=sec_per_month,
+                                  steps_per_cover=12)
+    emis_grid = np.multiply(emis, cell_area)
+    emis_grid[emis_grid==np.inf]=0.
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, month_period, emis_data, BA_data, grid_data,
+                    landCover_data, time_data, keep_time=False, monthly=False,
+                    chunk=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    check_chunk(chunk)
+    time = int(year*12)
+    
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    return grid_ops.fire_budget(get_monthly_fire_budget,
+                    calc_fuel_consumption, time, month_period, chunk,
+                    (emis_data, BA_data, grid_data, landCover_data, time_data),
+                    keep_time, monthly)
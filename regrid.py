@@ -0,0 +1,369 @@
+"""
+This module regrids fields between the grids of the models,
+replacing repeated calls to scipy.interpolate.griddata.
+
+The interpolation weights from a source grid to a set of target
+points are computed once, for each interpolation method, as a
+sparse (target points x source cells) matrix, and stored under
+REGRID_DIR, so that regridding any number of fields (or every
+time step of a cube) is a single sparse product.
+
+Besides nearest neighbour and linear interpolation, fields can be
+remapped conservatively between regular lat/lon grids: each target
+cell takes the area-weighted mean of the source cells it overlaps,
+so that totals (value times cell area) are kept.
+"""
+
+import os
+import hashlib
+
+import numpy as np
+import scipy.sparse as sparse
+import scipy.spatial as spatial
+
+
+REGRID_DIR = './cache/regrid/'
+
+# Bump when the computation of the weights changes, so that
+# previously stored weights are no longer used.
+REGRID_VERSION = 1
+
+# Set to False to never store the weights on disk.
+persist = True
+
+# Interpolation methods with precomputed weights.
+METHODS = ['nearest', 'linear', 'conservative']
+
+# Regridders already built, keyed by their cache key.
+_regridders = {}
+
+
+class Regridder(object):
+    """
+    Regrids fields on the regular grid given by the 1-D arrays
+    src_lons and src_lats (in the standard orientation) to the
+    points given by the arrays dst_lons and dst_lats, which can
+    have any shape (e.g. from np.meshgrid), with the given method.
+
+    The results match those of scipy.interpolate.griddata with
+    the same method: points outside the convex hull of the source
+    grid are set to NaN for linear interpolation.
+    
+    For conservative remapping, the targets must be a regular grid
+    too, given either by 1-D arrays or by the 2-D arrays returned by
+    np.meshgrid, and the fields must be given per unit of grid area
+    (e.g. load_var_grid with per_area set to True). NaN source cells
+    are left out of the mean.
+    """
+    def __init__(self, src_lons, src_lats, dst_lons, dst_lats,
+                 method='nearest', weights=None, outside=None):
+        self.src_shape = (len(src_lats), len(src_lons))
+        if method == 'conservative':
+            dst_lons, dst_lats = get_axes(dst_lons, dst_lats)
+            self.dst_shape = (len(dst_lats), len(dst_lons))
+        else:
+            self.dst_shape = np.shape(dst_lons)
+        self.method = method
+        if weights is None:
+            weights, outside = compute_weights(src_lons, src_lats,
+                                        dst_lons, dst_lats, method)
+        self.weights = weights
+        # Target points without a value, or None.
+        self.outside = outside
+
+    def regrid(self, grid):
+        """
+        Returns the given source grid, or cube with a time axis,
+        on the target points. Masked values are used as they are,
+        as griddata does.
+        """
+        grid_shape = np.shape(grid)
+        lead_shape = grid_shape[:len(grid_shape)-2]
+        cells = self.src_shape[0]*self.src_shape[1]
+        data = np.reshape(np.ma.getdata(grid), (-1, cells))
+        missing = None
+        if self.method == 'conservative':
+            missing = np.isnan(data)
+        if missing is not None and missing.any():
+            # Renormalise the weights over the valid source cells.
+            covered = np.asarray(self.weights.dot((~missing).T)).T
+            data = np.where(missing, 0., data)
+            new_grid = np.asarray(self.weights.dot(data.T)).T
+            new_grid = np.divide(new_grid, covered)
+        else:
+            new_grid = np.asarray(self.weights.dot(data.T)).T
+        if self.outside is not None:
+            new_grid[:,self.outside] = np.nan
+        return np.reshape(new_grid, lead_shape + self.dst_shape)
+
+    def regrid_cells(self, values, src_index, dst_index):
+        """
+        Returns the values given at the flat source cells src_index,
+        with or without leading axes, at the flat target points
+        dst_index, with every other source cell taken as zero (see the
+        land_cells module). The results are those of regrid at the
+        same points, from a product restricted to the given cells.
+        """
+        lead_shape = np.shape(values)[:-1]
+        weights = self.weights[dst_index][:,src_index]
+        data = np.reshape(np.ma.getdata(values), (-1, len(src_index)))
+        missing = None
+        if self.method == 'conservative':
+            missing = np.isnan(data)
+        if missing is not None and missing.any():
+            # The cells left out are zeros, so they are covered.
+            total = np.asarray(self.weights.sum(axis=1)).ravel()[dst_index]
+            covered = total - np.asarray(weights.dot(missing.T)).T
+            data = np.where(missing, 0., data)
+            new_values = np.asarray(weights.dot(data.T)).T
+            new_values = np.divide(new_values, covered)
+        else:
+            new_values = np.asarray(weights.dot(data.T)).T
+        if self.outside is not None:
+            new_values[:,self.outside[dst_index]] = np.nan
+        return np.reshape(new_values, lead_shape + (len(dst_index),))
+
+    def get_targets(self, src_index):
+        """
+        Returns the flat indices, in increasing order, of the target
+        points which take a value from the source cells at the flat
+        indices src_index, or have no value. Every other target point
+        is zero if the other source cells are.
+        """
+        reached = np.asarray(abs(self.weights[:,src_index]).sum(axis=1))
+        reached = reached.ravel() > 0
+        if self.outside is not None:
+            reached |= self.outside
+        return np.flatnonzero(reached)
+
+
+def get_regridder(src_lons, src_lats, dst_lons, dst_lats, method='nearest'):
+    """
+    Returns the Regridder for the given grids and method. Its
+    weights are only computed once, and are then loaded from
+    REGRID_DIR in later runs.
+    """
+    if method == 'conservative':
+        dst_lons, dst_lats = get_axes(dst_lons, dst_lats)
+    key = get_key(src_lons, src_lats, dst_lons, dst_lats, method)
+    if key not in _regridders:
+        weights, outside = load(key)
+        if weights is None:
+            weights, outside = compute_weights(src_lons, src_lats,
+                                        dst_lons, dst_lats, method)
+            if persist:
+                save(key, weights, outside)
+        _regridders[key] = Regridder(src_lons, src_lats, dst_lons, dst_lats,
+                                     method, weights, outside)
+    return _regridders[key]
+
+
+def regrid(grid, src_lons, src_lats, dst_lons, dst_lats, method='nearest'):
+    """
+    Regrids the given grid, as done by the Regridder of the given
+    grids and method.
+    """
+    return get_regridder(src_lons, src_lats, dst_lons, dst_lats,
+                         method).regrid(grid)
+
+
+def get_key(src_lons, src_lats, dst_lons, dst_lats, method):
+    """
+    Returns the key of the weights for the given grids and method.
+    """
+    description = hashlib.sha1(repr((REGRID_VERSION, method)).encode('utf-8'))
+    for coords in (src_lons, src_lats, dst_lons, dst_lats):
+        coords = np.ascontiguousarray(coords, dtype='float64')
+        description.update(repr(coords.shape).encode('utf-8'))
+        description.update(coords.tobytes())
+    return description.hexdigest()
+
+
+def compute_weights(src_lons, src_lats, dst_lons, dst_lats, method):
+    """
+    Returns the sparse interpolation weights from the given source
+    grid to the given target points, of shape (target points,
+    source cells), and the boolean array of the target points
+    without a value (or None if every point has one).
+    """
+    if method not in METHODS:
+        raise ValueError('No precomputed weights for method ' + method)
+    if method == 'conservative':
+        return compute_conservative_weights(src_lons, src_lats,
+                                            dst_lons, dst_lats)
+    src_lons, src_lats = np.meshgrid(src_lons, src_lats)
+    points = np.column_stack((src_lons.ravel(), src_lats.ravel()))
+    targets = np.column_stack((np.ravel(dst_lons), np.ravel(dst_lats)))
+    no_targets = len(targets)
+    if method == 'nearest':
+        tree = spatial.cKDTree(points)
+        index = tree.query(targets)[1]
+        weights = sparse.csr_matrix((np.ones(no_targets),
+                                     (np.arange(no_targets), index)),
+                                    shape=(no_targets, len(points)))
+        return weights, None
+    # Barycentric weights of the vertices of the enclosing triangle,
+    # as used by griddata.
+    triangulation = spatial.Delaunay(points)
+    simplex = triangulation.find_simplex(targets)
+    outside = simplex < 0
+    inside = np.nonzero(~outside)[0]
+    simplex = simplex[inside]
+    transform = triangulation.transform[simplex]
+    offset = targets[inside] - transform[:,2]
+    coords = np.einsum('ijk,ik->ij', transform[:,:2], offset)
+    coords = np.column_stack((coords, 1. - coords.sum(axis=1)))
+    rows = np.repeat(inside, 3)
+    cols = triangulation.simplices[simplex].ravel()
+    weights = sparse.csr_matrix((coords.ravel(), (rows, cols)),
+                                shape=(no_targets, len(points)))
+    if not outside.any():
+        outside = None
+    return weights, outside
+
+
+def compute_conservative_weights(src_lons, src_lats, dst_lons, dst_lats):
+    """
+    Returns the first-order conservative weights from the given
+    source grid to the given target grid, both regular, in the
+    same form as compute_weights. The weight of a source cell is
+    the fraction of the covered area of the target cell that it
+    overlaps. Target cells that overlap no source cell have no
+    value.
+    """
+    dst_lons, dst_lats = get_axes(dst_lons, dst_lats)
+    # Overlap areas are separable on a regular grid: the overlap
+    # in longitude times the overlap in the sine of latitude.
+    dst_south, dst_north = get_bounds(dst_lats, 90.)
+    src_south, src_north = get_bounds(src_lats, 90.)
+    lat_overlap = get_overlaps(np.sin(np.radians(dst_south)),
+                               np.sin(np.radians(dst_north)),
+                               np.sin(np.radians(src_south)),
+                               np.sin(np.radians(src_north)))
+    dst_west, dst_east = get_bounds(dst_lons)
+    src_west, src_east = get_bounds(src_lons)
+    lon_overlap = get_overlaps(dst_west, dst_east, src_west, src_east,
+                               period=360.)
+    overlap = sparse.kron(lat_overlap, lon_overlap, format='csr')
+    covered = np.asarray(overlap.sum(axis=1)).ravel()
+    outside = covered == 0
+    scale = np.divide(1., np.where(outside, 1., covered))
+    weights = sparse.diags(scale, 0).dot(overlap).tocsr()
+    if not outside.any():
+        outside = None
+    return weights, outside
+
+
+def get_axes(lons, lats):
+    """
+    Returns the 1-D longitude and latitude axes of a regular grid,
+    given either as 1-D axes or as 2-D arrays from np.meshgrid.
+    """
+    lons = np.asarray(lons)
+    lats = np.asarray(lats)
+    if lons.ndim == 2:
+        lons = lons[0,:]
+    if lats.ndim == 2:
+        lats = lats[:,0]
+    return lons, lats
+
+
+def get_bounds(centres, limit=None):
+    """
+    Returns the lower and upper bounds of the cells with the given
+    1-D array of centres, in increasing or decreasing order. Cell
+    edges are halfway between the centres, and are clipped to
+    [-limit, limit] if limit is given.
+    """
+    centres = np.asarray(centres, dtype='float64')
+    edges = np.empty(len(centres)+1)
+    edges[1:-1] = (centres[1:] + centres[:-1])/2.
+    edges[0] = centres[0] - (centres[1]-centres[0])/2.
+    edges[-1] = centres[-1] + (centres[-1]-centres[-2])/2.
+    if limit is not None:
+        edges = np.clip(edges, -limit, limit)
+    return np.minimum(edges[:-1], edges[1:]), np.maximum(edges[:-1], edges[1:])
+
+
+def get_overlaps(dst_low, dst_high, src_low, src_high, period=None):
+    """
+    Returns the sparse matrix of the lengths of the overlaps
+    between the target cells and the source cells, of shape
+    (target cells, source cells), from the bounds of the cells.
+    If period is given, the axis is periodic (e.g. longitudes).
+    """
+    shifts = [0.]
+    if period is not None:
+        shifts = [-period, 0., period]
+    rows, cols, lengths = [], [], []
+    for shift in shifts:
+        low = np.maximum(dst_low[:,np.newaxis], src_low[np.newaxis,:] + shift)
+        high = np.minimum(dst_high[:,np.newaxis], src_high[np.newaxis,:] + shift)
+        row, col = np.nonzero(high > low)
+        rows.append(row)
+        cols.append(col)
+        lengths.append((high - low)[row, col])
+    return sparse.csr_matrix((np.concatenate(lengths),
+                              (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(len(dst_low), len(src_low)))
+
+
+def load(key):
+    """
+    Returns the weights and outside points stored under the given
+    key, or (None, None) if they are not stored.
+    """
+    path = _get_file(key)
+    if not persist or not os.path.exists(path):
+        return None, None
+    try:
+        stored = np.load(path)
+        weights = sparse.csr_matrix((stored['data'], stored['indices'],
+                                     stored['indptr']),
+                                    shape=tuple(stored['shape']))
+        outside = stored['outside']
+        stored.close()
+    except (IOError, ValueError, KeyError):
+        # Incomplete or corrupted file, recompute it.
+        return None, None
+    if not outside.any():
+        outside = None
+    return weights, outside
+
+
+def save(key, weights, outside):
+    """
+    Stores the given weights and outside points under the given key.
+    """
+    if not os.path.isdir(REGRID_DIR):
+        os.makedirs(REGRID_DIR)
+    if outside is None:
+        outside = np.zeros(weights.shape[0], dtype='bool')
+    path = _get_file(key)
+    # Write to a temporary file first, so that an interrupted run
+    # never leaves partial weights under the final name.
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'wb')
+    try:
+        np.savez(f, data=weights.data, indices=weights.indices,
+                 indptr=weights.indptr, shape=np.array(weights.shape),
+                 outside=outside)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+
+def clear():
+    """
+    Deletes all the stored weights.
+    """
+    _regridders.clear()
+    if not os.path.isdir(REGRID_DIR):
+        return
+    for name in os.listdir(REGRID_DIR):
+        if name.endswith('.npz'):
+            os.remove(os.path.join(REGRID_DIR, name))
+
+
+def _get_file(key):
+    return os.path.join(REGRID_DIR, key + '.npz')
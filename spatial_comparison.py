@@ -10,74 +10,74 @@ import matplotlib.pyplot as plt
 import matplotlib.colors as clb
 from mpl_toolkits.basemap import Basemap, cm, interp
 import scipy.interpolate as intrplt
-
-import jsbach_analysis as jsbach
-import clm_analysis as clm
-import ctem_analysis as ctem
-import blaze_analysis as blaze
-import orchidee_analysis as orchidee
-import inferno_analysis as inferno
-import spitfire_analysis as spitfire
-import mc2_analysis as mc2
-import globfirm_analysis as globfirm
+import scipy.sparse as sparse
 
 import gfed_analysis as gfed
 
+import data_registry as registry
+import grid_cache
+import grid_ops
+import cube_store
+import regrid
+import land_cells
+import model_adapters as adapters
+
+# Analysis module of each model.
+MODEL_MODULES = dict((model, adapter.module)
+                     for model, adapter in adapters.ADAPTERS.items())
+
 
 #
 # Regional Analysis Toolkit
 #
 
+# Regions already generated, keyed by region type and model grid.
+_regions = {}
+
+# Region matrices already built, keyed like _regions.
+_region_matrices = {}
+
 def create_box_regions(lons,lats):
     """
     Roughly based on GFED regions and
     GPP (gross primary production) data.
     See http://tinyurl.com/h6zvduw.
+    
+    Returns an integer array of the region (1 to 12) of each
+    cell, for the given arrays of longitudes and latitudes.
     """
-    regions = np.empty(lons.shape)
-    for index,lon in np.ndenumerate(lons):
-        lat = lats[index]
-        if -170.<=lon<-30.:
-            if 45.<=lat<90.:
-                regions[index]=1
-            elif 20.<=lat<45.:
-                regions[index]=2
-            elif -25.<=lat<20.:
-                regions[index]=3
-            else:
-                regions[index]=4
-        elif -30.<=lon<60:
-            if 45.<=lat<90.:
-                regions[index]=5
-            elif 15.<=lat<45.:
-                regions[index]=6
-            elif -15.<=lat<15.:
-                regions[index]=7
-            else:
-                regions[index]=8
-        else:
-            if 45.<=lat<90.:
-                regions[index]=9
-            elif 20.<=lat<45.:
-                regions[index]=10
-            elif -10.<=lat<20.:
-                regions[index]=11
-            else:
-                regions[index]=12
+    lons = np.asarray(lons)
+    lats = np.asarray(lats)
+    americas = (-170.<=lons) & (lons<-30.)
+    europe_africa = (-30.<=lons) & (lons<60)
+    north = (45.<=lats) & (lats<90.)
+    # The first matching condition gives the region, and
+    # every other cell is in region 12.
+    conditions = [americas & north,
+                  americas & (20.<=lats) & (lats<45.),
+                  americas & (-25.<=lats) & (lats<20.),
+                  americas,
+                  europe_africa & north,
+                  europe_africa & (15.<=lats) & (lats<45.),
+                  europe_africa & (-15.<=lats) & (lats<15.),
+                  europe_africa,
+                  north,
+                  (20.<=lats) & (lats<45.),
+                  (-10.<=lats) & (lats<20.)]
+    regions = np.select(conditions, range(1, 12), default=12)
     return regions
 
 
 def interp_regions(lons, lats, var='none'):
-    regions_GFED = gfed.grid_GFED["basis_regions"]
-    regions_GFED = np.array(regions_GFED)
-
-    lats_gfed = np.arange(-89.875, 90.,0.25)
-    lats_gfed = lats_gfed[::-1]
-    lons_gfed = np.arange(-179.875, 180.,0.25)
-    lons_gfed, lats_gfed = np.meshgrid(lons_gfed, lats_gfed)
-    
-    regions = intrplt.griddata((lons_gfed.ravel(),lats_gfed.ravel()), 
-                  regions_GFED.ravel(), (lons,lats), method='nearest')
+    """
+    Returns the GFED basis regions at the given arrays of longitudes
+    and latitudes, using nearest neighbour interpolation with weights
+    that are only computed once for each grid.
+    """
+    regions_GFED = np.array(gfed.get_basis_regions())[::-1,:]
+    lons_gfed, lats_gfed = get_lons_lats('gfed')
+    regions = regrid.regrid(regions_GFED, lons_gfed, lats_gfed,
+                            lons, lats, method='nearest')
     return regions
 
 
@@ -92,81 +92,11 @@ def get_lons_lats(model, standard=True):
     as the shift that would have been given to the
     standardised format. Used only for tests and 
     checks.
+    
+    The coordinates are those declared by the model's adapter,
+    see the model_adapters module.
     """
-    if model=='gfed':
-        lats = np.arange(-89.875, 90.,0.25)
-        lons = np.arange(-179.875, 180.,0.25)
-        lon_shift = 0.
-    elif model=='jsbach':
-        lats = jsbach.grid_JSBACH["latitude"]
-        lons = jsbach.grid_JSBACH["longitude"]
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = np.max(lons)/2.
-        if standard:
-            lats = lats[::-1]
-            lons = lons - lon_shift
-    elif model=='clm':
-        lats = clm.grid_CLM["lat"]
-        lons = clm.grid_CLM["lon"]
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = np.max(lons)/2.
-        if standard:
-            lons = lons - lon_shift
-    elif model=='ctem':
-        lats = ctem.grid_CTEM["lat"]
-        lons = ctem.grid_CTEM["lon"]
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = np.max(lons)/2.
-        if standard:
-            lons = lons - lon_shift
-    elif model=='blaze':
-        lats = blaze.grid_BLAZE["lat"]
-        lons = blaze.grid_BLAZE["lon"]
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = 0.
-    elif model=='orchidee':
-        lats = orchidee.grid_ORCHIDEE["latitude"]
-        lons = orchidee.grid_ORCHIDEE["longitude"]
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = 0.
-        if standard:
-            lats = lats[::-1]
-    elif model=='inferno':
-        lats = inferno.grid_INFERNO["latitude"]
-        lons = inferno.grid_INFERNO["longitude"]  
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = np.max(lons)/2.
-        if standard:
-            lons = lons - lon_shift
-    elif model=='spitfire':
-        lats = spitfire.grid_SPITFIRE["latitude"]
-        lons = spitfire.grid_SPITFIRE["longitude"]
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = 0.
-    elif model=='mc2':
-        lats = mc2.grid_MC2["latitude"]
-        lons = mc2.grid_MC2["longitude"]
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = 0
-    elif model=='globfirm':
-        lats = globfirm.grid_GLOBFIRM["latitude"]
-        lons = globfirm.grid_GLOBFIRM["longitude"]
-        lats = np.array(lats)
-        lons = np.array(lons)
-        lon_shift = 0
-        
-    if standard:
-        return lons, lats
-    else:
-        return lons, lats, lon_shift
+    return adapters.get_adapter(model).get_lons_lats(standard)
 
 def generate_regions(model='gfed', reg_type='boxes', plot=False):
     """
@@ -179,25 +109,38 @@ def generate_regions(model='gfed', reg_type='boxes', plot=False):
     respectively. The boxed latlon regions are the preferred method
     and are the default.
     
+    The regions are returned as a read-only integer array, and are
+    only generated once for each model grid and region type.
+    
     Argument plot can be set to True to show regions on map.
     """
     no_interp = False
     if reg_type=='gfed' and model=='gfed':
         no_interp = True
+        title = 'GFED Regions'
+        key = (reg_type, model)
     else:
         lons, lats = get_lons_lats(model)
-      
-    lons, lats = np.meshgrid(lons, lats)
+        key = (reg_type, lons.tobytes(), lats.tobytes())
+        if reg_type=='gfed':
+            title = 'GFED Regions Interpolated for ' + model.upper()
+        else:
+            title = 'Boxed Regions in '+ model.upper() + ' resolution'
+    
+    if key not in _regions:
+        if no_interp:
+            region_data = gfed.get_basis_regions()[::-1,:]
+        else:
+            lons, lats = np.meshgrid(lons, lats)
+            if reg_type=='gfed':
+                region_data = interp_regions(lons, lats)
+            else:
+                region_data = create_box_regions(lons,lats)
+        region_data = np.array(region_data, dtype='int')
+        region_data.setflags(write=False)
+        _regions[key] = region_data
+    region_data = _regions[key]
     
-    if no_interp:
-        region_data = gfed.grid_GFED["basis_regions"]
-        region_data = region_data[::-1,:]
-    elif reg_type=='gfed':
-        title = 'GFED Regions Interpolated for ' + model.upper()
-        region_data = interp_regions(lons, lats)
-    else:
-        title = 'Boxed Regions in '+ model.upper() + ' resolution'
-        region_data = create_box_regions(lons,lats)
     if plot:
         fig=plt.figure()
         m = Basemap(llcrnrlon=-180,llcrnrlat=-90, 
@@ -213,13 +156,23 @@ def generate_regions(model='gfed', reg_type='boxes', plot=False):
         return region_data
 
 
+def get_region_map(region_data, region):
+    """
+    Returns a map that is 1 in the given region and 0 in every
+    other region. Region 0 is the whole globe.
+    """
+    if region == 0:
+        return np.ones(region_data.shape)
+    return np.equal(region_data, region).astype('float64')
+
+
 def get_regional_var_grid(year, year_period, region, model, 
                        var, reg_type='boxes', grid=False,
                         per_area = False, keep_time=False,
-                        all_regions=False):
+                        all_regions=False, chunk_months=None):
     if type(grid) is bool:
         full_grid = load_var_grid(year,year_period,model,var,
-                                    per_area,keep_time)
+                                    per_area,keep_time,chunk_months)
     else:
         full_grid = grid
     region_data = generate_regions(model, reg_type)
@@ -227,24 +180,207 @@ def get_regional_var_grid(year, year_period, region, model,
     if all_regions:
         region_grid_list = []
         for region in range(13):
-            # Set desired region to 1 and every other region to 0.
-            region_map = np.copy(region_data)
-            region_map[region_map != region] = 0.
-            region_map[region_map == region] = 1.
+            region_map = get_region_map(region_data, region)
             
             regional_grid = np.multiply(full_grid, region_map)
             region_grid_list.append(regional_grid)
         region_grid_list = np.array(region_grid_list)
         return region_grid_list
     
-    # Set desired region to 1 and every other region to 0.
-    region_data[region_data != region] = 0.
-    region_data[region_data == region] = 1.
-    
-    regional_grid = np.multiply(full_grid, region_data)
+    region_map = get_region_map(region_data, region)
+
+    regional_grid = np.multiply(full_grid, region_map)
     return regional_grid
 
+
+def get_regional_sums(grid, region_data, no_regions=13):
+    """
+    Returns the totals of the grid over each region of the given
+    region labels, as returned by generate_regions, without building
+    a grid for each region. Region 0 is the whole globe.
+
+    If the grid has a time axis (e.g. from load_var_grid with
+    keep_time set to True), the totals are given for each time step,
+    as an array of shape (time, no_regions). Otherwise the array has
+    shape (no_regions,). Masked cells count as zero. The totals are
+    summed in float64, whatever the precision of the grid.
+    
+    The grid and the labels can also be compressed with the same
+    layout (see get_land_cells), which gives the same totals.
+    """
+    labels = np.asarray(region_data).ravel()
+    cells = len(labels)
+    data = np.ma.filled(grid, 0.)
+    data = np.reshape(data, (-1, cells))
+    sums = np.empty((len(data), no_regions))
+    for step in range(len(data)):
+        # Segment sums over the labels, one pass per time step.
+        step_sums = np.bincount(labels, weights=data[step],
+                                minlength=no_regions)
+        sums[step] = step_sums[:no_regions]
+        sums[step,0] = np.sum(step_sums)
+    if np.ndim(grid) == np.ndim(region_data):
+        return sums[0]
+    return sums
+
+
+def get_regional_totals(year, year_period, model, var, reg_type='boxes',
+                        grid=False, per_area=False, keep_time=False,
+                        no_regions=13, chunk_months=None, cells=None):
+    """
+    Returns the totals of the given variable over each region, as
+    returned by get_regional_sums, for region 0 (the whole globe)
+    up to no_regions-1. The values are loaded compressed with
+    load_var_cells, unless a grid is given with the grid argument,
+    which is compressed with the layout cells if given (see
+    get_land_cells).
+
+    This replaces get_regional_var_grid with all_regions set to True
+    when only the regional totals are needed, and never builds a grid
+    for each region.
     
+    Argument reg_type can also be a sparse region matrix, as returned
+    by get_region_matrix or create_region_matrix, in which case the
+    totals are weighted by the fraction of each cell in each region.
+    """
+    if type(grid) is bool:
+        cells = get_land_cells(model, year, year_period, chunk_months)
+        grid = load_var_cells(year,year_period,model,var,per_area,
+                              keep_time,chunk_months,cells)
+    if sparse.issparse(reg_type):
+        if cells is not None:
+            reg_type = cells.compress_matrix(reg_type)
+        return apply_region_matrix(grid, reg_type)
+    region_data = generate_regions(model, reg_type)
+    if cells is not None:
+        region_data = cells.compress(region_data)
+    return get_regional_sums(grid, region_data, no_regions)
+
+
+def get_yearly_totals(sums, year_period):
+    """
+    Sums the regional totals of each time step, as returned by
+    get_regional_sums, over each year. Returns an array of shape
+    (year_period, no_regions).
+    """
+    sums = np.asarray(sums)
+    return np.sum(np.reshape(sums, (year_period, -1, sums.shape[-1])),
+                  axis=1)
+
+
+def create_region_matrix(weight_maps):
+    """
+    Returns a sparse matrix of shape (regions, cells) from the given
+    list of maps, one for each region, of the fraction of each cell
+    that is in the region. Cells are in the order of the flattened
+    maps. Any mask (e.g. countries or biomes) on the model grid can
+    be turned into a region set in this way.
+    """
+    rows = []
+    for weights in weight_maps:
+        rows.append(sparse.csr_matrix(np.ravel(np.ma.filled(weights, 0.)),
+                                      dtype='float64'))
+    return sparse.vstack(rows, format='csr')
+
+
+def create_label_matrix(region_data, no_regions=13):
+    """
+    Returns the sparse region matrix of the given integer region
+    labels, as returned by generate_regions, for region 0 (the whole
+    globe) up to no_regions-1. Each cell has weight 1 in its region.
+    """
+    labels = np.asarray(region_data).ravel()
+    cells = np.arange(len(labels))
+    in_set = (labels > 0) & (labels < no_regions)
+    # Row 0 takes every cell, the other rows the cells of their label.
+    rows = np.concatenate([np.zeros(len(labels), dtype='int'),
+                           labels[in_set]])
+    cols = np.concatenate([cells, cells[in_set]])
+    weights = np.ones(len(rows))
+    return sparse.csr_matrix((weights, (rows, cols)),
+                             shape=(no_regions, len(labels)))
+
+
+def create_lat_band_matrix(lats, no_lons, bands):
+    """
+    Returns the sparse region matrix of the given latitude bands,
+    given as (south, north) pairs in degrees, for a grid with the
+    given latitudes of the cell centres (in either order) and
+    number of longitudes.
+    
+    Cells split by the edge of a band have the fraction of their
+    area inside the band as weight, so that no area is counted
+    twice or lost between neighbouring bands.
+    """
+    south, north = regrid.get_bounds(lats, 90.)
+    south = np.radians(south)
+    north = np.radians(north)
+    # Cell area is proportional to the difference of the sines.
+    cell_area = np.sin(north) - np.sin(south)
+    weight_maps = []
+    for band_south, band_north in bands:
+        low = np.maximum(south, np.radians(band_south))
+        high = np.minimum(north, np.radians(band_north))
+        overlap = np.clip(np.sin(high) - np.sin(low), 0., None)
+        fraction = np.divide(overlap, cell_area)
+        weight_maps.append(np.repeat(fraction[:,np.newaxis], no_lons, axis=1))
+    return create_region_matrix(weight_maps)
+
+
+def get_region_matrix(model='gfed', reg_type='boxes', no_regions=13,
+                      bands=None):
+    """
+    Returns the sparse region matrix, of shape (regions, cells), of
+    the given region type for the grid of the given model. It is only
+    built once for each model grid and region set.
+    
+    Argument reg_type can be 'boxes' or 'gfed' for the regions of
+    generate_regions, with region 0 as the whole globe, or 'lat_bands'
+    for the latitude bands given as (south, north) pairs with the
+    bands argument.
+    """
+    if reg_type == 'lat_bands':
+        lons, lats = get_lons_lats(model)
+        bands = tuple(tuple(band) for band in bands)
+        key = (reg_type, lats.tobytes(), len(lons), bands)
+        if key not in _region_matrices:
+            _region_matrices[key] = create_lat_band_matrix(lats, len(lons),
+                                                           bands)
+        return _region_matrices[key]
+    region_data = generate_regions(model, reg_type)
+    # The labels are cached by generate_regions for each model grid,
+    # and never freed, so the same grid always gives the same array.
+    key = (reg_type, id(region_data), no_regions)
+    if key not in _region_matrices:
+        _region_matrices[key] = create_label_matrix(region_data, no_regions)
+    return _region_matrices[key]
+
+
+def apply_region_matrix(grid, region_matrix):
+    """
+    Returns the weighted totals of the grid over each region of the
+    given sparse region matrix, as a single sparse product. If the
+    grid has a time axis, the totals are given for each time step,
+    as an array of shape (time, regions). Otherwise the array has
+    shape (regions,). Masked cells count as zero. The totals are
+    summed in float64, whatever the precision of the grid.
+    
+    The grid can also be compressed, with the region matrix
+    restricted to its cells (see land_cells.LandCells.compress_matrix).
+    """
+    cells = region_matrix.shape[1]
+    data = np.ma.filled(grid, 0.)
+    data = np.reshape(np.asarray(data, dtype='float64'), (-1, cells))
+    sums = np.asarray(region_matrix.dot(data.T)).T
+    # Compressed vectors have a single cell axis, grids two.
+    cell_ndim = 2
+    if np.shape(grid)[-1] == cells:
+        cell_ndim = 1
+    if np.ndim(grid) == cell_ndim:
+        return sums[0]
+    return sums
+
+
     
 #generate_regions('spitfire', plot=True)
 
@@ -254,7 +390,7 @@ def get_regional_var_grid(year, year_period, region, model,
 #
 
 def load_var_grid(year, year_period, model, var='FC', 
-                    per_area=True, keep_time=False):
+                    per_area=True, keep_time=False, chunk_months=None):
     """
     Year is in absolute terms, e.g. 1997.
     
@@ -274,270 +410,372 @@ def load_var_grid(year, year_period, model, var='FC',
     time data or if it will be summed over it. Default is False. This is
     used in the temporal comparison module, and only works for emissions
     and burnt area.
+    
+    chunk_months argument is the number of months read from the
+    source files at a time when summing over time, so that long periods
+    can be summed with bounded memory. Default is None, which reads the
+    whole period at once. For ORCHIDEE it must be a multiple of 12, and
+    for MC2 and GLOBFIRM it is rounded down to whole years.
+    
+    Grids summed over time are taken from load_fire_budget, which
+    computes the emissions, burnt area and fuel consumption together
+    from a single read of the model's inputs.
+    
+    Grids are stored in the on-disk cache of the grid_cache module,
+    so each grid is only computed once across runs, unless its source
+    files change. If the cube of the variable has been exported with
+    export_cubes, grids with keep_time set to True and per_area set
+    to False are read-only, memory-mapped views of the cube.
+    
+    Grids are computed in the precision set by
+    grid_ops.set_precision, which is part of their cache key. Views
+    of exported cubes are float64 in both modes.
     """
-    year_adj = year-1700
-    year_ctem = year-1861
-    year_mc2 = year - 1901
-    year_gfed = year-1997
+    if keep_time and not per_area and var != 'FC':
+        grid = cube_store.get_cube_slice(model, var, year, year_period)
+        if grid is not None:
+            return grid
+    if var == 'FC' or not keep_time:
+        emis, BA, FC = load_fire_budget(year, year_period, model, chunk_months)
+        grid = {'emis': emis, 'BA': BA, 'FC': FC}[var]
+        # Convert to per m^2 units if output is for map.
+        if per_area and var != 'FC':
+            grid = adapters.get_adapter(model).to_per_area(grid)
+        return grid
+    args = (year, year_period, model, var, per_area, keep_time, chunk_months)
+    return grid_cache.cached('load_var_grid', args + (grid_ops.precision,),
+                        registry.get_model_paths(model),
+                        lambda: compute_var_grid(*args))
+
+
+def load_fire_budget(year, year_period, model, chunk_months=None,
+                     mmap_mode=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids of
+    the given model, summed over the given period, as (emis, BA, FC),
+    in the standard orientation and in absolute units (i.e. not per
+    m^2). Year is in absolute terms, e.g. 1997.
+    
+    The three grids are computed together from a single read of the
+    model's inputs, and stored together in the on-disk cache. See
+    load_var_grid for the chunk_months argument. If mmap_mode is
+    given (e.g. 'r'), cached grids are memory-mapped.
+    """
+    args = (year, year_period, model, chunk_months, grid_ops.precision)
+    return grid_cache.cached_group('load_fire_budget', args,
+                        registry.get_model_paths(model),
+                        lambda: compute_fire_budget(year, year_period, model,
+                                            chunk_months=chunk_months), 3,
+                        mmap_mode)
+
+
+def load_var_points(year, year_period, model, cells, var='FC',
+                    per_area=True, chunk_months=None):
+    """
+    Returns the values of the grid returned by load_var_grid at the
+    given flat indices of cells of the standard grid, e.g. the cells
+    of field observations. Year is in absolute terms, e.g. 1997.
+    
+    The summed grids are memory-mapped from the on-disk cache, so
+    only the pages holding the given cells are read once the grid
+    has been cached.
+    """
+    emis, BA, FC = load_fire_budget(year, year_period, model, chunk_months,
+                                    mmap_mode='r')
+    grid = {'emis': emis, 'BA': BA, 'FC': FC}[var]
+    values = np.ravel(grid)[cells]
+    if per_area and var != 'FC':
+        cell_area = adapters.get_adapter(model).get_cell_area()
+        values = np.divide(values, np.ravel(cell_area)[cells])
+    return values
+
+
+def load_fire_series(year, year_period, model):
+    """
+    Returns the monthly (yearly for MC2 and GLOBFIRM) emissions and
+    burnt area grids of the given model, as (emis, BA), in the
+    standard orientation and in absolute units. Year is in absolute
+    terms, e.g. 1997.
+    
+    If both cubes have been exported with export_cubes, they are
+    served from the cube store. Otherwise both series are computed
+    from a single read of the model's inputs.
+    """
+    emis = cube_store.get_cube_slice(model, 'emis', year, year_period)
+    BA = cube_store.get_cube_slice(model, 'BA', year, year_period)
+    if emis is not None and BA is not None:
+        return emis, BA
+    args = (year, year_period, model, grid_ops.precision)
+    return grid_cache.cached_group('load_fire_series', args,
+                        registry.get_model_paths(model),
+                        lambda: compute_fire_budget(year, year_period, model,
+                                                    keep_time=True)[:2], 2)
+
+
+def export_cubes(model, year, year_period, var_list=['emis','BA']):
+    """
+    Exports the monthly (yearly for MC2 and GLOBFIRM) grids of the
+    given variables for the given model, from the given year (in
+    absolute terms, e.g. 1997) for year_period years, to the cube
+    store, in the standard orientation and in absolute units
+    (i.e. not per m^2).
+    
+    Once exported, load_var_grid serves the time series used by
+    the temporal comparison module as views of the stored cubes.
+    """
+    for var in var_list:
+        cube = None
+        for i in range(year_period):
+            grid = compute_var_grid(year+i, 1, model, var,
+                                    per_area=False, keep_time=True)
+            if cube is None:
+                cube = cube_store.create_cube(model, var, year_period,
+                                              grid.shape[1:])
+            steps = len(grid)
+            cube[i*steps:(i+1)*steps] = np.ma.filled(grid, 0.)
+        cube_store.finish_cube(model, var, year, cube)
+
+
+def compute_fire_budget(year, year_period, model, keep_time=False,
+                        chunk_months=None):
+    """
+    Computes the grids returned by load_fire_budget from the source
+    files, bypassing the cache. If keep_time is True, the emissions
+    and burnt area grids keep their time axis.
+    """
+    adapter = adapters.get_adapter(model)
+    return adapter.compute('budget', year, year_period, keep_time=keep_time,
+                           chunk=get_chunk(model, chunk_months))
+
+
+def convert_to_standard(grid, model):
+    """
+    Converts a grid of the given model, with or without a time
+    axis, to the standard format: latitudes from south to north,
+    and longitudes from -180 to 180. The orientation of each model
+    is declared by its adapter, see the model_adapters module.
+    """
+    return adapters.get_adapter(model).to_standard(grid)
+
+
+def get_chunk(model, chunk_months):
+    """
+    Returns the chunk size, in time steps of the given model,
+    for the given number of months.
+    """
+    # MC2 and GLOBFIRM have yearly outputs, so read whole years.
+    if chunk_months and adapters.get_adapter(model).steps_per_year == 1:
+        return max(chunk_months//12, 1)
+    return chunk_months
+
+
+def compute_var_grid(year, year_period, model, var='FC', 
+                    per_area=True, keep_time=False, chunk_months=None):
+    """
+    Computes a single grid returned by load_var_grid from the source
+    files, bypassing the cache and reading only the inputs of the
+    given variable. See load_var_grid for details.
+    """
+    adapter = adapters.get_adapter(model)
+    chunk = get_chunk(model, chunk_months)
     if var == 'FC':
-        if model == 'gfed':
-            grid = gfed.get_grid_fuel_consumption(year_gfed,year_period*12,
-                                                     gfed.data_GFED)
-            # Convert to standard format.
-            grid = grid[::-1,:]
-        elif model == 'jsbach':
-            grid = jsbach.get_grid_fuel_consumption(year_adj,year_period*12,
-                                     jsbach.emis_JSBACH,jsbach.BA_JSBACH)
-            # Convert to standard format.
-            grid = grid[::-1,:]
-            grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-        elif model == 'clm':
-            grid = clm.get_grid_fuel_consumption(year_adj,year_period*12,
-                               clm.emis_CLM,clm.BA_CLM,clm.time_data)
-            # Convert to standard format.
-            grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-        elif model == 'ctem':
-            grid = ctem.get_grid_fuel_consumption(year_ctem,year_period*12,
-                         ctem.emis_CTEM,ctem.BA_CTEM,ctem.landCover_CTEM)
-            # Convert to standard format.
-            grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-        elif model == 'blaze':
-            grid = blaze.get_grid_fuel_consumption(year_adj,year_period*12,
-                               blaze.emis_BLAZE,blaze.BA_BLAZE,blaze.time_data)
-        elif model == 'orchidee':
-            grid = orchidee.get_grid_fuel_consumption(year_adj,year_period*12,
-                     orchidee.emis_ORCHIDEE,orchidee.BA_ORCHIDEE,
-                     orchidee.landCover_ORCHIDEE,orchidee.time_data)
-            # Convert to standard format.
-            grid = grid[::-1,:]
-        elif model == 'inferno':
-            grid = inferno.get_grid_fuel_consumption(year_adj,year_period*12,
-                     inferno.emis_INFERNO,inferno.BA_INFERNO,
-                     inferno.landmask_INFERNO,inferno.landCover_INFERNO)
-            # Convert to standard format.
-            grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-        elif model == 'spitfire':
-            grid = spitfire.get_grid_fuel_consumption(year_adj, year_period*12,
-                    spitfire.emis_SPITFIRE,spitfire.BA_SPITFIRE)
-        elif model == 'mc2':
-            grid = mc2.get_grid_fuel_consumption(year_mc2, year_period,
-                    mc2.emis_MC2,mc2.BA_MC2)
-        elif model == 'globfirm':
-            grid = globfirm.get_grid_fuel_consumption(year_adj, year_period,
-                    globfirm.emis_GLOBFIRM,globfirm.BA_GLOBFIRM)
-    elif var == 'emis':
-        if model == 'gfed':
-            grid = gfed.get_grid_emissions(year_gfed,year_period*12,
-                                       gfed.data_GFED, gfed.grid_GFED,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = grid[:,::-1,:]
-            else:
-                grid = grid[::-1,:]
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, gfed.grid_GFED["grid_cell_area"])
-        elif model == 'jsbach':
-            grid = jsbach.get_grid_emissions(year_adj,year_period*12,
-                                         jsbach.emis_JSBACH, jsbach.grid_JSBACH,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = grid[:,::-1,:]
-                grid = np.roll(grid, len(grid[0,0,:])/2,axis=2)
-            else:
-                grid = grid[::-1,:]
-                grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, jsbach.grid_JSBACH["area"])
-        elif model == 'clm':
-            grid = clm.get_grid_emissions(year_adj,year_period*12,
-                                clm.emis_CLM,clm.grid_CLM,clm.time_data,
-                                keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = np.roll(grid, len(grid[0,0,:])/2,axis=2)
-            else:
-                grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, clm.grid_CLM["cell_area"])
-        elif model == 'ctem':
-            grid = ctem.get_grid_emissions(year_ctem,year_period*12,
-                         ctem.emis_CTEM,ctem.grid_CTEM,ctem.landCover_CTEM,
-                                       keep_time=keep_time)  
-            # Convert to standard format.
-            if keep_time:
-                grid = np.roll(grid, len(grid[0,0,:])/2,axis=2)
-            else:
-                grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, ctem.grid_CTEM["cell_area"])
-        elif model == 'blaze':
-            grid = blaze.get_grid_emissions(year_adj,year_period*12,
-                               blaze.emis_BLAZE,blaze.grid_BLAZE,blaze.time_data,
-                                       keep_time=keep_time)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, blaze.grid_BLAZE["cell_area"])
-        elif model == 'orchidee':
-            grid = orchidee.get_grid_emissions(year_adj,year_period*12,
-                     orchidee.emis_ORCHIDEE,orchidee.grid_ORCHIDEE,
-                     orchidee.landCover_ORCHIDEE,orchidee.time_data,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = grid[:,::-1,:]
-            else:
-                grid = grid[::-1,:]
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, orchidee.grid_ORCHIDEE["cell_area"])
-        elif model == 'inferno':
-            grid = inferno.get_grid_emissions(year_adj,year_period*12,
-                     inferno.emis_INFERNO,inferno.grid_INFERNO,
-                     inferno.landmask_INFERNO,inferno.landCover_INFERNO,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = np.roll(grid, len(grid[0,0,:])/2,axis=2)
-            else:
-                grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, inferno.grid_INFERNO["cell_area"])
-        elif model == 'spitfire':
-            grid = spitfire.get_grid_emissions(year_adj, year_period*12,
-                    spitfire.emis_SPITFIRE,spitfire.grid_SPITFIRE,
-                                       keep_time=keep_time)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, spitfire.grid_SPITFIRE["cell_area"])
-        elif model == 'mc2':
-            grid = mc2.get_grid_emissions(year_mc2, year_period,
-                    mc2.emis_MC2,mc2.grid_MC2, keep_time = keep_time)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, mc2.grid_MC2["cell_area"])
-        elif model == 'globfirm':
-            grid = globfirm.get_grid_emissions(year_adj, year_period,
-                    globfirm.emis_GLOBFIRM,globfirm.grid_GLOBFIRM,
-                    keep_time=keep_time)            
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, globfirm.grid_GLOBFIRM["cell_area"])
-        
-    elif var == 'BA':
-        if model == 'gfed':
-            grid = gfed.get_grid_burnt_area(year_gfed,year_period*12,
-                                          gfed.data_GFED, gfed.grid_GFED,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = grid[:,::-1,:]
-            else:
-                grid = grid[::-1,:]
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, gfed.grid_GFED["grid_cell_area"])
-        elif model == 'jsbach':
-            grid = jsbach.get_grid_burnt_area(year_adj,year_period*12,
-                                         jsbach.BA_JSBACH, jsbach.grid_JSBACH,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = grid[:,::-1,:]
-                grid = np.roll(grid, len(grid[0,0,:])/2,axis=2)
-            else:
-                grid = grid[::-1,:]
-                grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, jsbach.grid_JSBACH["area"])
-        elif model == 'clm':
-            grid = clm.get_grid_burnt_area(year_adj,year_period*12,
-                                clm.BA_CLM,clm.grid_CLM,clm.time_data,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = np.roll(grid, len(grid[0,0,:])/2,axis=2)
-            else:
-                grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, clm.grid_CLM["cell_area"])
-        elif model == 'ctem':
-            grid = ctem.get_grid_burnt_area(year_ctem,year_period*12,
-                         ctem.BA_CTEM,ctem.grid_CTEM,ctem.landCover_CTEM,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = np.roll(grid, len(grid[0,0,:])/2,axis=2)
-            else:
-                grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, ctem.grid_CTEM["cell_area"])
-        elif model == 'blaze':
-            grid = blaze.get_grid_burnt_area(year_adj,year_period*12,
-                               blaze.BA_BLAZE,blaze.grid_BLAZE,
-                                       keep_time=keep_time)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, blaze.grid_BLAZE["cell_area"])
-        elif model == 'orchidee':
-            grid = orchidee.get_grid_burnt_area(year_adj,year_period*12,
-                     orchidee.BA_ORCHIDEE,orchidee.grid_ORCHIDEE,
-                     orchidee.landCover_ORCHIDEE,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = grid[:,::-1,:]
-            else:
-                grid = grid[::-1,:]
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, orchidee.grid_ORCHIDEE["cell_area"])
-        elif model == 'inferno':
-            grid = inferno.get_grid_burnt_area(year_adj,year_period*12,
-                     inferno.BA_INFERNO,inferno.grid_INFERNO,
-                     inferno.landmask_INFERNO,inferno.landCover_INFERNO,
-                                       keep_time=keep_time)
-            # Convert to standard format.
-            if keep_time:
-                grid = np.roll(grid, len(grid[0,0,:])/2,axis=2)
-            else:
-                grid = np.roll(grid, len(grid[0,:])/2,axis=1)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, inferno.grid_INFERNO["cell_area"])
-        elif model == 'spitfire':
-            grid = spitfire.get_grid_burnt_area(year_adj, year_period*12,
-                    spitfire.BA_SPITFIRE,spitfire.grid_SPITFIRE,
-                                       keep_time=keep_time)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, spitfire.grid_SPITFIRE["cell_area"])
-        elif model == 'mc2':
-            grid = mc2.get_grid_burnt_area(year_mc2, year_period,
-                    mc2.BA_MC2,mc2.grid_MC2, keep_time = keep_time)
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, mc2.grid_MC2["cell_area"])
-        elif model == 'globfirm':
-            grid = globfirm.get_grid_burnt_area(year_adj, year_period,
-                    globfirm.BA_GLOBFIRM,globfirm.grid_GLOBFIRM,
-                    keep_time=keep_time)            
-            # Convert to per m^2 units if output is for map.
-            if per_area:
-                grid = np.divide(grid, globfirm.grid_GLOBFIRM["cell_area"])
-                            
+        grid = adapter.compute('FC', year, year_period, chunk=chunk)
+    else:
+        grid = adapter.compute(var, year, year_period, keep_time=keep_time,
+                               chunk=chunk)
+    # Convert to per m^2 units if output is for map.
+    if per_area and var != 'FC':
+        grid = adapter.to_per_area(grid)
     return grid
 
 
+#
+# Compressed Land Cells
+#
+
+# Layouts already built, keyed by model, period and precision.
+_land_cells = {}
+
+def get_land_cells(model, year, year_period, chunk_months=None):
+    """
+    Returns the compressed layout, as a land_cells.LandCells, of the
+    standard grid of the given model for the given period, which
+    keeps the cells where the emissions, burnt area or fuel
+    consumption summed over the period are not zero. Year is in
+    absolute terms, e.g. 1997.
+    
+    The grids of load_var_grid for the period, with or without their
+    time axis, are zero (or masked) in every other cell, so the
+    statistics can be computed on the values of load_var_cells only.
+    The layout is computed from the grids of load_fire_budget, and
+    stored in the on-disk cache. See load_var_grid for the
+    chunk_months argument.
+    """
+    key = (model, year, year_period, grid_ops.precision)
+    if key not in _land_cells:
+        args = (year, year_period, model, grid_ops.precision)
+        burnt = grid_cache.cached('get_land_cells', args,
+                        registry.get_model_paths(model),
+                        lambda: compute_burnt_cells(year, year_period, model,
+                                                    chunk_months))
+        _land_cells[key] = land_cells.from_mask(burnt)
+    return _land_cells[key]
+
+
+def compute_burnt_cells(year, year_period, model, chunk_months=None):
+    """
+    Returns the boolean grid of the cells kept by the layout of
+    get_land_cells, bypassing the cache.
+    """
+    burnt = None
+    for grid in load_fire_budget(year, year_period, model, chunk_months,
+                                 mmap_mode='r'):
+        grid_burnt = np.ma.filled(grid, 0.) != 0
+        if burnt is None:
+            burnt = grid_burnt
+        else:
+            burnt |= grid_burnt
+    return burnt
+
+
+def load_var_cells(year, year_period, model, var='FC', per_area=True,
+                   keep_time=False, chunk_months=None, cells=None):
+    """
+    Returns the values of the grid returned by load_var_grid (see
+    there for the arguments) at the cells of the given layout, by
+    default the layout of the model for the given period (see
+    get_land_cells), as a compressed vector, with the time axis first
+    if keep_time is True. Year is in absolute terms, e.g. 1997.
+    
+    Summed grids are memory-mapped from the on-disk cache, and
+    converted to per m^2 units after compressing them.
+    """
+    if cells is None:
+        cells = get_land_cells(model, year, year_period, chunk_months)
+    if var == 'FC' or not keep_time:
+        emis, BA, FC = load_fire_budget(year, year_period, model, chunk_months,
+                                        mmap_mode='r')
+        grid = {'emis': emis, 'BA': BA, 'FC': FC}[var]
+    else:
+        grid = load_var_grid(year, year_period, model, var, per_area=False,
+                             keep_time=True, chunk_months=chunk_months)
+    values = cells.compress(grid)
+    if per_area and var != 'FC':
+        cell_area = adapters.get_adapter(model).get_cell_area()
+        values = np.divide(values, cells.compress(cell_area))
+    return values
+
+
+def get_region_cells(model, reg_type, cells):
+    """
+    Returns the region labels of generate_regions for the given model
+    and region type, compressed with the given layout.
+    """
+    return cells.compress(generate_regions(model, reg_type))
+
+
+def get_interp_targets(src_model, src_cells, dst_model, method):
+    """
+    Returns the layout of the grid of dst_model of the cells that
+    interpolating values compressed with the layout src_cells of the
+    grid of src_model, with the given method (see interp_grid), can
+    make non-zero. Methods without precomputed weights keep every cell.
+    """
+    src_lons, src_lats = get_lons_lats(src_model)
+    lons, lats = np.meshgrid(*get_lons_lats(dst_model))
+    if method not in regrid.METHODS:
+        return land_cells.from_mask(np.ones(np.shape(lons), dtype='bool'))
+    regridder = regrid.get_regridder(src_lons, src_lats, lons, lats, method)
+    return land_cells.LandCells(regridder.get_targets(src_cells.index),
+                                np.shape(lons))
+
+
+def interp_cells(values, src_model, src_cells, dst_model, dst_cells, method):
+    """
+    Interpolates the values compressed with the layout src_cells of
+    the grid of src_model to the grid of dst_model, as interp_grid
+    does for the full grids, and returns them compressed with the
+    layout dst_cells, which should hold the cells returned by
+    get_interp_targets.
+    """
+    src_lons, src_lats = get_lons_lats(src_model)
+    lons, lats = np.meshgrid(*get_lons_lats(dst_model))
+    if method not in regrid.METHODS:
+        grid = interp_grid(src_cells.expand(values), src_lons, src_lats,
+                           lons, lats, method)
+        return dst_cells.compress(grid)
+    regridder = regrid.get_regridder(src_lons, src_lats, lons, lats, method)
+    return regridder.regrid_cells(values, src_cells.index, dst_cells.index)
+
+
+
+#
+# Map Binning
+#
+
+# Colour classes of the binned maps, for each kind of map and variable.
+# Each class goes from one edge up to (not including) the next, and the
+# last class has no upper bound. The lowest edge is excluded, so zero is
+# left out, unless include_lowest is set. Cells are set to the index of
+# their class, or to the given values if any. Ticks and bounds are those
+# of the colourbar.
+DIFF_BINS = {'edges': [-100,-50,0,50,100,150,200,300],
+             'include_lowest': True,
+             'values': [-120,-60,0,20,40,60,80,100],
+             'ticks': [-100,-50,0,50,100,150,200,300,'>500'],
+             'bounds': [-120,-60,0,20,40,60,80,100,120]}
+
+MAP_BINS = {
+    'map': {
+        'FC': {'edges': [0.,.05,.1,.2,.5,1.,2.,5.,10.],
+               'ticks': [0,.05,.1,.2,.5,1.,2.,5.,10.,'>20.0']},
+        'emis': {'edges': [0.,.005,.01,.02,.05,.1,.2,.5,1.],
+                 'ticks': [0.,.005,.01,.02,.05,.1,.2,.5,1.,'>5.0']},
+        'BA': {'edges': [0.,.002,.005,.01,.02,.05,.1,.2,.5],
+               'ticks': [0,.002,.005,.01,.02,.05,.1,.2,.5,'>1.0']},
+    },
+    'diff': {'FC': DIFF_BINS, 'emis': DIFF_BINS, 'BA': DIFF_BINS},
+    'std': {
+        'FC': {'edges': [0.,0.1,0.5,1,2,3,4,5,10],
+               'ticks': [0,0.1,0.5,1,2,3,4,5,10,'>20.0']},
+        'emis': {'edges': [0.,0.01,0.05,0.1,0.15,0.2,0.25,0.3,0.4],
+                 'ticks': [0,0.01,0.05,0.1,0.15,0.2,0.25,0.3,0.35,'>0.4']},
+        'BA': {'edges': [0.,0.01,0.05,0.1,0.2,0.3,0.5,0.7,1.],
+               'ticks': [0,0.01,0.05,0.1,0.2,0.3,0.5,0.7,1,'>2.0']},
+    },
+}
+
+
+def bin_grid(grid, kind, var):
+    """
+    Classifies every cell of the grid into the colour classes of
+    MAP_BINS for the given kind of map ('map', 'diff' or 'std') and
+    variable. Cells outside all the classes (e.g. NaN) are left
+    unchanged.
+    
+    Returns the binned grid, and the ticks and bounds to use for
+    the colourbar.
+    """
+    bins = MAP_BINS[kind][var]
+    edges = np.array(bins['edges'], dtype='float64')
+    values = np.array(bins.get('values', range(len(edges))), dtype='float64')
+    bounds = bins.get('bounds', range(len(edges)+1))
+    
+    data = np.ma.getdata(grid)
+    # NaN compares as False, so it is never in a class.
+    if bins.get('include_lowest', False):
+        in_bins = data >= edges[0]
+    else:
+        in_bins = data > edges[0]
+    classes = np.digitize(data, edges) - 1
+    binned = np.where(in_bins, values[classes], data)
+    if np.ma.isMaskedArray(grid):
+        # Cells given a class are no longer masked.
+        binned = np.ma.masked_array(binned,
+                            mask=np.ma.getmaskarray(grid) & ~in_bins)
+    return binned, bins['ticks'], bounds
+
+
 def plot_map(year, year_period, model, var='FC', 
          region=0, reg_type='boxes', binned=True, save=False):
     """
@@ -589,103 +827,32 @@ def plot_map(year, year_period, model, var='FC',
         elif year>2008:
             return 'No data for given time period.'            
     
-    grid = load_var_grid(year, year_period, model, var)
+    cells = get_land_cells(model, year, year_period)
+    values = load_var_cells(year, year_period, model, var, cells=cells)
     if region != 0:
-        grid = get_regional_var_grid(year, year_period, region, 
-                                    model, var, reg_type)
+        region_data = get_region_cells(model, reg_type, cells)
+        values = np.multiply(values, region_data == region)
     
     # Convert zeroes to NaNs and take yearly mean.
-    grid[grid==0]=np.nan
+    values[values==0]=np.nan
     if var != 'FC':
-        grid = np.divide(grid, year_period)
+        values = np.divide(values, year_period)
                 
     
     if var == 'FC':
         title = 'Fuel Consumption'
         units = '($kg\, C\, m^{-2}\, burned$)'
-        if binned:
-            ticks=[0,.05,.1,.2,.5,1.,2.,5.,10.,'>20.0']
-            bounds=[0,1,2,3,4,5,6,7,8,9]
-            for index,value in np.ndenumerate(grid):
-                bin = 'nan'
-                if 0.<value<0.05:
-                    bin = 0
-                elif 0.05<=value<0.1:
-                    bin = 1
-                elif 0.1<=value<0.2:
-                    bin = 2
-                elif 0.2<=value<0.5:
-                    bin = 3
-                elif 0.5<=value<1.:
-                    bin = 4
-                elif 1.<=value<2.:
-                    bin = 5
-                elif 2.<=value<5.:
-                    bin = 6
-                elif 5.<=value<10.:
-                    bin = 7
-                elif 10.<=value:
-                    bin = 8
-                if bin != 'nan':    
-                    grid[index] = bin
     elif var == 'emis':
         title = 'Carbon Emissions'
         units = '($kg\, C\, m^{-2}\, year^{-1}$)'
-        if binned:
-            ticks=[0.,.005,.01,.02,.05,.1,.2,.5,1.,'>5.0']
-            bounds=[0,1,2,3,4,5,6,7,8,9]
-            for index,value in np.ndenumerate(grid):
-                bin = 'nan'
-                if 0.<value<0.005:
-                    bin = 0
-                elif 0.005<=value<0.01:
-                    bin = 1
-                elif 0.01<=value<0.02:
-                    bin = 2
-                elif 0.02<=value<0.05:
-                    bin = 3
-                elif 0.05<=value<0.1:
-                    bin = 4
-                elif 0.1<=value<0.2:
-                    bin = 5
-                elif 0.2<=value<0.5:
-                    bin = 6
-                elif 0.5<=value<1.:
-                    bin = 7
-                elif 1.<=value:
-                    bin = 8
-                if bin != 'nan':    
-                    grid[index] = bin
     elif var == 'BA':
         title = 'Burnt Area'
         # Due to recurring fires in <year, not normalised.
         units = '(Fraction Burned per Year)'
-        if binned:
-            ticks=[0,.002,.005,.01,.02,.05,.1,.2,.5,'>1.0']
-            bounds=[0,1,2,3,4,5,6,7,8,9]
-            for index,value in np.ndenumerate(grid):
-                bin = 'nan'
-                if 0.<value<0.002:
-                    bin = 0
-                elif 0.002<=value<0.005:
-                    bin = 1
-                elif 0.005<=value<0.01:
-                    bin = 2
-                elif 0.01<=value<0.02:
-                    bin = 3
-                elif 0.02<=value<0.05:
-                    bin = 4
-                elif 0.05<=value<0.1:
-                    bin = 5
-                elif 0.1<=value<0.2:
-                    bin = 6
-                elif 0.2<=value<0.5:
-                    bin = 7
-                elif 0.5<=value:
-                    bin = 8
-                if bin != 'nan':    
-                    grid[index] = bin
-    
+    if binned:
+        values, ticks, bounds = bin_grid(values, 'map', var)
+    # Cells left out of the layout are zeros, i.e. NaNs.
+    grid = cells.expand(values, fill=np.nan)
     
     fig=plt.figure(figsize=(14,10))
     m = Basemap(llcrnrlon=-180,llcrnrlat=-90, 
@@ -757,10 +924,10 @@ def plot_spatial_histogram(year, year_period, model,
         elif year>2008:
             return 'No data for given time period.'
                 
-    grid = load_var_grid(year, year_period, model, var)
+    cells = get_land_cells(model, year, year_period)
+    values = load_var_cells(year, year_period, model, var, cells=cells)
     if region != 0:
-        grid = get_regional_var_grid(year, year_period, region, 
-                                    model, var, reg_type)
+        values = values[get_region_cells(model, reg_type, cells) == region]
     
     if var == 'FC':
         title = 'Fuel Consumption'
@@ -775,7 +942,7 @@ def plot_spatial_histogram(year, year_period, model,
     
     # Not needed, removing 0 values flattens.
     #flat_grid = np.ndarray.flatten(grid)
-    flat_grid = grid[grid > 0]
+    flat_grid = values[values > 0]
     if var!='FC':
         flat_grid = np.divide(flat_grid, year_period)
     fig = plt.figure()
@@ -819,6 +986,10 @@ def plot_multimodel_box(year, year_period, var='FC',
     NHAF, SHAF, BOAS, CEAS, SEAS, EQAS, AUST respectively.
     For details regarding the GFED regions, go to 
     http://www.globalfiredata.org/data.html.
+    
+    Emissions and burnt area are given per m^2 and per year, as in
+    the axis label, both for all the models and for the regions of
+    a single model, and in every region.
     """
     if reg_type=='boxes':
         region_names = ['Global','BONA','TENA','EQCSA','SOMA','NOEU',
@@ -847,22 +1018,29 @@ def plot_multimodel_box(year, year_period, var='FC',
         x_labels = model_names
         title_end = region_names[region]
         for model_name in model_list:
-            grid = load_var_grid(year, year_period, model_name, var)
+            cells = get_land_cells(model_name, year, year_period)
+            values = load_var_cells(year, year_period, model_name, var,
+                                    cells=cells)
             if region != 0:
-                grid = get_regional_var_grid(year, year_period, 
-                                       region, model_name, var, reg_type)
-            flat_grid = grid[grid > 0]
+                values = values[get_region_cells(model_name, reg_type,
+                                                 cells) == region]
+            flat_grid = values[values > 0]
             if var!='FC':
                 flat_grid = np.divide(flat_grid, year_period)
             data.append(flat_grid)
     else:
         x_labels = region_names
         title_end = model.upper()
-        grid_list = get_regional_var_grid(year, year_period, 
-                              region, model, var, reg_type,
-                              all_regions=True)
-        for grid in grid_list:
-            flat_grid = grid[grid > 0]
+        cells = get_land_cells(model, year, year_period)
+        values = load_var_cells(year, year_period, model, var, cells=cells)
+        region_data = get_region_cells(model, reg_type, cells)
+        for region in range(len(region_names)):
+            # Select the cells of each region directly, rather
+            # than building a masked copy of the grid.
+            if region == 0:
+                flat_grid = values[values > 0]
+            else:
+                flat_grid = values[(region_data == region) & (values > 0)]
             if var!='FC':
                 flat_grid = np.divide(flat_grid, year_period)
             data.append(flat_grid)
@@ -910,15 +1088,24 @@ def interp_GFED_func(lons, lats, var, year, year_period, method):
     more information on the use of the function.
     """
     GFED_data = load_var_grid(year,year_period,'gfed',var)
-    
-    
-    lats_gfed = np.arange(-89.875, 90.,0.25)
-    lons_gfed = np.arange(-179.875, 180.,0.25)
-    lons_gfed, lats_gfed = np.meshgrid(lons_gfed, lats_gfed)
-    
-    new_grid = intrplt.griddata((lons_gfed.ravel(),lats_gfed.ravel()), 
-                  GFED_data.ravel(), (lons,lats), method=method)
-    return new_grid
+    lons_gfed, lats_gfed = get_lons_lats('gfed')
+    return interp_grid(GFED_data, lons_gfed, lats_gfed, lons, lats, method)
+
+
+def interp_grid(grid, src_lons, src_lats, lons, lats, method):
+    """
+    Interpolates the grid given on the regular grid of the 1-D
+    src_lons and src_lats arrays to the points given by the lons
+    and lats arrays. Nearest neighbour and linear interpolation,
+    and conservative remapping, use the cached weights of the
+    regrid module, and any other method falls back to
+    scipy.interpolate.griddata.
+    """
+    if method in regrid.METHODS:
+        return regrid.regrid(grid, src_lons, src_lats, lons, lats, method)
+    src_lons, src_lats = np.meshgrid(src_lons, src_lats)
+    return intrplt.griddata((src_lons.ravel(),src_lats.ravel()),
+                  np.ravel(grid), (lons,lats), method=method)
 
 
 def interp_GFED_grid(year, year_period, model, var='FC',
@@ -942,6 +1129,12 @@ def interp_GFED_grid(year, year_period, model, var='FC',
     nearest neighbour, as it is the fastest and simplest, without
     too much loss in accuracy.
     
+    Method 'conservative' takes the area-weighted mean of the GFED
+    cells overlapping each model cell instead, which keeps the
+    totals when going to a coarser grid. It is only meant for
+    emissions and burnt area, not for fuel consumption, which is
+    per unit of burnt area rather than of grid area.
+    
     Argument plot can be set to True to show map of interpolated
     data, useful for checks.
     """
@@ -966,6 +1159,34 @@ def interp_GFED_grid(year, year_period, model, var='FC',
     else:
         return new_grid
 
+
+def get_comparison_cells(year, year_period, model, method='nearest'):
+    """
+    Returns the layout of the grid of the given model holding both
+    its own cells (see get_land_cells) and the cells that the GFED
+    grid interpolated with the given method can make non-zero, so
+    that both grids are zero in every other cell.
+    """
+    GFED_targets = get_interp_targets('gfed',
+                            get_land_cells('gfed', year, year_period),
+                            model, method)
+    return get_land_cells(model, year, year_period).union(GFED_targets)
+
+
+def interp_GFED_cells(year, year_period, model, cells, var='FC',
+                      method='nearest'):
+    """
+    Returns the GFED grid of interp_GFED_grid, compressed with the
+    given layout of the grid of the model, e.g. from
+    get_comparison_cells. Only the GFED cells that burn during the
+    period are interpolated.
+    """
+    GFED_cells = get_land_cells('gfed', year, year_period)
+    GFED_values = load_var_cells(year, year_period, 'gfed', var,
+                                 cells=GFED_cells)
+    return interp_cells(GFED_values, 'gfed', GFED_cells, model, cells, method)
+
+
 def calc_spatial_correlation(year, year_period, model, var):
     """
     Calculates the Pearson correlation between a model and
@@ -974,23 +1195,25 @@ def calc_spatial_correlation(year, year_period, model, var):
     Function is used in get_spacial_correlations to get table
     of correlations for all models. See its associated docstring
     for more information.
+    
+    Both grids are compressed with the layout of
+    get_comparison_cells, and the cells left out, where both are
+    zero, are accounted for by land_cells.pearsonr.
     """
-    GFED_grid = interp_GFED_grid(year,year_period,model,var)
-    model_grid = load_var_grid(year,year_period,model,var)
+    cells = get_comparison_cells(year, year_period, model)
+    GFED_values = interp_GFED_cells(year,year_period,model,cells,var)
+    model_values = load_var_cells(year,year_period,model,var,cells=cells)
     
     # Exception for MC2, goes up to 2008.
     if model=='mc2':
         lst_yr = year+year_period
         if lst_yr > 2008 and year<=2008:
-            model_grid = np.divide(model_grid, 2008-year+1)
-            GFED_grid = np.divide(GFED_grid, year_period)
+            model_values = np.divide(model_values, 2008-year+1)
+            GFED_values = np.divide(GFED_values, year_period)
         elif year>2008:
             return 'No data for given time period.'
     
-    GFED_flat = GFED_grid.flatten()
-    model_flat = model_grid.flatten()
-    
-    pearson = stats.pearsonr(GFED_flat, model_flat)
+    pearson = land_cells.pearsonr(GFED_values, model_values, cells.size)
     return pearson
     
     
@@ -1031,7 +1254,7 @@ def get_spatial_correlations(year, year_period, var):
 
 
 def plot_diff_map(year, year_period, model, var, 
-                    binned=True, save=False):
+                    binned=True, method=None, save=False):
     """
     Plots a map of the relative difference of the given model
     with GFED for a given variable.
@@ -1051,42 +1274,33 @@ def plot_diff_map(year, year_period, model, var,
     it will arrange the colorbar and colormap automatically.
     It is suggested that bins are used for standardised maps
     and easier comparison.
+    
+    Argument method is the method used to take GFED to the model's
+    grid, see interp_GFED_grid. Default is conservative remapping,
+    which keeps the GFED totals, for emissions and burnt area, and
+    linear interpolation for fuel consumption, which is per unit of
+    burnt area and would be biased low by averaging in unburnt cells.
     """
     # Ignore division by zero warning. Returns NaN.
     np.seterr(divide='ignore')
     
-    GFED_grid = interp_GFED_grid(year,year_period,model,var,
-                                 method='linear')
-    GFED_grid = np.array(GFED_grid)
-    model_grid = load_var_grid(year,year_period,model,var)
-    model_grid = np.array(model_grid)
+    if method is None:
+        method = 'linear' if var == 'FC' else 'conservative'
+    
+    cells = get_comparison_cells(year, year_period, model, method)
+    GFED_values = interp_GFED_cells(year,year_period,model,cells,var,
+                                    method=method)
+    GFED_values = np.array(GFED_values)
+    model_values = load_var_cells(year,year_period,model,var,cells=cells)
+    model_values = np.array(model_values)
     
-    diff_grid = np.divide(model_grid-GFED_grid,GFED_grid)
-    diff_grid = np.multiply(diff_grid, 100)
+    diff_values = np.divide(model_values-GFED_values,GFED_values)
+    diff_values = np.multiply(diff_values, 100)
     
     if binned:
-        ticks=[-100,-50,0,50,100,150,200,300,'>500']
-        bounds=[-120,-60,0,20,40,60,80,100,120]
-        for index,value in np.ndenumerate(diff_grid):
-            bin = 'nan'
-            if -100<=value<-50:
-                bin = bounds[0]
-            elif -50<=value<0:
-                bin = bounds[1]
-            elif 0<=value<50:
-                bin = bounds[2]
-            elif 50<=value<100:
-                bin = bounds[3]
-            elif 100<=value<150:
-                bin = bounds[4]
-            elif 150<=value<200:
-                bin = bounds[5]
-            elif 200<=value<300:
-                bin = bounds[6]
-            elif 300<=value:
-                bin = bounds[7]
-            if bin != 'nan':    
-                diff_grid[index] = bin
+        diff_values, ticks, bounds = bin_grid(diff_values, 'diff', var)
+    # Both grids are zero in the cells left out, i.e. NaN differences.
+    diff_grid = cells.expand(diff_values, fill=np.nan)
     
     fig=plt.figure(figsize=(14,10))
     m = Basemap(llcrnrlon=-180,llcrnrlat=-90, 
@@ -1123,23 +1337,26 @@ def interp_std_func(model, var, year, year_period,
     """
     model_data = load_var_grid(year,year_period,model,var)
     lons, lats = get_lons_lats(model)
-      
-    lons, lats = np.meshgrid(lons, lats)
-    
-    if ref_grid=='ctem':
-        lats_ref = ctem.grid_CTEM["lat"]
-        lons_ref = ctem.grid_CTEM["lon"]
-        lons_ref = np.array(lons_ref) - np.max(lons_ref)/2.
-    
-    if ref_grid=='gfed':
-        lats_ref = np.arange(-89.875, 90.,0.25)
-        lons_ref = np.arange(-179.875, 180.,0.25)
     
+    lons_ref, lats_ref = get_lons_lats(ref_grid)
     lons_ref, lats_ref = np.meshgrid(lons_ref, lats_ref)
     
-    new_grid = intrplt.griddata((lons.ravel(),lats.ravel()), 
-                  model_data.ravel(), (lons_ref,lats_ref), method=method)
+    new_grid = interp_grid(model_data, lons, lats, lons_ref, lats_ref, method)
     return new_grid
+
+
+def interp_std_cells(model, var, year, year_period, method, ref_grid, cells):
+    """
+    Returns the grid of interp_std_func compressed with the given
+    layout of the grid of ref_grid, which should hold the cells of
+    get_interp_targets for the model. Only the cells of the model
+    that burn during the period are interpolated.
+    """
+    model_cells = get_land_cells(model, year, year_period)
+    model_values = load_var_cells(year, year_period, model, var,
+                                  cells=model_cells)
+    return interp_cells(model_values, model, model_cells, ref_grid, cells,
+                        method)
     
     
 def plot_std_map(year, year_period, var='FC', method='nearest',
@@ -1148,18 +1365,31 @@ def plot_std_map(year, year_period, var='FC', method='nearest',
                     'orchidee', 'inferno','ctem',
                     'spitfire', 'mc2','globfirm']
     grid_list = []
+    cells = None
     if ref_grid=='gfed':
         print 'Using GFED resolution.'
     if ref_grid=='ctem':
         print 'Using CTEM resolution.'
         model_list=model_list[:-1]
-        model_grid = load_var_grid(year,year_period,'ctem',var)
+        cells = get_land_cells('ctem', year, year_period)
+    
+    # Every model is zero outside the cells of the layout.
+    for model in model_list:
+        targets = get_interp_targets(model,
+                                     get_land_cells(model, year, year_period),
+                                     ref_grid, method)
+        if cells is None:
+            cells = targets
+        else:
+            cells = cells.union(targets)
+    if ref_grid=='ctem':
+        model_grid = load_var_cells(year,year_period,'ctem',var,cells=cells)
         model_grid = np.array(model_grid)
         grid_list.append(model_grid)
     
     for model in model_list:
-        model_grid=interp_std_func(model, var, year, year_period, 
-                                      method, ref_grid)
+        model_grid=interp_std_cells(model, var, year, year_period, 
+                                      method, ref_grid, cells)
         model_grid = np.array(model_grid)
         if var != 'FC':
             # Exception for MC2, goes up to 2008.
@@ -1174,96 +1404,25 @@ def plot_std_map(year, year_period, var='FC', method='nearest',
         grid_list.append(model_grid)
         
     grid_list = np.array(grid_list)
-    std_grid = np.std(grid_list, axis=0)
-    std_grid[std_grid==0]=np.nan
+    std_values = np.std(grid_list, axis=0)
+    std_values[std_values==0]=np.nan
 
     
     
     if var == 'FC':
         title = 'Fuel Consumption'
         units = '($kg\, C\, m^{-2}\, burned$)'
-        if binned:
-            ticks=[0,0.1,0.5,1,2,3,4,5,10,'>20.0']
-            bounds=[0,1,2,3,4,5,6,7,8,9]
-            for index,value in np.ndenumerate(std_grid):
-                bin = 'nan'
-                if 0.<value<0.1:
-                    bin = 0
-                elif 0.1<=value<0.5:
-                    bin = 1
-                elif 0.5<=value<1:
-                    bin = 2
-                elif 1<=value<2:
-                    bin = 3
-                elif 2<=value<3:
-                    bin = 4
-                elif 3<=value<4:
-                    bin = 5
-                elif 4<=value<5:
-                    bin = 6
-                elif 5<=value<10:
-                    bin = 7
-                elif 10<=value:
-                    bin = 8
-                if bin != 'nan':    
-                    std_grid[index] = bin
     elif var == 'emis':
         title = 'Carbon Emissions'
         units = '($kg\, C\, m^{-2} \, year^{-1}$)'
-        if binned:
-            ticks=[0,0.01,0.05,0.1,0.15,0.2,0.25,0.3,0.35,'>0.4']
-            bounds=[0,1,2,3,4,5,6,7,8,9]
-            for index,value in np.ndenumerate(std_grid):
-                bin = 'nan'
-                if 0.<value<0.01:
-                    bin = 0
-                elif 0.01<=value<0.05:
-                    bin = 1
-                elif 0.05<=value<0.1:
-                    bin = 2
-                elif 0.1<=value<0.15:
-                    bin = 3
-                elif 0.15<=value<0.2:
-                    bin = 4
-                elif 0.2<=value<0.25:
-                    bin = 5
-                elif 0.25<=value<0.3:
-                    bin = 6
-                elif 0.35<=value<0.4:
-                    bin = 7
-                elif 0.4<=value:
-                    bin = 8
-                if bin != 'nan':
-                    std_grid[index] = bin
     elif var == 'BA':
         title = 'Burnt Area'
         # Due to recurring fires in <year, not normalised.
         units = '(Fraction Burned per Year)'
-        if binned:
-            ticks=[0,0.01,0.05,0.1,0.2,0.3,0.5,0.7,1,'>2.0']
-            bounds=[0,1,2,3,4,5,6,7,8,9]
-            for index,value in np.ndenumerate(std_grid):
-                bin = 'nan'
-                if 0.<value<0.01:
-                    bin = 0
-                elif 0.01<=value<0.05:
-                    bin = 1
-                elif 0.05<=value<0.1:
-                    bin = 2
-                elif 0.1<=value<0.2:
-                    bin = 3
-                elif 0.2<=value<0.3:
-                    bin = 4
-                elif 0.3<=value<0.5:
-                    bin = 5
-                elif 0.5<=value<0.7:
-                    bin = 6
-                elif 0.7<=value<1.:
-                    bin = 7
-                elif 1.<=value:
-                    bin = 8
-                if bin != 'nan':
-                    std_grid[index] = bin
+    if binned:
+        std_values, ticks, bounds = bin_grid(std_values, 'std', var)
+    # Every model is zero in the cells left out, i.e. NaN deviations.
+    std_grid = cells.expand(std_values, fill=np.nan)
         
     fig=plt.figure(figsize=(14,10))
     m = Basemap(llcrnrlon=-180,llcrnrlat=-90, 
@@ -1,36 +1,51 @@
-from netCDF4 import Dataset
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap, cm
 
+import data_registry as registry
+import grid_ops
 
-emis_SPITFIRE = Dataset('../../model_data/LPJ-GUESS-SPITFIRE_SF1_fFirepft.nc', 
-                'r', format = 'NETCDF4')
-BA_SPITFIRE = Dataset('../../model_data/LPJ-GUESS-SPITFIRE_SF1_burntArea.nc', 
-                'r', format = 'NETCDF4')            
-grid_SPITFIRE = Dataset('../../model_data/HalfDegree-gridarea-8975.nc', 
-                    'r', format = 'NETCDF4')                   
+emis_SPITFIRE = registry.get_dataset('spitfire', 'emis_SPITFIRE')
+BA_SPITFIRE = registry.get_dataset('spitfire', 'BA_SPITFIRE')
+grid_SPITFIRE = registry.get_dataset('spitfire', 'grid_SPITFIRE')
+
+
+#
+# Static Grid Data
+#
+
+def get_cell_area(grid_data=grid_SPITFIRE):
+    """
+    Returns the cached cell areas of the SPITFIRE grid.
+    """
+    return registry.get_static_field(grid_data, "cell_area",
+                                     dtype=grid_ops.get_dtype())
 
 
 #
 # Burnt Area Analysis
 #
 
-def get_grid_burnt_area(year, month_period, BA_data, grid_data, keep_time=False):
-    BA = BA_data["burntArea"][year*12:year*12+month_period]
+def get_monthly_burnt_area(time, month_period, BA_data, grid_data):
+    BA = grid_ops.to_precision(BA_data["burntArea"][time:time+month_period])
     
     BA = np.sum(BA, axis=1)
     BA = np.divide(BA, 100.)
-    BA = np.multiply(BA, grid_data["cell_area"])
-    
+    BA = np.multiply(BA, get_cell_area(grid_data))
+    return BA
+
+def get_grid_burnt_area(year, month_period, BA_data, grid_data,
+                        keep_time=False, chunk=None):
+    time = int(year*12)
     if keep_time:
-        return BA
-    BA = np.sum(BA, axis=0)
+        return get_monthly_burnt_area(time, month_period, BA_data, grid_data)
+    BA = grid_ops.sum_over_time(get_monthly_burnt_area, time, month_period,
+                                chunk, BA_data, grid_data)
     return BA
     
 def get_global_BA_yearly(year, BA_data, grid_data):
     BA_grid = get_grid_burnt_area(year, 12, BA_data, grid_data)
-    burnt_area = np.sum(BA_grid)
+    burnt_area = np.sum(BA_grid, dtype="float64")
     return burnt_area
 
 
@@ -39,30 +54,34 @@ def get_global_BA_yearly(year, BA_data, grid_data):
 #
 
 
-def get_grid_emissions(year, month_period, emis_data, grid_data, keep_time=False):
-    time = int(year*12)
-    
+def get_monthly_emissions(time, month_period, emis_data, grid_data):
     # Original output is in 'per month' units, so using
     # exact conversion unit to get correct results.
     sec_per_month = 1/0.000000388024691
     
-    # Ignore overflow warning.
-    np.seterr(over='ignore')
-    
-    
-    emis = emis_data["fFirepft"][time:time+month_period]
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
      
     emis = np.sum(emis, axis=1) 
-    emis = np.multiply(emis, grid_data["cell_area"])
+    emis = np.multiply(emis, get_cell_area(grid_data))
     emis = np.multiply(emis, sec_per_month)
+    return emis
+
+def get_grid_emissions(year, month_period, emis_data, grid_data,
+                       keep_time=False, chunk=None):
+    time = int(year*12)
+    
+    # Ignore overflow warning.
+    np.seterr(over='ignore')
+    
     if keep_time:
-        return emis
-    emis = np.sum(emis, axis = 0)
+        return get_monthly_emissions(time, month_period, emis_data, grid_data)
+    emis = grid_ops.sum_over_time(get_monthly_emissions, time, month_period,
+                                  chunk, emis_data, grid_data)
     return emis
 
 def get_global_emissions_yearly(year, emis_data, grid_data):
     emissions_grid = get_grid_emissions(year, 12, emis_data, grid_data)
-    emissions = np.sum(emissions_grid)
+    emissions = np.sum(emissions_grid, dtype="float64")
     return emissions
 
 
@@ -70,44 +89,62 @@ def get_global_emissions_yearly(year, emis_data, grid_data):
 # Fuel Consumption Analysis
 #
 
-def get_grid_fuel_consumption(year, month_period, emis_data,
-                 BA_data, monthly=False):
-    time = int(year*12)
-    
+def get_monthly_fire_data(time, month_period, emis_data, BA_data):
+    """
+    Returns the monthly emissions and burnt area used for the
+    fuel consumption, per unit area and summed over the pfts.
+    """
     # Original output is in 'per month' units, so using
     # exact conversion unit to get correct results.
     sec_per_month = 1/0.000000388024691
     
-    # Ignore division by zero warning. Returns NaN.
-    np.seterr(divide='ignore')
-    
-    BA = BA_data["burntArea"][time:time+month_period]
+    BA = grid_ops.to_precision(BA_data["burntArea"][time:time+month_period])
     BA = np.sum(BA, axis=1)
     BA = np.divide(BA, 100.)
     BA = np.array(BA)
-    if not monthly:
-        BA = np.sum(BA, axis=0)
+    
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    emis = np.sum(emis, axis=1)
+    emis = np.multiply(emis, sec_per_month)
+    return emis, BA
+
+def calc_fuel_consumption(emis, BA, monthly=False):
+    """
+    Returns the fuel consumption from the emissions and burnt
+    area, either summed over time or monthly, in which case the
+    monthly fuel consumption is summed.
+    """
     inv_BA = 1./BA
     # Remove infinities due to division by 0.
     inv_BA[inv_BA == np.inf] = 0
     
-    emis = emis_data["fFirepft"][time:time+month_period]
-    emis = np.sum(emis, axis=1)
-    emis = np.multiply(emis, sec_per_month)
-    if not monthly:
-        emis = np.sum(emis, axis=0)
-        
     fuel_consumption = np.multiply(emis,inv_BA)
     if monthly:
         fuel_consumption = np.nansum(fuel_consumption, axis = 0)
     return fuel_consumption
 
+def get_grid_fuel_consumption(year, month_period, emis_data,
+                 BA_data, monthly=False, chunk=None):
+    time = int(year*12)
+    
+    # Ignore division by zero warning. Returns NaN.
+    np.seterr(divide='ignore')
+    
+    if monthly:
+        return grid_ops.accumulate(lambda start, count: calc_fuel_consumption(
+                    *get_monthly_fire_data(start, count, emis_data, BA_data),
+                    monthly=True), time, month_period, chunk)
+    emis, BA = grid_ops.sum_over_time(get_monthly_fire_data, time,
+                                      month_period, chunk, emis_data, BA_data)
+    fuel_consumption = calc_fuel_consumption(emis, BA)
+    return fuel_consumption
+
     
 def get_global_mean_FC_yearly(year, emis_data, BA_data, grid_data):
     time = int(year*12)   
     FC_data = get_grid_fuel_consumption(year,12,emis_data, BA_data)
     #Taking the weighted average of fuel consumption.
-    global_mean_FC = np.average(FC_data, weights=grid_data["cell_area"])
+    global_mean_FC = np.average(FC_data, weights=get_cell_area(grid_data))
     return global_mean_FC 
     
     
@@ -117,3 +154,48 @@ def get_global_mean_FC_yearly_rough(year, emis_data, BA_data, grid_data):
     global_mean_FC = total_emis/total_BA
     return global_mean_FC
 
+
+#
+# Fire Budget
+#
+
+def get_monthly_fire_budget(time, month_period, emis_data, BA_data,
+                            grid_data):
+    """
+    Returns the monthly emissions and burnt area grids, and the
+    monthly emissions and burnt area per unit area used for the
+    fuel consumption, reading each input only once.
+    """
+    # Original output is in 'per month' units, so using
+    # exact conversion unit to get correct results.
+    sec_per_month = 1/0.000000388024691
+    cell_area = get_cell_area(grid_data)
+    
+    BA = grid_ops.to_precision(BA_data["burntArea"][time:time+month_period])
+    BA = np.sum(BA, axis=1)
+    BA = np.divide(BA, 100.)
+    BA_grid = np.multiply(BA, cell_area)
+    BA = np.array(BA)
+    
+    emis = grid_ops.to_precision(emis_data["fFirepft"][time:time+month_period])
+    emis = np.sum(emis, axis=1)
+    emis_grid = np.multiply(emis, cell_area)
+    emis_grid = np.multiply(emis_grid, sec_per_month)
+    emis = np.multiply(emis, sec_per_month)
+    return emis_grid, BA_grid, emis, BA
+
+def get_fire_budget(year, month_period, emis_data, BA_data, grid_data,
+                    keep_time=False, monthly=False, chunk=None):
+    """
+    Returns the emissions, burnt area and fuel consumption grids
+    as (emis, BA, FC), reading each input only once. See
+    grid_ops.fire_budget for the keep_time and monthly arguments.
+    """
+    time = int(year*12)
+    
+    # Ignore division by zero and overflow warnings.
+    np.seterr(divide='ignore', over='ignore')
+    
+    return grid_ops.fire_budget(get_monthly_fire_budget,
+                    calc_fuel_consumption, time, month_period, chunk,
+                    (emis_data, BA_data, grid_data), keep_time, monthly)
@@ -51,43 +51,32 @@ def plot_time_series(year, year_period, var, region=0, model='all',
     
     if var != 'FC':
         for model in model_list:
-            grid = spt.get_regional_var_grid(year,year_period,region,
-                                            model,var,per_area=False,
-                                            keep_time=True, 
-                                            all_regions=all_regions)
-            if all_regions:
-                yearly_data = np.sum(np.split(grid.sum(axis=2).sum(axis=2),
-                                    year_period,axis=1),axis=2)
-            else:
-                yearly_data = np.sum(np.split(grid.sum(axis=1).sum(axis=1),
-                                    year_period),axis=1)
+            # Totals of every region are taken in one pass over the grid.
+            sums = spt.get_regional_totals(year,year_period,model,var,
+                                           keep_time=True)
+            yearly_data = spt.get_yearly_totals(sums, year_period)
+            if not all_regions:
+                yearly_data = yearly_data[:,region]
             data_list.append(yearly_data)
             print(model.upper() + ' finished.')
             
     elif var == 'FC':
         for model in model_list:
-            emis_grid = spt.get_regional_var_grid(year,year_period,region,
-                                            model,'emis',per_area=False,
-                                            keep_time=True, 
-                                            all_regions=all_regions)
-            if all_regions:
-                emis_data = np.sum(np.split(emis_grid.sum(axis=2).sum(axis=2),
-                                        year_period,axis=1),axis=2)
-            else:
-                emis_data = np.sum(np.split(emis_grid.sum(axis=1).sum(axis=1),
-                                        year_period),axis=1)
-                                        
-            BA_grid = spt.get_regional_var_grid(year,year_period,region,
-                                            model,'BA',per_area=False,
-                                            keep_time=True, 
-                                            all_regions=all_regions)
-            if all_regions:
-                BA_data = np.sum(np.split(BA_grid.sum(axis=2).sum(axis=2),
-                                     year_period,axis=1),axis=2)
-            else:
-                BA_data = np.sum(np.split(BA_grid.sum(axis=1).sum(axis=1),
-                                     year_period),axis=1)
-            
+            # Emissions and burnt area are read together, and only
+            # the cells which burn in the period are kept.
+            emis_grid, BA_grid = spt.load_fire_series(year,year_period,model)
+            cells = spt.get_land_cells(model,year,year_period)
+            emis_grid = cells.compress(emis_grid)
+            BA_grid = cells.compress(BA_grid)
+            emis_sums = spt.get_regional_totals(year,year_period,model,
+                                            'emis',grid=emis_grid,cells=cells)
+            emis_data = spt.get_yearly_totals(emis_sums, year_period)
+            BA_sums = spt.get_regional_totals(year,year_period,model,
+                                            'BA',grid=BA_grid,cells=cells)
+            BA_data = spt.get_yearly_totals(BA_sums, year_period)
+            if not all_regions:
+                emis_data = emis_data[:,region]
+                BA_data = BA_data[:,region]
             
             yearly_data = np.divide(emis_data, BA_data)
             data_list.append(yearly_data)